@@ -3,7 +3,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from networks.layers.loss import Concat_CrossEntropyLoss
-from networks.layers.matching import global_matching, global_matching_for_eval, local_matching, foreground2background
+from networks.layers.matching import global_matching, global_matching_for_eval, local_matching, foreground2background, GlobalMatchingBank
 from networks.layers.attention import calculate_attention_head, calculate_attention_head_for_eval
 from networks.cfbi.ensembler import CollaborativeEnsembler, DynamicPreHead
 
@@ -76,7 +76,8 @@ class CFBI(nn.Module):
 
         return self.criterion(tmp_dic, label_dic, step), all_pred, boards
 
-    def forward_for_eval(self, ref_embeddings, ref_masks, prev_embedding, prev_mask, current_frame, pred_size, gt_ids):
+    def forward_for_eval(self, ref_embeddings, ref_masks, prev_embedding, prev_mask, current_frame, pred_size, gt_ids,
+                         global_banks=None):
         current_frame_embedding, current_low_level = self.extract_feature(current_frame)
         if prev_embedding is None:
             return None, current_frame_embedding
@@ -90,7 +91,8 @@ class CFBI(nn.Module):
                 prev_mask,
                 gt_ids,
                 current_low_level=current_low_level,
-                tf_board=False)
+                tf_board=False,
+                global_banks=global_banks)
             all_pred = []
             for i in range(bs):
                 pred = tmp_dic[i]
@@ -108,7 +110,7 @@ class CFBI(nn.Module):
     def before_seghead_process(self,
             ref_frame_embedding=None, previous_frame_embedding=None, current_frame_embedding=None,
             ref_frame_label=None, previous_frame_mask=None,
-            gt_ids=None, current_low_level=None, tf_board=False):
+            gt_ids=None, current_low_level=None, tf_board=False, global_banks=None):
 
         cfg = self.cfg
         
@@ -181,7 +183,8 @@ class CFBI(nn.Module):
                     n_chunks=cfg.TEST_GLOBAL_CHUNKS,
                     dis_bias=dis_bias, 
                     atrous_rate=cfg.TEST_GLOBAL_ATROUS_RATE,
-                    use_float16=cfg.MODEL_FLOAT16_MATCHING)
+                    use_float16=cfg.MODEL_FLOAT16_MATCHING,
+                    reference_bank=global_banks.setdefault(n, GlobalMatchingBank()) if global_banks is not None else None)
     
     
             #########################Local dist map
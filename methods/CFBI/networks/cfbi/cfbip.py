@@ -3,7 +3,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from networks.layers.loss import Concat_CrossEntropyLoss
-from networks.layers.matching import global_matching, global_matching_for_eval, local_matching, foreground2background
+from networks.layers.matching import global_matching, global_matching_for_eval, local_matching, foreground2background, GlobalMatchingBank
 from networks.layers.attention import calculate_attention_head, calculate_attention_head_for_eval
 from networks.layers.fpn import FPN
 from networks.cfbi.ensembler import CollaborativeEnsemblerMS
@@ -81,7 +81,7 @@ class CFBIP(nn.Module):
         return self.criterion(tmp_dic, label_dic, step), all_pred, boards
 
     def forward_for_eval(self, ref_embeddings, ref_masks, prev_embedding, prev_mask, current_frame,
-                         pred_size, gt_ids, is_flipped=False):
+                         pred_size, gt_ids, is_flipped=False, global_banks=None):
 
         current_frame_embedding_4x, current_frame_embedding_8x, current_frame_embedding_16x, current_low_level = self.extract_feature(current_frame)
         current_frame_embedding = [current_frame_embedding_4x, current_frame_embedding_8x, current_frame_embedding_16x]
@@ -98,7 +98,8 @@ class CFBIP(nn.Module):
                 prev_mask,
                 gt_ids, 
                 current_low_level=current_low_level,
-                tf_board=False)
+                tf_board=False,
+                global_banks=global_banks)
             all_pred = []
             for i in range(bs):
                 pred = tmp_dic[i]
@@ -121,7 +122,7 @@ class CFBIP(nn.Module):
     def before_seghead_process(self,
             ref_frame_embeddings=None, previous_frame_embeddings=None, current_frame_embeddings=None,
             ref_frame_labels=None, previous_frame_mask=None,
-            gt_ids=None, current_low_level=None, tf_board=False):
+            gt_ids=None, current_low_level=None, tf_board=False, global_banks=None):
 
         cfg = self.cfg
         
@@ -208,7 +209,8 @@ class CFBIP(nn.Module):
                         dis_bias=dis_bias,
                         atrous_rate=cfg.TEST_GLOBAL_ATROUS_RATE[scale_idx],
                         use_float16=cfg.MODEL_FLOAT16_MATCHING,
-                        atrous_obj_pixel_num=cfg.TEST_GLOBAL_MATCHING_MIN_PIXEL)
+                        atrous_obj_pixel_num=cfg.TEST_GLOBAL_MATCHING_MIN_PIXEL,
+                        reference_bank=global_banks.setdefault((n, scale_idx), GlobalMatchingBank()) if global_banks is not None else None)
 
         
                 #########################Local FG map
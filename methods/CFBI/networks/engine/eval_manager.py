@@ -185,6 +185,7 @@ class Evaluator(object):
             ref_masks = []
             prev_embedding = []
             prev_mask = []
+            global_banks = []
             with torch.no_grad():
                 for frame_idx, samples in enumerate(seq_dataloader):
                     time_start = time.time()
@@ -196,6 +197,7 @@ class Evaluator(object):
                             ref_masks.append([])
                             prev_embedding.append(None)
                             prev_mask.append(None)
+                            global_banks.append({})
 
                         sample = samples[aug_idx]
                         ref_emb = ref_embeddings[aug_idx]
@@ -217,7 +219,7 @@ class Evaluator(object):
                         obj_num = obj_num.cuda(self.gpu)
                         bs, _, h, w = current_img.size()
 
-                        all_pred, current_embedding = self.model.forward_for_eval(ref_emb, ref_m, prev_emb, prev_m, current_img, gt_ids=obj_num, pred_size=[ori_height,ori_width])
+                        all_pred, current_embedding = self.model.forward_for_eval(ref_emb, ref_m, prev_emb, prev_m, current_img, gt_ids=obj_num, pred_size=[ori_height,ori_width], global_banks=global_banks[aug_idx])
 
                         if frame_idx == 0:
                             if current_label is None:
@@ -279,6 +281,7 @@ class Evaluator(object):
                 del(ref_masks)
                 del(prev_embedding)
                 del(prev_mask)
+                del(global_banks)
                 del(seq_dataset)
                 del(seq_dataloader)
 
@@ -132,6 +132,119 @@ def _nearest_neighbor_features_per_object_in_chunks(
 
     return nn_features
 
+def _nearest_neighbor_features_per_object_streaming(
+    reference_bank, query_embeddings_flat, n_chunks):
+    """Calculates the nearest neighbor features per object against a GlobalMatchingBank.
+    The references in the bank are grouped by object, so the padded min of
+    _nn_features_per_object_for_chunk can be taken as
+        min(nearest reference of the object, nearest reference + WRONG_LABEL_PADDING_DISTANCE)
+    with running mins over reference chunks. The [m, n_objects, n] distance tensor
+    is never built.
+    Args:
+        reference_bank: A GlobalMatchingBank holding the flattened references.
+        query_embeddings_flat: [m, embedding_dim], 
+          the embedding vectors for the query frames.
+        n_chunks: Integer, the number of query chunks to use to save memory
+          (set to 1 for no chunking).
+    Returns:
+        nn_features: [m, n_objects, 1].
+    """
+    feature_dim, embedding_dim = query_embeddings_flat.size()
+    chunk_size = int(np.ceil(float(feature_dim) / n_chunks))
+    ref_chunk_size = reference_bank.ref_chunk_size
+    query_square = query_embeddings_flat.pow(2).sum(1)
+
+    all_features = []
+    for chunk_start in range(0, feature_dim, chunk_size):
+        query_embeddings_flat_chunk = query_embeddings_flat[chunk_start:chunk_start + chunk_size]
+        query_square_chunk = query_square[chunk_start:chunk_start + chunk_size]
+        m = query_square_chunk.size(0)
+        obj_dists = query_square_chunk.new_full((m, reference_bank.obj_nums), float('inf'))
+        all_dists = query_square_chunk.new_full((m, ), float('inf'))
+        for reference_embeddings_flat, ref_square, obj_counts in zip(
+                reference_bank.embeddings, reference_bank.squares, reference_bank.obj_counts):
+            obj_start = 0
+            for obj_idx, obj_count in enumerate(obj_counts):
+                for ref_start in range(obj_start, obj_start + obj_count, ref_chunk_size):
+                    ref_end = min(ref_start + ref_chunk_size, obj_start + obj_count)
+                    dists = _flattened_pairwise_distances(
+                        reference_embeddings_flat[ref_start:ref_end], ref_square[ref_start:ref_end],
+                        query_embeddings_flat_chunk, query_square_chunk)
+                    dists, _ = torch.min(dists, 1)
+                    torch.min(obj_dists[:, obj_idx], dists, out=obj_dists[:, obj_idx])
+                    torch.min(all_dists, dists, out=all_dists)
+                obj_start += obj_count
+        wrong_label_dists = all_dists + all_dists.new_tensor(WRONG_LABEL_PADDING_DISTANCE)
+        features = torch.min(obj_dists, wrong_label_dists.unsqueeze(1))
+        all_features.append(features.unsqueeze(2))
+    nn_features = torch.cat(all_features, dim=0)
+
+    return nn_features
+
+def _atrous_sample_reference(reference_embeddings, reference_labels, h, w, atrous_rate):
+    h_pad = (atrous_rate - h % atrous_rate) % atrous_rate
+    w_pad = (atrous_rate - w % atrous_rate) % atrous_rate
+    if h_pad > 0  or w_pad > 0:
+        reference_embeddings = F.pad(reference_embeddings, (0, 0, 0, w_pad, 0, h_pad))
+        reference_labels = F.pad(reference_labels, (0, 0, 0, w_pad, 0, h_pad))
+
+    reference_embeddings = reference_embeddings.view((h + h_pad) // atrous_rate, atrous_rate, 
+                                                     (w + w_pad) // atrous_rate, atrous_rate, -1)
+    reference_labels = reference_labels.view((h + h_pad) // atrous_rate, atrous_rate, 
+                                             (w + w_pad) // atrous_rate, atrous_rate, -1)
+    reference_embeddings = reference_embeddings[:, 0, :, 0, :].contiguous()
+    reference_labels = reference_labels[:, 0, :, 0, :].contiguous()
+    return reference_embeddings, reference_labels
+
+class GlobalMatchingBank(object):
+    """
+    The reference frames of one sequence for global_matching_for_eval.
+    Each reference frame is sampled, flattened, filtered, grouped by object and normed
+    once, when it is added, instead of on every query frame. Reference frames are never
+    changed after being added during evaluation, so update() only processes the new ones.
+    """
+    def __init__(self, ref_chunk_size=4096):
+        self.ref_chunk_size = ref_chunk_size
+        self.reset()
+
+    def reset(self, obj_nums=None):
+        self.obj_nums = obj_nums
+        self.ref_num = 0
+        self.embeddings = []
+        self.squares = []
+        self.obj_counts = []
+
+    def size(self):
+        return sum([ref_square.size(0) for ref_square in self.squares])
+
+    def update(self, all_reference_embeddings, all_reference_labels, atrous_rate=1, use_float16=True):
+        h, w, embedding_dim = all_reference_embeddings[0].size()
+        obj_nums = all_reference_labels[0].size(2)
+        if obj_nums != self.obj_nums or len(all_reference_labels) < self.ref_num:
+            self.reset(obj_nums)
+
+        for reference_embeddings, reference_labels in zip(
+                all_reference_embeddings[self.ref_num:], all_reference_labels[self.ref_num:]):
+            if atrous_rate > 1:
+                reference_embeddings, reference_labels = _atrous_sample_reference(
+                    reference_embeddings, reference_labels, h, w, atrous_rate)
+            reference_embeddings_flat = reference_embeddings.reshape(-1, embedding_dim)
+            reference_labels_flat = reference_labels.reshape(-1, obj_nums)
+
+            # the labels are one-hot, so every kept pixel belongs to exactly one object
+            ref_fg = torch.sum(reference_labels_flat, dim=1) > 0.9
+            reference_embeddings_flat = reference_embeddings_flat[ref_fg]
+            ref_obj_ids = torch.argmax(reference_labels_flat[ref_fg], dim=1)
+            ref_obj_ids, order = torch.sort(ref_obj_ids, stable=True)
+            reference_embeddings_flat = reference_embeddings_flat[order]
+            if use_float16:
+                reference_embeddings_flat = reference_embeddings_flat.half()
+
+            self.embeddings.append(reference_embeddings_flat)
+            self.squares.append(reference_embeddings_flat.pow(2).sum(1))
+            self.obj_counts.append(torch.bincount(ref_obj_ids, minlength=obj_nums).tolist())
+        self.ref_num = len(all_reference_labels)
+
 
 def global_matching(
     reference_embeddings, query_embeddings, reference_labels,
@@ -207,7 +320,8 @@ def global_matching(
 
 def global_matching_for_eval(
     all_reference_embeddings, query_embeddings, all_reference_labels,
-    n_chunks=20, dis_bias=0., ori_size=None, atrous_rate=1, use_float16=True, atrous_obj_pixel_num=0):
+    n_chunks=20, dis_bias=0., ori_size=None, atrous_rate=1, use_float16=True, atrous_obj_pixel_num=0,
+    reference_bank=None):
     """
     Calculates the distance to the nearest neighbor per object.
     For every pixel of query_embeddings calculate the distance to the
@@ -228,12 +342,26 @@ def global_matching_for_eval(
           the original spatial size. If "None", (ori_height, ori_width) = (height, width).
         atrous_rate: Integer, the atrous rate of reference_embeddings.
         use_float16: Bool, if "True", use float16 type for matching.
+        reference_bank: A GlobalMatchingBank of the sequence. If given, the references
+          are cached in it across frames and matched chunk by chunk with a running min.
+          Not used with atrous_obj_pixel_num > 0.
     Returns:
         nn_features: [n_query_images, ori_height, ori_width, n_objects, feature_dim].
     """
     
     h, w, embedding_dim = query_embeddings.size()
     obj_nums = all_reference_labels[0].size(2)
+    if reference_bank is not None and atrous_obj_pixel_num == 0:
+        reference_bank.update(all_reference_embeddings, all_reference_labels, atrous_rate, use_float16)
+        if reference_bank.size() == 0:
+            return torch.ones(1, h, w, obj_nums, 1, device=query_embeddings.device)
+        query_embeddings_flat = query_embeddings.view(-1, embedding_dim)
+        if use_float16:
+            query_embeddings_flat = query_embeddings_flat.half()
+        nn_features = _nearest_neighbor_features_per_object_streaming(
+            reference_bank, query_embeddings_flat, n_chunks)
+        return _global_matching_output(nn_features, h, w, obj_nums, dis_bias, ori_size, use_float16)
+
     all_reference_embeddings_flat = []
     all_reference_labels_flat = []
     ref_num = len(all_reference_labels)
@@ -326,6 +454,9 @@ def global_matching_for_eval(
     nn_features = _nearest_neighbor_features_per_object_in_chunks(
         reference_embeddings_flat, query_embeddings_flat, reference_labels_flat, n_chunks)
 
+    return _global_matching_output(nn_features, h, w, obj_nums, dis_bias, ori_size, use_float16)
+
+def _global_matching_output(nn_features, h, w, obj_nums, dis_bias, ori_size, use_float16):
     nn_features_reshape = nn_features.view(1, h, w, obj_nums, 1)
     nn_features_reshape = (torch.sigmoid(nn_features_reshape + dis_bias.view(1, 1, 1, -1, 1)) - 0.5) * 2
 
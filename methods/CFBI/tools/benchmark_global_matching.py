@@ -0,0 +1,95 @@
+import sys
+import time
+import resource
+import argparse
+import multiprocessing as mp
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+
+from networks.layers.matching import global_matching_for_eval, GlobalMatchingBank
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def synthetic_frame(args, generator):
+    h, w = args.size
+    embedding = torch.randn(h, w, args.embedding_dim, generator=generator)
+    label = torch.randint(0, args.obj_num, (h, w), generator=generator)
+    label = (label.unsqueeze(-1) == torch.arange(args.obj_num)).float()
+    return embedding, label
+
+
+def run_case(args, ref_num, use_bank, result_queue):
+    torch.set_num_threads(args.threads)
+    generator = torch.Generator().manual_seed(0)
+    all_reference_embeddings, all_reference_labels = [], []
+    for _ in range(ref_num):
+        embedding, label = synthetic_frame(args, generator)
+        all_reference_embeddings.append(embedding)
+        all_reference_labels.append(label)
+    queries = [synthetic_frame(args, generator)[0] for _ in range(args.frames)]
+    dis_bias = torch.zeros(args.obj_num)
+    reference_bank = GlobalMatchingBank(args.ref_chunk_size) if use_bank else None
+
+    base_rss = _peak_rss_mb()
+    latency = 0.
+    with torch.no_grad():
+        for query_embeddings in queries:
+            start = time.perf_counter()
+            out = global_matching_for_eval(
+                all_reference_embeddings, query_embeddings, all_reference_labels,
+                n_chunks=args.chunks, dis_bias=dis_bias, atrous_rate=args.atrous_rate,
+                use_float16=args.float16, reference_bank=reference_bank)
+            latency += time.perf_counter() - start
+
+    result_queue.put({
+        'latency_ms': latency / args.frames * 1e3,
+        'peak_rss_mb': _peak_rss_mb() - base_rss,
+        'out': out.numpy(),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark CFBI global matching at eval time on CPU")
+    parser.add_argument('--refs', nargs='+', type=int, default=[1, 5, 20])
+    parser.add_argument('--size', nargs=2, type=int, default=[60, 108])
+    parser.add_argument('--embedding_dim', type=int, default=100)
+    parser.add_argument('--obj_num', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=5)
+    parser.add_argument('--chunks', type=int, default=4)
+    parser.add_argument('--ref_chunk_size', type=int, default=4096)
+    parser.add_argument('--atrous_rate', type=int, default=2)
+    parser.add_argument('--float16', action='store_true')
+    parser.set_defaults(float16=False)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    print('{:>5} {:>6} {:>12} {:>12} {:>12}'.format(
+        'refs', 'path', 'ms/frame', 'peak RSS MB', 'max abs err'))
+    for ref_num in args.refs:
+        outs = []
+        for use_bank in [False, True]:
+            result_queue = ctx.Queue()
+            # A fresh process per case keeps the peak RSS numbers apart.
+            proc = ctx.Process(target=run_case,
+                               args=(args, ref_num, use_bank, result_queue))
+            proc.start()
+            result = result_queue.get()
+            proc.join()
+            outs.append(result['out'])
+            err = abs(outs[0] - result['out']).max()
+            print('{:>5} {:>6} {:>12.1f} {:>12.1f} {:>12.2e}'.format(
+                ref_num, 'bank' if use_bank else 'cat', result['latency_ms'],
+                result['peak_rss_mb'], err))
+        assert (outs[0] == outs[1]).all(), 'bank matching does not match'
+
+
+if __name__ == '__main__':
+    main()
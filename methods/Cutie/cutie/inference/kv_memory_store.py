@@ -3,14 +3,116 @@ from collections import defaultdict
 import torch
 
 
-def _add_last_dim(dictionary, key, new_value, prepend=False):
-    # append/prepend a new value to the last dimension of a tensor in a dictionary
+class _LastDimBuffer:
+    """
+    Preallocated storage that grows along the last dimension.
+    The valid elements are buffer[..., start:end] so readers always get a contiguous view.
+    Removing elements at either end only moves a pointer; the freed slots at the front are
+    reclaimed by compacting once the back is full and enough of the buffer is free.
+    With n_major, a ...*C*N buffer is laid out ...*N*C in memory: the views keep their shape and
+    view().transpose(-1, -2) is contiguous, as the top-k readout wants for the values.
+    """
+    def __init__(self, value: torch.Tensor, compact_ratio: float = 0.5, n_major: bool = False):
+        self.n_major = n_major
+        self.buffer = self._new_empty(value, value.shape)
+        self.buffer.copy_(value)
+        self.start = 0
+        self.end = value.shape[-1]
+        self.compact_ratio = compact_ratio
+
+    def _new_empty(self, like: torch.Tensor, shape: torch.Size) -> torch.Tensor:
+        if self.n_major:
+            return like.new_empty(shape[:-2] + (shape[-1], shape[-2])).transpose(-1, -2)
+        return like.new_empty(shape)
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    @property
+    def capacity(self) -> int:
+        return self.buffer.shape[-1]
+
+    def view(self) -> torch.Tensor:
+        return self.buffer[..., self.start:self.end]
+
+    def _reserve(self, size: int) -> None:
+        # make room for size more elements at the back
+        if self.end + size <= self.capacity:
+            return
+        length = len(self)
+        if self.start >= self.compact_ratio * self.capacity and length + size <= self.capacity:
+            valid = self.view()
+            if self.start < length:
+                valid = valid.clone()
+            self.buffer[..., :length].copy_(valid)
+        else:
+            capacity = max(2 * self.capacity, length + size)
+            buffer = self._new_empty(self.buffer, self.buffer.shape[:-1] + (capacity, ))
+            buffer[..., :length].copy_(self.view())
+            self.buffer = buffer
+        self.start, self.end = 0, length
+
+    def append(self, value: torch.Tensor) -> None:
+        size = value.shape[-1]
+        self._reserve(size)
+        self.buffer[..., self.end:self.end + size].copy_(value)
+        self.end += size
+
+    def insert(self, pos: int, value: torch.Tensor) -> None:
+        if pos == len(self):
+            self.append(value)
+            return
+        size = value.shape[-1]
+        self._reserve(size)
+        pos = self.start + pos
+        tail = self.buffer[..., pos:self.end].clone()
+        self.buffer[..., pos:pos + size].copy_(value)
+        self.buffer[..., pos + size:self.end + size].copy_(tail)
+        self.end += size
+
+    def remove(self, start: int, end: int) -> None:
+        # remove [start, end) by moving whichever side of the range is shorter
+        size = end - start
+        if size <= 0:
+            return
+        if start <= len(self) - end:
+            if start > 0:
+                head = self.buffer[..., self.start:self.start + start]
+                if size < start:
+                    head = head.clone()
+                self.buffer[..., self.start + size:self.start + end].copy_(head)
+            self.start += size
+        else:
+            tail = self.buffer[..., self.start + end:self.end]
+            if size < tail.shape[-1]:
+                tail = tail.clone()
+            self.buffer[..., self.start + start:self.end - size].copy_(tail)
+            self.end -= size
+
+    def keep(self, indices: torch.Tensor) -> None:
+        # indices: bs*K, keep these elements of every batch element in this order
+        view = self.view()
+        indices = indices.reshape(indices.shape[0], *([1] * (view.dim() - 2)), indices.shape[-1])
+        kept = torch.gather(view, -1, indices.expand(*view.shape[:-1], indices.shape[-1]))
+        self.end = self.start + kept.shape[-1]
+        self.view().copy_(kept)
+
+
+def _add_last_dim(dictionary, key, new_value, insert_pt=None):
+    # append a new value to the last dimension of a buffer in a dictionary,
+    # or insert it at insert_pt (used to put permanent memory in front of the temporary part)
     # if the key does not exist, put the new value in
-    # append by default
     if key in dictionary:
-        dictionary[key] = torch.cat([dictionary[key], new_value], -1)
+        if insert_pt is None:
+            dictionary[key].append(new_value)
+        else:
+            dictionary[key].insert(insert_pt, new_value)
     else:
-        dictionary[key] = new_value
+        dictionary[key] = _LastDimBuffer(new_value)
+
+
+def _views(dictionary):
+    return {key: buffer.view() for key, buffer in dictionary.items()}
 
 
 class KeyValueMemoryStore:
@@ -26,6 +128,7 @@ class KeyValueMemoryStore:
             and a dictionary of value tensors indexed by object id.
 
         The keys and values are stored as the concatenation of a permanent part and a temporary part.
+        Every tensor lives in a preallocated _LastDimBuffer; the properties below return views.
         """
         self.save_selection = save_selection
         self.save_usage = save_usage
@@ -33,7 +136,7 @@ class KeyValueMemoryStore:
         self.global_bucket_id = 0  # does not reduce even if buckets are removed
         self.buckets: Dict[int, List[int]] = {}  # indexed by bucket id
         self.k: Dict[int, torch.Tensor] = {}  # indexed by bucket id
-        self.v: Dict[int, torch.Tensor] = {}  # indexed by object id
+        self.v: Dict[int, torch.Tensor] = {}  # indexed by object id, stored N-major
 
         # indexed by bucket id; the end point of permanent memory
         self.perm_end_pt: Dict[int, int] = defaultdict(int)
@@ -75,6 +178,13 @@ class KeyValueMemoryStore:
         assert not self.save_selection or len(selection.shape) == 3
         assert as_permanent in ['no', 'first', 'all']
 
+        def perm_insert_pt(bucket_id):
+            # permanent memory is inserted right after the existing permanent memory
+            if as_permanent == 'all' or (as_permanent == 'first'
+                                         and self.perm_end_pt[bucket_id] == 0):
+                return self.perm_end_pt[bucket_id]
+            return None
+
         # add the value and create new buckets if necessary
         if supposed_bucket_id >= 0:
             enabled_buckets = [supposed_bucket_id]
@@ -83,10 +193,10 @@ class KeyValueMemoryStore:
                 if bucket_exist:
                     assert obj in self.v
                     assert obj in self.buckets[supposed_bucket_id]
-                    _add_last_dim(self.v, obj, value, prepend=(as_permanent == 'all'))
+                    _add_last_dim(self.v, obj, value, perm_insert_pt(supposed_bucket_id))
                 else:
                     assert obj not in self.v
-                    self.v[obj] = value
+                    self.v[obj] = _LastDimBuffer(value, n_major=True)
             self.buckets[supposed_bucket_id] = list(values.keys())
         else:
             new_bucket_id = None
@@ -94,15 +204,15 @@ class KeyValueMemoryStore:
             for obj, value in values.items():
                 assert len(value.shape) == 3
                 if obj in self.v:
-                    _add_last_dim(self.v, obj, value, prepend=(as_permanent == 'all'))
                     bucket_used = [
                         bucket_id for bucket_id, object_ids in self.buckets.items()
                         if obj in object_ids
                     ]
                     assert len(bucket_used) == 1  # each object should only be in one bucket
+                    _add_last_dim(self.v, obj, value, perm_insert_pt(bucket_used[0]))
                     enabled_buckets.add(bucket_used[0])
                 else:
-                    self.v[obj] = value
+                    self.v[obj] = _LastDimBuffer(value, n_major=True)
                     if new_bucket_id is None:
                         # create new bucket
                         new_bucket_id = self.global_bucket_id
@@ -113,16 +223,11 @@ class KeyValueMemoryStore:
                     enabled_buckets.add(new_bucket_id)
 
         # increment the permanent size if necessary
-        add_as_permanent = {}  # indexed by bucket id
+        add_as_permanent = {}  # indexed by bucket id, the insertion point of permanent memory
         for bucket_id in enabled_buckets:
-            add_as_permanent[bucket_id] = False
-            if as_permanent == 'all':
+            add_as_permanent[bucket_id] = perm_insert_pt(bucket_id)
+            if add_as_permanent[bucket_id] is not None:
                 self.perm_end_pt[bucket_id] += ne
-                add_as_permanent[bucket_id] = True
-            elif as_permanent == 'first':
-                if self.perm_end_pt[bucket_id] == 0:
-                    self.perm_end_pt[bucket_id] = ne
-                    add_as_permanent[bucket_id] = True
 
         # create new counters for usage if necessary
         if self.save_usage and as_permanent != 'all':
@@ -135,9 +240,9 @@ class KeyValueMemoryStore:
                 # if we are not adding new values to a bucket, we should skip it
                 continue
 
-            _add_last_dim(self.k, bucket_id, key, prepend=add_as_permanent[bucket_id])
-            _add_last_dim(self.s, bucket_id, shrinkage, prepend=add_as_permanent[bucket_id])
-            if not add_as_permanent[bucket_id]:
+            _add_last_dim(self.k, bucket_id, key, add_as_permanent[bucket_id])
+            _add_last_dim(self.s, bucket_id, shrinkage, add_as_permanent[bucket_id])
+            if add_as_permanent[bucket_id] is None:
                 if self.save_selection:
                     _add_last_dim(self.e, bucket_id, selection)
                 if self.save_usage:
@@ -154,8 +259,9 @@ class KeyValueMemoryStore:
         if usage.shape[-1] == 0:
             # if there is no temporary memory, we don't need to update
             return
-        self.use_cnt[bucket_id] += usage.view_as(self.use_cnt[bucket_id])
-        self.life_cnt[bucket_id] += 1
+        use_cnt = self.use_cnt[bucket_id].view()
+        use_cnt += usage.view_as(use_cnt)
+        self.life_cnt[bucket_id].view().add_(1)
 
     def sieve_by_range(self, bucket_id: int, start: int, end: int, min_size: int) -> None:
         # keep only the temporary elements *outside* of this range (with some boundary conditions)
@@ -167,37 +273,25 @@ class KeyValueMemoryStore:
         assert end <= 0
 
         object_ids = self.buckets[bucket_id]
-        bucket_num_elements = self.k[bucket_id].shape[-1] - self.perm_end_pt[bucket_id]
+        bucket_num_elements = len(self.k[bucket_id]) - self.perm_end_pt[bucket_id]
         if bucket_num_elements <= min_size:
             return
 
-        if end == 0:
-            # negative 0 would not work as the end index!
-            # effectively make the second part an empty slice
-            end = self.k[bucket_id].shape[-1] + 1
-
         p_size = self.perm_end_pt[bucket_id]
+        # convert to absolute indices
         start = start + p_size
+        end = len(self.k[bucket_id]) + end if end < 0 else len(self.k[bucket_id])
+        end = max(end, start)
 
-        k = self.k[bucket_id]
-        s = self.s[bucket_id]
+        self.k[bucket_id].remove(start, end)
+        self.s[bucket_id].remove(start, end)
         if self.save_selection:
-            e = self.e[bucket_id]
+            self.e[bucket_id].remove(start - p_size, end - p_size)
         if self.save_usage:
-            use_cnt = self.use_cnt[bucket_id]
-            life_cnt = self.life_cnt[bucket_id]
-
-        self.k[bucket_id] = torch.cat([k[:, :, :start], k[:, :, end:]], -1)
-        self.s[bucket_id] = torch.cat([s[:, :, :start], s[:, :, end:]], -1)
-        if self.save_selection:
-            self.e[bucket_id] = torch.cat([e[:, :, :start - p_size], e[:, :, end:]], -1)
-        if self.save_usage:
-            self.use_cnt[bucket_id] = torch.cat([use_cnt[:, :start - p_size], use_cnt[:, end:]], -1)
-            self.life_cnt[bucket_id] = torch.cat([life_cnt[:, :start - p_size], life_cnt[:, end:]],
-                                                 -1)
+            self.use_cnt[bucket_id].remove(start - p_size, end - p_size)
+            self.life_cnt[bucket_id].remove(start - p_size, end - p_size)
         for obj_id in object_ids:
-            v = self.v[obj_id]
-            self.v[obj_id] = torch.cat([v[:, :, :start], v[:, :, end:]], -1)
+            self.v[obj_id].remove(start, end)
 
     def remove_old_memory(self, bucket_id: int, max_len: int) -> None:
         self.sieve_by_range(bucket_id, 0, -max_len, max_len)
@@ -212,37 +306,26 @@ class KeyValueMemoryStore:
         usage = self.get_usage(bucket_id)
         bs = usage.shape[0]
 
-        survivals = []
-
-        for bi in range(bs):
-            _, survived = torch.topk(usage[bi], k=max_size)
-            survivals.append(survived.flatten())
-            assert survived.shape[-1] == survivals[0].shape[-1]
+        _, survived = torch.topk(usage, k=max_size, dim=-1)
 
-        self.k[bucket_id] = torch.stack(
-            [self.k[bucket_id][bi, :, survived] for bi, survived in enumerate(survivals)], 0)
-        self.s[bucket_id] = torch.stack(
-            [self.s[bucket_id][bi, :, survived] for bi, survived in enumerate(survivals)], 0)
+        self.k[bucket_id].keep(survived)
+        self.s[bucket_id].keep(survived)
 
         if self.save_selection:
             # Long-term memory does not store selection so this should not be needed
-            self.e[bucket_id] = torch.stack(
-                [self.e[bucket_id][bi, :, survived] for bi, survived in enumerate(survivals)], 0)
+            self.e[bucket_id].keep(survived)
         for obj_id in object_ids:
-            self.v[obj_id] = torch.stack(
-                [self.v[obj_id][bi, :, survived] for bi, survived in enumerate(survivals)], 0)
+            self.v[obj_id].keep(survived)
 
-        self.use_cnt[bucket_id] = torch.stack(
-            [self.use_cnt[bucket_id][bi, survived] for bi, survived in enumerate(survivals)], 0)
-        self.life_cnt[bucket_id] = torch.stack(
-            [self.life_cnt[bucket_id][bi, survived] for bi, survived in enumerate(survivals)], 0)
+        self.use_cnt[bucket_id].keep(survived)
+        self.life_cnt[bucket_id].keep(survived)
 
     def get_usage(self, bucket_id: int) -> torch.Tensor:
         # return normalized usage
         if not self.save_usage:
             raise RuntimeError('I did not count usage!')
         else:
-            usage = self.use_cnt[bucket_id] / self.life_cnt[bucket_id]
+            usage = self.use_cnt[bucket_id].view() / self.life_cnt[bucket_id].view()
             return usage
 
     def get_all_sliced(
@@ -259,16 +342,22 @@ class KeyValueMemoryStore:
 
         if end == 0:
             # negative 0 would not work as the end index!
-            k = self.k[bucket_id][:, :, start:]
-            sk = self.s[bucket_id][:, :, start:]
-            ek = self.e[bucket_id][:, :, start - p_size:] if self.save_selection else None
-            value = {obj_id: self.v[obj_id][:, :, start:] for obj_id in self.buckets[bucket_id]}
+            k = self.k[bucket_id].view()[:, :, start:]
+            sk = self.s[bucket_id].view()[:, :, start:]
+            ek = self.e[bucket_id].view()[:, :, start - p_size:] if self.save_selection else None
+            value = {
+                obj_id: self.v[obj_id].view()[:, :, start:]
+                for obj_id in self.buckets[bucket_id]
+            }
             usage = self.get_usage(bucket_id)[:, start - p_size:] if self.save_usage else None
         else:
-            k = self.k[bucket_id][:, :, start:end]
-            sk = self.s[bucket_id][:, :, start:end]
-            ek = self.e[bucket_id][:, :, start - p_size:end] if self.save_selection else None
-            value = {obj_id: self.v[obj_id][:, :, start:end] for obj_id in self.buckets[bucket_id]}
+            k = self.k[bucket_id].view()[:, :, start:end]
+            sk = self.s[bucket_id].view()[:, :, start:end]
+            ek = self.e[bucket_id].view()[:, :, start - p_size:end] if self.save_selection else None
+            value = {
+                obj_id: self.v[obj_id].view()[:, :, start:end]
+                for obj_id in self.buckets[bucket_id]
+            }
             usage = self.get_usage(bucket_id)[:, start - p_size:end] if self.save_usage else None
 
         return k, sk, ek, value, usage
@@ -304,13 +393,13 @@ class KeyValueMemoryStore:
             self.sieve_by_range(bucket_id, 0, 0, 0)
 
     def get_v_size(self, obj_id: int) -> int:
-        return self.v[obj_id].shape[-1]
+        return len(self.v[obj_id])
 
     def size(self, bucket_id: int) -> int:
         if bucket_id not in self.k:
             return 0
         else:
-            return self.k[bucket_id].shape[-1]
+            return len(self.k[bucket_id])
 
     def perm_size(self, bucket_id: int) -> int:
         return self.perm_end_pt[bucket_id]
@@ -330,19 +419,19 @@ class KeyValueMemoryStore:
 
     @property
     def key(self) -> Dict[int, torch.Tensor]:
-        return self.k
+        return _views(self.k)
 
     @property
     def value(self) -> Dict[int, torch.Tensor]:
-        return self.v
+        return _views(self.v)
 
     @property
     def shrinkage(self) -> Dict[int, torch.Tensor]:
-        return self.s
+        return _views(self.s)
 
     @property
     def selection(self) -> Dict[int, torch.Tensor]:
-        return self.e
+        return _views(self.e)
 
     def __contains__(self, key):
         return key in self.v
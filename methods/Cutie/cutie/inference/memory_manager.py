@@ -74,18 +74,31 @@ class MemoryManager:
         else:
             self.max_mem_frames = cfg.max_mem_frames - 1
 
+    def _softmax(self, similarity: torch.Tensor, return_usage: bool = False):
+        # with top_k the affinity stays sparse as an (indices, weights) pair
+        if self.top_k is None:
+            return do_softmax(similarity, inplace=True, return_usage=return_usage)
+        return do_sparse_softmax(similarity, self.top_k, return_usage=return_usage)
+
     def _readout(self, affinity, v) -> torch.Tensor:
-        # affinity: bs*N*HW
-        # v: bs*C*N or bs*num_objects*C*N
+        # affinity: bs*N*HW, or the (indices, weights) pair from _softmax
+        # v: bs*C*N or bs*num_objects*C*N, N-major like the stored values
         # returns bs*C*HW or bs*num_objects*C*HW
+        if isinstance(affinity, tuple):
+            if len(v.shape) == 3:
+                return sparse_readout(v.transpose(-1, -2), *affinity)
+            # objects go into the batch, they share the top-k affinity
+            bs, num_objects = v.shape[:2]
+            indices, weights = (x.repeat_interleave(num_objects, dim=0) for x in affinity)
+            out = sparse_readout(v.transpose(-1, -2).flatten(0, 1), indices, weights)
+            return out.view(bs, num_objects, *out.shape[1:])
+
         if len(v.shape) == 3:
             # single object
             return v @ affinity
         else:
-            bs, num_objects, C, N = v.shape
-            v = v.view(bs, num_objects * C, N)
-            out = v @ affinity
-            return out.view(bs, num_objects, C, -1)
+            # N-major values cannot fold the objects into the channels; broadcast instead
+            return v @ affinity.unsqueeze(1)
 
     def _get_mask_by_ids(self, mask: torch.Tensor, obj_ids: List[int]) -> torch.Tensor:
         # -1 because the mask does not contain the background channel
@@ -99,12 +112,15 @@ class MemoryManager:
 
     def _get_visual_values_by_ids(self, obj_ids: List[int]) -> torch.Tensor:
         # All the values that the object ids refer to should have the same shape
-        value = torch.stack([self.work_mem.value[obj] for obj in obj_ids], dim=1)
-        if self.use_long_term and obj_ids[0] in self.long_mem.value:
-            lt_value = torch.stack([self.long_mem.value[obj] for obj in obj_ids], dim=1)
-            value = torch.cat([lt_value, value], dim=-1)
+        # returns (1/2)*num_objects*C*N, laid out N-major like the stored values
+        work_values = self.work_mem.value
+        value = torch.stack([work_values[obj].transpose(-1, -2) for obj in obj_ids], dim=1)
+        if self.use_long_term and obj_ids[0] in self.long_mem:
+            long_values = self.long_mem.value
+            lt_value = torch.stack([long_values[obj].transpose(-1, -2) for obj in obj_ids], dim=1)
+            value = torch.cat([lt_value, value], dim=-2)
 
-        return value
+        return value.transpose(-1, -2)
 
     def read(self, pix_feat: torch.Tensor, query_key: torch.Tensor, selection: torch.Tensor,
              last_mask: torch.Tensor, network: CUTIE) -> Dict[int, torch.Tensor]:
@@ -140,10 +156,7 @@ class MemoryManager:
                     [self.long_mem.shrinkage[bucket_id], self.work_mem.shrinkage[bucket_id]], -1)
 
                 similarity = get_similarity(memory_key, shrinkage, query_key, selection)
-                affinity, usage = do_softmax(similarity,
-                                             top_k=self.top_k,
-                                             inplace=True,
-                                             return_usage=True)
+                affinity, usage = self._softmax(similarity, return_usage=True)
                 """
                 Record memory usage for working and long-term memory
                 """
@@ -162,13 +175,10 @@ class MemoryManager:
                 similarity = get_similarity(memory_key, shrinkage, query_key, selection)
 
                 if self.use_long_term:
-                    affinity, usage = do_softmax(similarity,
-                                                 top_k=self.top_k,
-                                                 inplace=True,
-                                                 return_usage=True)
+                    affinity, usage = self._softmax(similarity, return_usage=True)
                     self.work_mem.update_bucket_usage(bucket_id, usage)
                 else:
-                    affinity = do_softmax(similarity, top_k=self.top_k, inplace=True)
+                    affinity = self._softmax(similarity)
 
             if self.chunk_size < 1:
                 object_chunks = [bucket]
@@ -1,5 +1,6 @@
 import math
 import torch
+import torch.nn.functional as F
 from typing import Optional, Union, Tuple
 
 
@@ -55,10 +56,7 @@ def do_softmax(
     # similarity: B x N x [HW/P]
     # use inplace with care
     if top_k is not None:
-        values, indices = torch.topk(similarity, k=top_k, dim=1)
-
-        x_exp = values.exp_()
-        x_exp /= torch.sum(x_exp, dim=1, keepdim=True)
+        indices, x_exp = do_sparse_softmax(similarity, top_k)
         if inplace:
             similarity.zero_().scatter_(1, indices, x_exp)  # B*N*HW
             affinity = similarity
@@ -77,6 +75,43 @@ def do_softmax(
     return affinity
 
 
+def do_sparse_softmax(
+    similarity: torch.Tensor,
+    top_k: int,
+    return_usage: bool = False
+) -> Union[Tuple[torch.Tensor, torch.Tensor], Tuple[Tuple[torch.Tensor, torch.Tensor],
+                                                      torch.Tensor]]:
+    # top-k softmax as (indices, weights), each B x top_k x [HW/P]
+    # do_softmax scatters them into the dense B x N x [HW/P] affinity
+    values, indices = torch.topk(similarity, k=top_k, dim=1)
+
+    x_exp = values.exp_()
+    x_exp /= torch.sum(x_exp, dim=1, keepdim=True)
+
+    if return_usage:
+        usage = torch.zeros(similarity.shape[:2], dtype=x_exp.dtype, device=x_exp.device)
+        usage.scatter_add_(1, indices.flatten(start_dim=1), x_exp.flatten(start_dim=1))  # B*N
+        return (indices, x_exp), usage
+
+    return indices, x_exp
+
+
+def sparse_readout(mv: torch.Tensor, indices: torch.Tensor, weights: torch.Tensor) -> torch.Tensor:
+    # mv @ affinity for the top-k affinity from do_sparse_softmax
+    # mv: B x N x C (N-major, the memory stores keep values this way)
+    # indices/weights: B x top_k x [HW/P]
+    # returns B x C x [HW/P]
+    # every query pixel is a bag of top_k memory rows, so time and memory do not depend on N
+    B, N, C = mv.shape
+    top_k = indices.shape[1]
+    indices = indices + N * torch.arange(B, device=indices.device).view(B, 1, 1)
+    mem = F.embedding_bag(indices.transpose(1, 2).reshape(-1, top_k),
+                          mv.reshape(B * N, C),
+                          per_sample_weights=weights.transpose(1, 2).reshape(-1, top_k).to(mv.dtype),
+                          mode='sum')
+    return mem.view(B, -1, C).transpose(1, 2).contiguous()
+
+
 def get_affinity(mk: torch.Tensor, ms: torch.Tensor, qk: torch.Tensor,
                  qe: torch.Tensor) -> torch.Tensor:
     # shorthand used in training with no top-k
@@ -0,0 +1,105 @@
+"""
+CPU benchmark of MemoryManager.add_memory and read on a synthetic stream.
+The network calls in read are replaced by identity functions so the timings only cover the
+memory stores. Run from the Cutie root: python -m scripts.benchmark_memory_store
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+from cutie.inference.object_manager import ObjectManager
+from cutie.inference.memory_manager import MemoryManager
+
+
+class MemoryOnlyNetwork:
+    def pixel_fusion(self, pix_feat, visual_readout, sensory, last_mask):
+        return visual_readout
+
+    def readout_query(self, pixel_readout, obj_memory):
+        return pixel_readout, None
+
+
+def get_config(args):
+    return OmegaConf.create({
+        'model': {
+            'sensory_dim': 256
+        },
+        'top_k': 30,
+        'chunk_size': -1,
+        'save_aux': False,
+        'use_long_term': args.long_term,
+        'max_mem_frames': 5,
+        'long_term': {
+            'count_usage': True,
+            'max_mem_frames': 10,
+            'min_mem_frames': 5,
+            'num_prototypes': 128,
+            'max_num_tokens': 10000,
+            'buffer_tokens': 2000,
+        },
+    })
+
+
+def run(args):
+    torch.manual_seed(0)
+    objects = list(range(1, args.num_objects + 1))
+    object_manager = ObjectManager()
+    object_manager.add_new_objects(objects)
+    memory = MemoryManager(get_config(args), object_manager)
+    network = MemoryOnlyNetwork()
+
+    h, w, ck, cv = args.height, args.width, 64, 256
+    pix_feat = torch.randn(1, 256, h, w)
+    last_mask = torch.rand(1, args.num_objects, h, w)
+    memory.initialize_sensory_if_needed(pix_feat, objects)
+
+    add_times, read_times = [], []
+    for ti in range(args.frames):
+        key = torch.randn(1, ck, h, w)
+        shrinkage = torch.rand(1, 1, h, w) + 1
+        selection = torch.rand(1, ck, h, w)
+        if ti > 0:
+            start = perf_counter()
+            memory.read(pix_feat, key, selection, last_mask, network)
+            read_times.append(perf_counter() - start)
+        if ti % args.mem_every == 0:
+            msk_value = torch.randn(1, args.num_objects, cv, h, w)
+            obj_value = torch.rand(1, args.num_objects, 16, 257)
+            start = perf_counter()
+            memory.add_memory(key,
+                              shrinkage,
+                              msk_value,
+                              obj_value,
+                              objects,
+                              selection=selection if args.long_term else None,
+                              as_permanent='first')
+            add_times.append(perf_counter() - start)
+
+    return np.array(add_times) * 1e3, np.array(read_times) * 1e3
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--frames', type=int, default=3000)
+    parser.add_argument('--mem_every', type=int, default=1)
+    parser.add_argument('--height', type=int, default=15)
+    parser.add_argument('--width', type=int, default=27)
+    parser.add_argument('--num_objects', type=int, default=2)
+    parser.add_argument('--long_term', action='store_true')
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    with torch.inference_mode():
+        add_ms, read_ms = run(args)
+    print(f'{"":>6} {"mean ms":>8} {"p50 ms":>8} {"p99 ms":>8}')
+    for name, times in [('add', add_ms), ('read', read_ms)]:
+        print(f'{name:>6} {times.mean():>8.3f} {np.percentile(times, 50):>8.3f} '
+              f'{np.percentile(times, 99):>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
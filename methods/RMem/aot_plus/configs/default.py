@@ -38,6 +38,7 @@ class DefaultEngineConfig():
         self.IGNORE_IN_MERGE = True
         self.DATA_VISOR_REPEAT = 1
         self.DATA_VISOR_IGNORE_THRESH = 0.2
+        self.DATA_USE_SHARDS = False  # VOST, VISOR and YouTube-VOS frames from tools/build_shards.py
 
         # the parameter of load the checkpoint 
         self.PRETRAIN = True
@@ -71,12 +72,15 @@ class DefaultEngineConfig():
         self.TRAIN_TBLOG = False
         self.TRAIN_TBLOG_STEP = 50
         self.TRAIN_LOG_STEP = 20
+        self.TRAIN_PROFILE_PHASES = False  # per-phase step timings in the log
+        self.TRAIN_PROFILE_DUMP_STEP = 0  # >0: profile, json and Chrome trace to DIR_LOG every N steps
         self.TRAIN_IMG_LOG = True
         self.TRAIN_TOP_K_PERCENT_PIXELS = 0.15
         self.TRAIN_SEQ_TRAINING_FREEZE_PARAMS = ['patch_wise_id_bank']
         self.TRAIN_SEQ_TRAINING_START_RATIO = 0.5
         self.TRAIN_HARD_MINING_RATIO = 0.5
         self.TRAIN_EMA_RATIO = 0.1
+        self.TRAIN_EMA_UPDATE_EVERY = 1  # average every N steps, decay**N
         self.TRAIN_CLIP_GRAD_NORM = 5.
         self.TRAIN_SAVE_STEP = 500
         self.TRAIN_EVAL = False
@@ -98,9 +102,14 @@ class DefaultEngineConfig():
         self.TRAIN_LSTT_DROPPATH_LST = False
         self.TRAIN_LSTT_LT_DROPOUT = 0.
         self.TRAIN_LSTT_ST_DROPOUT = 0.
+        self.TRAIN_CHECKPOINT_LSTT_LAYERS = []  # LSTT blocks recomputed in backward, e.g. [0, 1, 2]
+        self.TRAIN_CHECKPOINT_DECODER = False  # recompute the FPN decoder in backward
 
         self.TEST_GPU_ID = 0
         self.TEST_GPU_NUM = 1
+        # 'cuda' or 'cpu'
+        self.TEST_DEVICE = 'cuda'
+        self.TEST_CPU_THREADS = None
         self.TEST_FRAME_LOG = False
         self.TEST_DATASET = 'youtubevos'
         self.TEST_DATASET_FULL_RESOLUTION = False
@@ -113,6 +122,11 @@ class DefaultEngineConfig():
         self.TEST_MIN_SIZE = None
         self.TEST_MAX_SIZE = 800 * 1.3
         self.TEST_WORKERS = 4
+        self.TEST_MASK_WRITERS = 4
+        # PNG zlib level of the saved masks, 6 is the PIL default
+        self.TEST_MASK_COMPRESS_LEVEL = 6
+        # count and locate the host syncs of every frame, slow
+        self.TEST_AUDIT_SYNCS = False
 
         # GPU distribution
         self.DIST_ENABLE = True
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+# Sidecar directory, next to Annotations, written by tools/build_object_index.py
+INDEX_DIR = 'ObjectIndex'
+IGNORE_LABEL = 255
+
+
+def index_sequence(label_root, seq_name, labels=None):
+    """
+    Object presence of every annotated frame of a sequence.
+    Returns a dict of arrays:
+        labels: [F] annotation file names, sorted
+        fg_pixels: [F] non-zero pixels, ignored ones included
+        ignore_pixels: [F] pixels with the ignore label
+        obj_ids: [K] object ids found in the sequence
+        obj_pixels: [F, K] pixels of every object
+        obj_boxes: [F, K, 4] x0, y0, x1, y1 (inclusive), -1 when absent
+    """
+    if labels is None:
+        labels = os.listdir(os.path.join(label_root, seq_name))
+    labels = list(np.sort(labels))
+    counts = []
+    boxes = []
+    for label_name in labels:
+        label = np.array(Image.open(
+            os.path.join(label_root, seq_name, label_name)), dtype=np.uint8)
+        counts.append(np.bincount(label.ravel(), minlength=256))
+        frame_boxes = {}
+        for obj_id in np.flatnonzero(counts[-1]):
+            if obj_id == 0 or obj_id == IGNORE_LABEL:
+                continue
+            ys = np.flatnonzero((label == obj_id).any(axis=1))
+            xs = np.flatnonzero((label == obj_id).any(axis=0))
+            frame_boxes[obj_id] = (xs[0], ys[0], xs[-1], ys[-1])
+        boxes.append(frame_boxes)
+    counts = np.array(counts, dtype=np.int64).reshape(len(labels), 256)
+
+    present = counts.sum(axis=0) > 0
+    present[[0, IGNORE_LABEL]] = False
+    obj_ids = np.flatnonzero(present).astype(np.uint8)
+    obj_boxes = np.full((len(labels), len(obj_ids), 4), -1, dtype=np.int32)
+    for frame_idx, frame_boxes in enumerate(boxes):
+        for obj_idx, obj_id in enumerate(obj_ids):
+            if obj_id in frame_boxes:
+                obj_boxes[frame_idx, obj_idx] = frame_boxes[obj_id]
+    return {
+        'labels': np.array(labels),
+        'fg_pixels': counts[:, 1:].sum(axis=1),
+        'ignore_pixels': counts[:, IGNORE_LABEL],
+        'obj_ids': obj_ids,
+        'obj_pixels': counts[:, obj_ids].astype(np.int32),
+        'obj_boxes': obj_boxes,
+    }
+
+
+def index_path(index_root, seq_name):
+    return os.path.join(index_root, seq_name + '.npz')
+
+
+def write_sequence_index(label_root, index_root, seq_name, labels=None):
+    index = index_sequence(label_root, seq_name, labels)
+    os.makedirs(index_root, exist_ok=True)
+    path = index_path(index_root, seq_name)
+    # np.savez appends .npz to names without it
+    tmp_path = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp_path, **index)
+    os.replace(tmp_path, path)
+    return index
+
+
+def load_sequence_index(index_root, seq_name):
+    if index_root is None or not os.path.isfile(index_path(index_root, seq_name)):
+        return None
+    path = index_path(index_root, seq_name)
+    with np.load(path) as index:
+        index = dict(index)
+    index['labels'] = list(index['labels'])
+    return index
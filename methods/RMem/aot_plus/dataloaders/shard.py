@@ -0,0 +1,82 @@
+import io
+import os
+import json
+import mmap
+import struct
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Shard directory, next to JPEGImages and Annotations, written by
+# tools/build_shards.py
+SHARD_DIR = 'Shards'
+IMAGE_DIR = 'JPEGImages'
+LABEL_DIR = 'Annotations'
+# shards a dataset keeps mapped, each holds a file descriptor
+MAX_OPEN_SHARDS = 64
+
+# A shard packs the encoded frames of one sequence back to back, followed by
+# a JSON index {dir: {file name: [offset, size]}} and the offset of that index
+# as a little-endian uint64.
+_TRAILER = struct.Struct('<Q')
+
+
+def shard_path(shard_root, seq_name):
+    return os.path.join(shard_root, seq_name + '.shard')
+
+
+def write_shard(image_root, label_root, shard_root, seq_name):
+    index = {IMAGE_DIR: {}, LABEL_DIR: {}}
+    os.makedirs(shard_root, exist_ok=True)
+    path = shard_path(shard_root, seq_name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for kind, root in [(IMAGE_DIR, image_root), (LABEL_DIR, label_root)]:
+            seq_dir = os.path.join(root, seq_name)
+            if not os.path.isdir(seq_dir):
+                continue
+            for name in sorted(os.listdir(seq_dir)):
+                with open(os.path.join(seq_dir, name), 'rb') as member:
+                    data = member.read()
+                index[kind][name] = [f.tell(), len(data)]
+                f.write(data)
+        index_offset = f.tell()
+        f.write(json.dumps(index).encode())
+        f.write(_TRAILER.pack(index_offset))
+    os.replace(tmp_path, path)
+    return index
+
+
+class ShardReader(object):
+    """
+    Memory-mapped shard of one sequence. Frames are decoded from the mapped
+    buffer, as cv2.imread and Image.open would from the loose files.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        trailer_offset = len(self.buffer) - _TRAILER.size
+        index_offset, = _TRAILER.unpack(self.buffer[trailer_offset:])
+        self.index = json.loads(self.buffer[index_offset:trailer_offset])
+
+    def names(self, kind):
+        return sorted(self.index[kind].keys())
+
+    def read(self, kind, name):
+        offset, size = self.index[kind][name]
+        return np.frombuffer(self.buffer, dtype=np.uint8, count=size,
+                             offset=offset)
+
+    def read_image(self, name):
+        return cv2.imdecode(self.read(IMAGE_DIR, name), cv2.IMREAD_COLOR)
+
+    def read_label(self, name):
+        return Image.open(io.BytesIO(self.read(LABEL_DIR, name)))
+
+
+def sequence_names(shard_root, seq_name):
+    # the sorted image and label names of a sequence, as listed from the loose
+    # files
+    shard = ShardReader(shard_path(shard_root, seq_name))
+    return shard.names(IMAGE_DIR), shard.names(LABEL_DIR)
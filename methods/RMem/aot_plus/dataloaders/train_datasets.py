@@ -1,5 +1,6 @@
 from __future__ import division
 import os
+from collections import OrderedDict
 from os.path import exists
 from glob import glob
 import json
@@ -13,6 +14,9 @@ from torch.utils.data import Dataset
 import torchvision.transforms as TF
 
 import dataloaders.image_transforms as IT
+from dataloaders.object_index import INDEX_DIR, load_sequence_index
+from dataloaders.shard import SHARD_DIR, MAX_OPEN_SHARDS, ShardReader, \
+    shard_path, sequence_names
 
 cv2.setNumThreads(0)
 
@@ -251,9 +255,18 @@ class VOSTrain(Dataset):
                  merge_prob=0.3,
                  max_obj_n=10,
                  ignore_thresh=1.0,
-                 ignore_in_merge=False):
+                 ignore_in_merge=False,
+                 index_root=None,
+                 shard_root=None):
         self.image_root = image_root
         self.label_root = label_root
+        # per-sequence object presence sidecars, see dataloaders/object_index.py
+        self.index_root = index_root
+        self.object_indexes = {}
+        # frames read from per-sequence shards instead of loose files when set,
+        # see dataloaders/shard.py
+        self.shard_root = shard_root
+        self.shards = OrderedDict()
         self.rand_gap = rand_gap
         self.seq_len = seq_len
         self.rand_reverse = rand_reverse
@@ -282,12 +295,37 @@ class VOSTrain(Dataset):
         return imagelist, lablist
 
     def reload_images(self):
+        self.shards = OrderedDict()
         for seq_name in self.imglistdic.keys():
+            if self.shard_root is not None:
+                self.imglistdic[seq_name] = sequence_names(self.shard_root, seq_name)
+                continue
             images = list(
                 np.sort(os.listdir(os.path.join(self.image_root, seq_name))))
             labels = list(
                 np.sort(os.listdir(os.path.join(self.label_root, seq_name))))
             self.imglistdic[seq_name] = (images, labels)
+        self.object_indexes = {}
+
+    def open_shard(self, seqname):
+        # the least recently used shards are unmapped past MAX_OPEN_SHARDS
+        shard = self.shards.pop(seqname, None)
+        if shard is None:
+            shard = ShardReader(shard_path(self.shard_root, seqname))
+            if len(self.shards) >= MAX_OPEN_SHARDS:
+                self.shards.popitem(last=False)
+        self.shards[seqname] = shard
+        return shard
+
+    def read_image(self, seqname, image_name):
+        if self.shard_root is not None:
+            return self.open_shard(seqname).read_image(image_name)
+        return cv2.imread(os.path.join(self.image_root, seqname, image_name))
+
+    def read_label(self, seqname, label_name):
+        if self.shard_root is not None:
+            return self.open_shard(seqname).read_label(label_name)
+        return Image.open(os.path.join(self.label_root, seqname, label_name))
 
     def get_ref_index(self,
                       seqname,
@@ -300,8 +338,7 @@ class VOSTrain(Dataset):
             ref_index = np.random.randint(len(lablist))
             if ref_index in bad_indices:
                 continue
-            ref_label = Image.open(
-                os.path.join(self.label_root, seqname, lablist[ref_index]))
+            ref_label = self.read_label(seqname, lablist[ref_index])
             ref_label = np.array(ref_label, dtype=np.uint8)
             ref_objs = list(np.unique(ref_label))
             is_consistent = True
@@ -316,6 +353,36 @@ class VOSTrain(Dataset):
             bad_indices.append(ref_index)
         return ref_index
 
+    def get_object_index(self, seqname):
+        # None without a sidecar or when it does not list the annotations of the sequence
+        if seqname not in self.object_indexes:
+            index = load_sequence_index(self.index_root, seqname)
+            if index is not None and index['labels'] != list(self.imglistdic[seqname][1]):
+                print('Stale object index of {}, decoding its annotations.'.format(seqname))
+                index = None
+            if index is not None:
+                index['rows'] = {name: row for row, name in enumerate(index['labels'])}
+            self.object_indexes[seqname] = index
+        return self.object_indexes[seqname]
+
+    def is_index_consistent(self, seqname, ref_label_name, curr_frame_names):
+        # Whether every object of the current frames is in the reference frame,
+        # True when the sequence has no index
+        index = self.get_object_index(seqname)
+        if index is None:
+            return True
+        ref_row = index['rows'][ref_label_name]
+        missing = index['obj_pixels'][ref_row] == 0
+        ref_ignore = index['ignore_pixels'][ref_row] > 0
+        for frame_name in curr_frame_names:
+            row = index['rows'].get(frame_name.split('.')[0] + '.png')
+            if row is None:
+                continue
+            if (index['obj_pixels'][row][missing] > 0).any() or (
+                    index['ignore_pixels'][row] > 0 and not ref_ignore):
+                return False
+        return True
+
     def get_ref_index_v2(self,
                          seqname,
                          lablist,
@@ -326,14 +393,28 @@ class VOSTrain(Dataset):
         search_range = len(lablist) - total_gap
         if search_range <= 1:
             return 0
+        index = self.get_object_index(seqname)
+        if index is not None:
+            fg_pixels = index['fg_pixels']
+            ignore_pixels = index['ignore_pixels']
+            if lablist[0] != index['labels'][0]:  # reversed by reverse_seq
+                fg_pixels, ignore_pixels = fg_pixels[::-1], ignore_pixels[::-1]
+            fg_pixels = fg_pixels[:search_range]
+            is_valid = (fg_pixels > min_fg_pixels) & (
+                ignore_pixels[:search_range] / np.maximum(fg_pixels, 1) <= ignore_thresh)
+            # the same draws as below, without decoding the annotations
+            for _ in range(max_try):
+                ref_index = np.random.randint(search_range)
+                if is_valid[ref_index]:
+                    break
+            return ref_index
         bad_indices = []
         for _ in range(max_try):
             ref_index = np.random.randint(search_range)
             if ref_index in bad_indices:
                 continue
             frame_name = lablist[ref_index].split('.')[0] + '.jpg'
-            ref_label = Image.open(
-                os.path.join(self.label_root, seqname, lablist[ref_index]))
+            ref_label = self.read_label(seqname, lablist[ref_index])
             ref_label = np.array(ref_label, dtype=np.uint8)
             xs_ignore, ys_ignore = np.nonzero(ref_label == 255)
             xs, ys = np.nonzero(ref_label)
@@ -423,8 +504,7 @@ class VOSTrain(Dataset):
         else:
             frame_name = imagelist[index].split('.')[0]
 
-        image = cv2.imread(
-            os.path.join(self.image_root, seqname, frame_name + '.jpg'))
+        image = self.read_image(seqname, frame_name + '.jpg')
         image = np.array(image, dtype=np.float32)
 
         if self.rgb:
@@ -432,8 +512,7 @@ class VOSTrain(Dataset):
 
         label_name = frame_name + '.png'
         if label_name in lablist:
-            label = Image.open(
-                os.path.join(self.label_root, seqname, label_name))
+            label = self.read_label(seqname, label_name)
             label = np.array(label, dtype=np.uint8)
         else:
             label = None
@@ -514,13 +593,19 @@ class VOSTrain(Dataset):
                 #         adjusted_curr_gaps.append(imagelist.index(frame_name + '.jpg') - adjusted_index)
                 #     curr_gaps = adjusted_curr_gaps
 
+                curr_indices = self.get_curr_indices(imagelist, adjusted_index,
+                                                     curr_gaps)
+                # skip decoding the frames of a retry the index already rejects
+                if try_step < max_try and not self.is_index_consistent(
+                        seqname, lablist[ref_index],
+                        [imagelist[curr_index] for curr_index in curr_indices]):
+                    continue
+
                 ref_image, ref_label = self.get_image_label(
                     seqname, imagelist, lablist, ref_index, is_ref=True)
                 ref_objs = list(np.unique(ref_label))
 
                 # get curr frames
-                curr_indices = self.get_curr_indices(imagelist, adjusted_index,
-                                                     curr_gaps)
                 curr_images, curr_labels, curr_objs = [], [], []
                 labeled_frames = [1]
                 for curr_index in curr_indices:
@@ -650,7 +735,8 @@ class DAVIS2017_Train(VOSTrain):
                                               dynamic_merge,
                                               enable_prev_frame,
                                               merge_prob=merge_prob,
-                                              max_obj_n=max_obj_n)
+                                              max_obj_n=max_obj_n,
+                                              index_root=os.path.join(root, INDEX_DIR))
 
 class VOST_Train(VOSTrain):
     def __init__(self,
@@ -669,7 +755,8 @@ class VOST_Train(VOSTrain):
                  max_obj_n=10,
                  merge_prob=0.3,
                  ignore_thresh=1.0,
-                 ignore_in_merge=False):
+                 ignore_in_merge=False,
+                 use_shards=False):
         image_root = os.path.join(root, 'JPEGImages')
         label_root = os.path.join(root, 'Annotations')
         valid_root = os.path.join(root, 'ValidAnns')
@@ -681,7 +768,11 @@ class VOST_Train(VOSTrain):
             seqs_tmp = list(map(lambda elem: elem.strip(), seqs_tmp))
             seq_names.extend(seqs_tmp)
         imglistdic = {}
+        shard_root = os.path.join(root, SHARD_DIR) if use_shards else None
         for seq_name in seq_names:
+            if use_shards:
+                imglistdic[seq_name] = sequence_names(shard_root, seq_name)
+                continue
             images = list(
                 np.sort(os.listdir(os.path.join(image_root, seq_name))))
             labels = list(
@@ -702,7 +793,9 @@ class VOST_Train(VOSTrain):
                                               merge_prob=merge_prob,
                                               max_obj_n=max_obj_n,
                                               ignore_thresh=ignore_thresh,
-                                              ignore_in_merge=ignore_in_merge)
+                                              ignore_in_merge=ignore_in_merge,
+                                              index_root=os.path.join(root, INDEX_DIR),
+                                              shard_root=shard_root)
 
 class VISOR_Train(VOSTrain):
     def __init__(self,
@@ -720,7 +813,8 @@ class VISOR_Train(VOSTrain):
                  enable_prev_frame=False,
                  max_obj_n=10,
                  merge_prob=0.3,
-                 ignore_thresh=1.0):
+                 ignore_thresh=1.0,
+                 use_shards=False):
         image_root = os.path.join(root, 'JPEGImages')
         label_root = os.path.join(root, 'Annotations')
         seq_names = []
@@ -731,7 +825,11 @@ class VISOR_Train(VOSTrain):
             seqs_tmp = list(map(lambda elem: elem.strip(), seqs_tmp))
             seq_names.extend(seqs_tmp)
         imglistdic = {}
+        shard_root = os.path.join(root, SHARD_DIR) if use_shards else None
         for seq_name in seq_names:
+            if use_shards:
+                imglistdic[seq_name] = sequence_names(shard_root, seq_name)
+                continue
             images = list(
                 np.sort(os.listdir(os.path.join(image_root, seq_name))))
             labels = list(
@@ -751,7 +849,9 @@ class VISOR_Train(VOSTrain):
                                               enable_prev_frame,
                                               merge_prob=merge_prob,
                                               max_obj_n=max_obj_n,
-                                              ignore_thresh=ignore_thresh)
+                                              ignore_thresh=ignore_thresh,
+                                              index_root=os.path.join(root, INDEX_DIR),
+                                              shard_root=shard_root)
 
 
 class YOUTUBEVOS_Train(VOSTrain):
@@ -766,7 +866,8 @@ class YOUTUBEVOS_Train(VOSTrain):
                  dynamic_merge=True,
                  enable_prev_frame=False,
                  max_obj_n=10,
-                 merge_prob=0.3):
+                 merge_prob=0.3,
+                 use_shards=False):
         root = os.path.join(root, str(year), 'train')
         image_root = os.path.join(root, 'JPEGImages')
         label_root = os.path.join(root, 'Annotations')
@@ -807,7 +908,9 @@ class YOUTUBEVOS_Train(VOSTrain):
                                                dynamic_merge,
                                                enable_prev_frame,
                                                merge_prob=merge_prob,
-                                               max_obj_n=max_obj_n)
+                                               max_obj_n=max_obj_n,
+                                               index_root=os.path.join(root, INDEX_DIR),
+                                               shard_root=os.path.join(root, SHARD_DIR) if use_shards else None)
 
     def _check_preprocess(self):
         if not os.path.isfile(self.seq_list_file):
@@ -4,6 +4,7 @@ import torch.nn.functional as F
 
 import numpy as np
 from typing import Dict, List
+from contextlib import contextmanager
 
 from utils.math import generate_permute_matrix
 from utils.image import one_hot_mask
@@ -209,7 +210,7 @@ class AOTEngine(nn.Module):
         if ignore_mask is None:
             ignore_mask = torch.zeros(
                 one_hot_mask.shape[0], 1, one_hot_mask.shape[2], one_hot_mask.shape[3],
-                device=torch.device('cuda', self.gpu_id),
+                device=one_hot_mask.device,
             )
         if self.cfg.MODEL_IGNORE_TOKEN:
             non_ignored = (ignore_mask == 0).float()
@@ -245,6 +246,7 @@ class AOTEngine(nn.Module):
         frame_step=-1,
         obj_nums=None,
         img_embs=None,
+        pos_emb=None,
     ):
         if self.obj_nums is None and obj_nums is None:
             print('No objects for reference frame!')
@@ -286,7 +288,9 @@ class AOTEngine(nn.Module):
 
         self.curr_one_hot_mask = curr_one_hot_mask
 
-        if self.pos_emb is None:
+        if pos_emb is not None:
+            self.pos_emb = pos_emb
+        elif self.pos_emb is None:
             self.pos_emb = self.AOT.get_pos_emb(curr_enc_embs[-1]).expand(
                 self.batch_size, -1, -1, -1,
             ).view(self.batch_size, -1, self.enc_hw).permute(2, 0, 1)
@@ -319,11 +323,22 @@ class AOTEngine(nn.Module):
         )
 
         self.last_mem_step = frame_step
-        self.AOT.init_LSTT_memory(size_2d=self.enc_size_2d)
+        self.AOT.init_LSTT_memory(
+            size_2d=self.enc_size_2d,
+            memory_capacity=self.long_term_memory_capacity(),
+        )
         self.long_memories_indexes.append(self.frame_step)
 
         self.decode_current_logits(curr_enc_embs, curr_lstt_output)
 
+    def long_term_memory_capacity(self):
+        # restrict_long_memories runs right after an append, so the bank
+        # has to hold one frame more than the restricted length.
+        if hasattr(self.cfg, "FORMER_MEM_LEN") and hasattr(
+                self.cfg, "LATTER_MEM_LEN"):
+            return self.cfg.FORMER_MEM_LEN + self.cfg.LATTER_MEM_LEN + 1
+        return None
+
     def update_short_term_memory(self, curr_mask, curr_id_emb=None, step=0):
         if curr_id_emb is None:
             curr_ignore_mask = None
@@ -674,7 +689,15 @@ class AOTInferEngine(nn.Module):
         merged_logit = torch.logit(merged_prob)
         return merged_logit
 
-    def add_reference_frame(self, img, mask, obj_nums, frame_step=-1):
+    @contextmanager
+    def lstt_memory(self, aot_engine):
+        # The LSTT of the model holds the memories of the sequence. Sub-engines, and the engines of
+        # other test-time augmentations sharing the model, swap their own memories in and out.
+        self.AOT.set_LSTT_memory_state(getattr(aot_engine, 'lstt_memory_state', None))
+        yield
+        aot_engine.lstt_memory_state = self.AOT.get_LSTT_memory_state()
+
+    def add_reference_frame(self, img, mask, obj_nums, frame_step=-1, img_embs=None):
         if isinstance(obj_nums, list):
             obj_nums = obj_nums[0]
         aot_num = max(np.ceil(obj_nums / self.max_aot_obj_num), 1)
@@ -688,27 +711,47 @@ class AOTInferEngine(nn.Module):
             self.aot_engines.append(new_engine)
 
         separated_masks = self.separate_mask(mask)
-        img_embs = None
+        if img_embs is None:
+            img_embs = self.encode_reference_image(img)
+        pos_emb = None
         for aot_engine, separated_mask in zip(
             self.aot_engines,
             separated_masks,
         ):
-            aot_engine.add_reference_frame(
-                img,
-                separated_mask,
-                obj_nums=[self.max_aot_obj_num],
-                frame_step=frame_step,
-                img_embs=img_embs,
-            )
+            with self.lstt_memory(aot_engine):
+                aot_engine.add_reference_frame(
+                    img,
+                    separated_mask,
+                    obj_nums=[self.max_aot_obj_num],
+                    frame_step=frame_step,
+                    img_embs=img_embs,
+                    pos_emb=pos_emb,
+                )
+            pos_emb = aot_engine.pos_emb
 
         self.update_size()
 
-    def match_propogate_one_frame(self, img=None, mask=None, output_size=None):
-        img_embs = None
+    def encode_reference_image(self, img):
+        # With USE_MASK the encoder sees each sub-engine's own objects, so
+        # the reference frame can only be shared without it.
+        if hasattr(self.cfg, "USE_MASK") and self.cfg.USE_MASK:
+            return None
+        return self.AOT.encode_image(img)
+
+    def encode_image(self, img, mask=None):
+        # Encode the current frame once for all sub-engines.
+        if hasattr(self.cfg, "USE_MASK") and self.cfg.USE_MASK:
+            return self.AOT.encode_image(img, mask=mask)
+        return self.AOT.encode_image(img)
+
+    def match_propogate_one_frame(self, img=None, mask=None, output_size=None, img_embs=None):
+        if img_embs is None:
+            img_embs = self.encode_image(img, mask)
         all_logits = []
         for aot_engine in self.aot_engines:
-            logits = aot_engine.match_propogate_one_frame(
-                img, img_embs=img_embs, mask=mask, output_size=output_size)
+            with self.lstt_memory(aot_engine):
+                logits = aot_engine.match_propogate_one_frame(
+                    img, img_embs=img_embs, mask=mask, output_size=output_size)
             all_logits.append(logits)
         pred_id_logits = self.soft_logit_aggregation(all_logits)
         return pred_id_logits
@@ -719,9 +762,28 @@ class AOTInferEngine(nn.Module):
             self.aot_engines,
             separated_masks,
         ):
-            aot_engine.update_short_term_memory(separated_mask)
+            with self.lstt_memory(aot_engine):
+                aot_engine.update_short_term_memory(separated_mask)
 
     def update_size(self):
         self.input_size_2d = self.aot_engines[0].input_size_2d
         self.enc_size_2d = self.aot_engines[0].enc_size_2d
         self.enc_hw = self.aot_engines[0].enc_hw
+
+
+def batch_encode_images(aot_model, imgs):
+    # Images of the same size, like the flipped copies of test-time augmentation, go through the
+    # encoder as one batch. The others get None and are encoded by their engine.
+    img_embs = [None] * len(imgs)
+    if hasattr(aot_model.cfg, "USE_MASK") and aot_model.cfg.USE_MASK:
+        return img_embs
+    groups: Dict[tuple, List[int]] = {}
+    for idx, img in enumerate(imgs):
+        groups.setdefault(tuple(img.size()[2:]), []).append(idx)
+    for indices in groups.values():
+        if len(indices) == 1:
+            continue
+        embs = aot_model.encode_image(torch.cat([imgs[idx] for idx in indices], dim=0))
+        for batch_idx, idx in enumerate(indices):
+            img_embs[idx] = [emb[batch_idx:batch_idx + 1] for emb in embs]
+    return img_embs
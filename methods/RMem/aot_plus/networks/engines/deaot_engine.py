@@ -27,7 +27,7 @@ class DeAOTInferEngine(AOTInferEngine):
         super().__init__(aot_model, gpu_id, long_term_mem_gap,
                          short_term_mem_skip, max_aot_obj_num)
 
-    def add_reference_frame(self, img, mask, obj_nums, frame_step=-1):
+    def add_reference_frame(self, img, mask, obj_nums, frame_step=-1, img_embs=None):
         if isinstance(obj_nums, list):
             obj_nums = obj_nums[0]
         self.obj_nums = obj_nums
@@ -40,17 +40,22 @@ class DeAOTInferEngine(AOTInferEngine):
             self.aot_engines.append(new_engine)
 
         separated_masks = self.separate_mask(mask)
-        img_embs = None
+        if img_embs is None:
+            img_embs = self.encode_reference_image(img)
+        pos_emb = None
         for aot_engine, separated_mask in zip(
             self.aot_engines,
             separated_masks,
         ):
-            aot_engine.add_reference_frame(
-                img,
-                separated_mask,
-                obj_nums=[self.max_aot_obj_num],
-                frame_step=frame_step,
-                img_embs=img_embs,
-            )
+            with self.lstt_memory(aot_engine):
+                aot_engine.add_reference_frame(
+                    img,
+                    separated_mask,
+                    obj_nums=[self.max_aot_obj_num],
+                    frame_step=frame_step,
+                    img_embs=img_embs,
+                    pos_emb=pos_emb,
+                )
+            pos_emb = aot_engine.pos_emb
 
         self.update_size()
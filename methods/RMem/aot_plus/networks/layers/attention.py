@@ -4,6 +4,26 @@ import torch.nn.functional as F
 from networks.layers.basic import DropOutLogit, DWConv2d
 
 
+def frame_attention_mass(Q, K, frame_num, chunk_size=1024):
+    """
+    Attention mass that every query puts on every memory frame, computed over
+    query tiles so the [L_q, T * L_m] attention matrix is never materialized.
+    :param Q: A 4d tensor with shape of [bs, num_head, L_q, d], already scaled
+    :param K: A 4d tensor with shape of [bs, num_head, T * L_m, d]
+    :return: A 3d tensor with shape of [bs, L_q, T], averaged over heads
+    """
+    bs, num_head, l_q, _ = Q.size()
+    K_t = K.transpose(-1, -2)
+    masses = []
+    for start in range(0, l_q, chunk_size):
+        QK = Q[:, :, start:start + chunk_size] @ K_t
+        QK = QK.view(bs, num_head, QK.size(2), frame_num, -1)
+        # softmax over the per-frame log-sum-exp == summed softmax per frame
+        frame_lse = torch.logsumexp(QK.float(), dim=-1)
+        masses.append(torch.softmax(frame_lse, dim=-1).mean(dim=1))
+    return torch.cat(masses, dim=1).to(Q.dtype)
+
+
 # Long-term attention
 class MultiheadAttention(nn.Module):
     def __init__(self, d_model, num_head=8, dropout=0., use_linear=True):
@@ -25,11 +45,14 @@ class MultiheadAttention(nn.Module):
         self.projection = nn.Linear(d_model, d_model)
         self._init_weight()
 
-    def forward(self, Q, K, V, is_return_attn_weight=False):
+    def forward(self, Q, K, V, is_return_attn_weight=False,
+                is_return_frame_mass=False):
         """
         :param Q: A 3d tensor with shape of [T_q, bs, C_q]
         :param K: A 3d tensor with shape of [T_k, bs, C_k]
         :param V: A 3d tensor with shape of [T_v, bs, C_v]
+        :param is_return_frame_mass: return the [bs, T_q, T_k // T_q]
+            attention mass per memory frame instead of the attention map
         """
         num_head = self.num_head
         hidden_dim = self.hidden_dim
@@ -72,6 +95,9 @@ class MultiheadAttention(nn.Module):
                 outputs = F.scaled_dot_product_attention(Q, K, V, None, dropout_p, is_causal=False)
             outputs = outputs.permute(2, 0, 1, 3)
             attn = None
+            if is_return_frame_mass:
+                attn = frame_attention_mass(Q / self.T, K,
+                                            K.size(2) // Q.size(2))
 
         # Restore shape
         outputs = outputs.reshape(-1, bs, self.d_model)
@@ -136,11 +162,14 @@ class GatedPropagation(nn.Module):
 
         self._init_weight()
 
-    def forward(self, Q, K, V, U, size_2d, is_return_attn_weight=False):
+    def forward(self, Q, K, V, U, size_2d, is_return_attn_weight=False,
+                is_return_frame_mass=False):
         """
         :param Q: A 3d tensor with shape of [T_q, bs, C_q]
         :param K: A 3d tensor with shape of [T_k, bs, C_k]
         :param V: A 3d tensor with shape of [T_v, bs, C_v]
+        :param is_return_frame_mass: return the [bs, T_q, T_k // T_q]
+            attention mass per memory frame instead of the attention map
         """
         num_head = self.num_head
         hidden_dim = self.hidden_dim
@@ -202,6 +231,9 @@ class GatedPropagation(nn.Module):
                 outputs = F.scaled_dot_product_attention(Q, K, V, None, dropout_p, is_causal=False)
             outputs = outputs.permute(2, 0, 1, 3)
             attn = None
+            if is_return_frame_mass:
+                attn = frame_attention_mass(Q / self.T, K,
+                                            K.size(2) // Q.size(2))
         # Restore shape
         outputs = outputs.reshape(l, bs, -1) * U
 
@@ -282,7 +314,6 @@ class LocalGatedPropagation(nn.Module):
 
         self.drop_prob = dropout
 
-        self.local_mask = None
         self.last_size_2d = None
         self.qk_mask = None
 
@@ -328,10 +359,7 @@ class LocalGatedPropagation(nn.Module):
             qk = self.correlation_sampler(q, k).view(
                 n, self.num_head, self.window_size * self.window_size, h * w)
         else:
-            unfolded_k = self.pad_and_unfold(k).view(
-                n * self.num_head, self.d_att,
-                self.window_size * self.window_size, h, w)
-            qk = (q.unsqueeze(2) * unfolded_k).sum(dim=1).view(
+            qk = self.local_correlation(q, k).view(
                 n, self.num_head, self.window_size * self.window_size, h * w)
         if self.use_dis:
             qk = 2 * qk - self.pad_and_unfold(
@@ -347,10 +375,8 @@ class LocalGatedPropagation(nn.Module):
 
         local_attn = self.dropout(local_attn)
 
-        global_attn = self.local2global(local_attn, h, w)
-
-        agg_value = (global_attn @ v.transpose(-2, -1)).permute(
-            2, 0, 1, 3).reshape(h * w, n, -1)
+        agg_value = self.local_aggregate(local_attn, v, h, w).permute(
+            3, 0, 1, 2).reshape(h * w, n, -1)
 
         output = agg_value * u
 
@@ -360,46 +386,49 @@ class LocalGatedPropagation(nn.Module):
         self.last_size_2d = (h, w)
         return output, local_attn
 
-    def local2global(self, local_attn, height, width):
-        batch_size = local_attn.size()[0]
-
-        pad_height = height + 2 * self.max_dis
-        pad_width = width + 2 * self.max_dis
-
-        if self.local_mask is not None and (height,
-                                            width) == self.last_size_2d:
-            local_mask = self.local_mask
-        else:
-            ky, kx = torch.meshgrid([
-                torch.arange(0, pad_height, device=local_attn.device),
-                torch.arange(0, pad_width, device=local_attn.device)
-            ])
-            qy, qx = torch.meshgrid([
-                torch.arange(0, height, device=local_attn.device),
-                torch.arange(0, width, device=local_attn.device)
-            ])
-
-            offset_y = qy.reshape(-1, 1) - ky.reshape(1, -1) + self.max_dis
-            offset_x = qx.reshape(-1, 1) - kx.reshape(1, -1) + self.max_dis
-
-            local_mask = (offset_y.abs() <= self.max_dis) & (offset_x.abs() <=
-                                                             self.max_dis)
-            local_mask = local_mask.view(1, 1, height * width, pad_height,
-                                         pad_width)
-            self.local_mask = local_mask
-
-        global_attn = torch.zeros(
-            (batch_size, self.num_head, height * width, pad_height, pad_width),
-            device=local_attn.device)
-        global_attn[local_mask.expand(batch_size, self.num_head,
-                                      -1, -1, -1)] = local_attn.transpose(
-                                          -1, -2).reshape(-1)
-        global_attn = global_attn[:, :, :, self.max_dis:-self.max_dis,
-                                  self.max_dis:-self.max_dis].reshape(
-                                      batch_size, self.num_head,
-                                      height * width, height * width)
-
-        return global_attn
+    def local_aggregate(self, local_attn, v, height, width):
+        """
+        Values of every window weighted by the local attention, accumulated
+        over the window offsets on shifted views of the padded value map so
+        that no [hw, hw] attention is built. The window is not dilated, as in
+        the dense local-to-global expansion this replaces.
+        :param local_attn: [n, num_head, window_size ** 2, hw]
+        :param v: [n, num_head, hidden_dim, hw]
+        :return: [n, num_head, hidden_dim, hw]
+        """
+        n, num_head, hidden_dim, _ = v.size()
+        pad = self.max_dis
+        v = F.pad(v.reshape(n * num_head, hidden_dim, height, width),
+                  (pad, pad, pad, pad))
+        local_attn = local_attn.to(v.dtype).reshape(
+            n * num_head, 1, self.window_size * self.window_size, height,
+            width)
+        agg_value = v.new_zeros((n * num_head, hidden_dim, height, width))
+        for idx in range(self.window_size * self.window_size):
+            dy, dx = divmod(idx, self.window_size)
+            agg_value.addcmul_(local_attn[:, :, idx],
+                               v[:, :, dy:dy + height, dx:dx + width])
+        return agg_value.view(n, num_head, hidden_dim, height * width)
+
+    def local_correlation(self, q, k):
+        """
+        Dot products of every query with the keys of its dilated window, one
+        window offset at a time on shifted views of the padded keys, instead
+        of unfolding all the windows of the key map at once.
+        :param q: [n, d_att, h, w]
+        :param k: [n, d_att, h, w]
+        :return: [n, window_size ** 2, h, w], in the order of pad_and_unfold
+        """
+        n, _, height, width = q.size()
+        pad_pixel = self.max_dis * self.dilation
+        k = F.pad(k, (pad_pixel, pad_pixel, pad_pixel, pad_pixel))
+        qk = q.new_empty((n, self.window_size * self.window_size, height,
+                          width))
+        for idx in range(self.window_size * self.window_size):
+            dy, dx = divmod(idx, self.window_size)
+            dy, dx = dy * self.dilation, dx * self.dilation
+            qk[:, idx] = (q * k[:, :, dy:dy + height, dx:dx + width]).sum(dim=1)
+        return qk
 
     def pad_and_unfold(self, x):
         pad_pixel = self.max_dis * self.dilation
@@ -1,6 +1,7 @@
 import torch
 import torch.nn.functional as F
 from torch import nn
+from torch.utils.checkpoint import checkpoint
 
 
 class GroupNorm1D(nn.Module):
@@ -70,6 +71,19 @@ class ConvGN(nn.Module):
         return self.gn(self.conv(x))
 
 
+def checkpointed(module, enabled, *args, **kwargs):
+    # Recompute the activations of the module in backward instead of keeping
+    # them; the RNG state is replayed so dropout and droppath draw the same
+    # masks twice
+    if enabled and module.training and torch.is_grad_enabled():
+        return checkpoint(module,
+                          *args,
+                          use_reentrant=False,
+                          preserve_rng_state=True,
+                          **kwargs)
+    return module(*args, **kwargs)
+
+
 def seq_to_2d(tensor, size_2d):
     h, w = size_2d
     _, n, c = tensor.size()
@@ -0,0 +1,92 @@
+import torch
+
+
+def keep_index(length, slot):
+    # Indexes left after dropping `slot`, a device tensor so that the
+    # eviction does not wait for the host
+    keep = torch.arange(length - 1, device=slot.device)
+    return keep + (keep >= slot).long()
+
+
+def take_slot(mem, slot):
+    if torch.is_tensor(slot):
+        return mem.index_select(0, slot.view(1))[0]
+    return mem[slot]
+
+
+def drop_slot(mem, slot):
+    if torch.is_tensor(slot):
+        return mem.index_select(0, keep_index(mem.size(0), slot))
+    return torch.cat([mem[0:slot], mem[slot + 1:]], dim=0)
+
+
+class LongTermMemoryBank(object):
+    """Preallocated slot buffer for the long-term memory of one LSTT layer.
+
+    Each memory element (K, V, ...) is stored in a [capacity, L, B, C] buffer.
+    Only the first `length` slots are valid, so readers get a zero-copy view
+    `buffer[:length]` in temporal order.
+    """
+    def __init__(self, memories, max_capacity=None, init_capacity=8):
+        # memories: list of [T, L, B, C] tensors (or None for unused elements)
+        ref = [mem for mem in memories if mem is not None][0]
+        self.length = ref.size(0)
+        self.max_capacity = max_capacity
+        self.capacity = 0
+        self.buffers = [None for _ in memories]
+        self._reserve(max(self.length, init_capacity), memories)
+
+    def _reserve(self, size, memories=None):
+        if size <= self.capacity:
+            return
+        capacity = max(size, 2 * self.capacity)
+        if self.max_capacity is not None:
+            capacity = max(min(capacity, self.max_capacity), size)
+        if memories is None:
+            memories = self.views()
+        buffers = []
+        for mem in memories:
+            if mem is None:
+                buffers.append(None)
+                continue
+            buf = mem.new_empty((capacity, ) + tuple(mem.size()[1:]))
+            buf[:self.length].copy_(mem[:self.length])
+            buffers.append(buf)
+        self.buffers = buffers
+        self.capacity = capacity
+
+    def views(self):
+        return [
+            buf[:self.length] if buf is not None else None
+            for buf in self.buffers
+        ]
+
+    def valid_mask(self):
+        device = [buf for buf in self.buffers if buf is not None][0].device
+        return torch.arange(self.capacity, device=device) < self.length
+
+    def append(self, new_memory):
+        # new_memory: list of [L, B, C] tensors (or None)
+        self._reserve(self.length + 1)
+        for buf, new_e in zip(self.buffers, new_memory):
+            if buf is None or new_e is None:
+                continue
+            buf[self.length].copy_(new_e)
+        self.length += 1
+
+    def write(self, slot, elem_idx, value):
+        self.buffers[elem_idx][slot].copy_(value)
+
+    def evict(self, slot):
+        # Shift the newer slots down in place so the temporal order of the
+        # remaining memories (used by the temporal embeddings) is kept.
+        for buf in self.buffers:
+            if buf is None:
+                continue
+            if torch.is_tensor(slot):
+                buf[:self.length - 1].copy_(
+                    buf.index_select(0, keep_index(self.length, slot)))
+                continue
+            for idx in range(slot, self.length - 1):
+                buf[idx].copy_(buf[idx + 1])
+        self.length -= 1
@@ -3,10 +3,10 @@ import torch.nn.functional as F
 from torch import nn
 import torch
 
-from networks.layers.basic import DropPath, GroupNorm1D, GNActDWConv2d, seq_to_2d
+from networks.layers.basic import DropPath, GroupNorm1D, GNActDWConv2d, seq_to_2d, checkpointed
 from networks.layers.attention import MultiheadAttention, GatedPropagation, LocalGatedPropagation, silu
+from networks.layers.memory_bank import LongTermMemoryBank, take_slot, drop_slot
 from utils.tensor import lbc_2_bchw, bchw_2_lbc
-import numpy as np
 from networks.debug import debug
 # import random
 
@@ -32,6 +32,80 @@ def _get_activation_fn(activation):
         F"activation should be relu/gele/glu, not {activation}.")
 
 
+# Attributes that hold the memories of the sequence being processed, on the LSTT and on its layers
+LSTT_MEMORY_ATTRS = (
+    'lstt_curr_memories', 'lstt_long_memories', 'lstt_short_memories',
+    'short_term_memories_list', 'short_term_memories', 'long_term_memories',
+    'long_term_banks', 'long_term_memory_hidden_states',
+    'stored_attn_weight', 'stored_frame_times',
+)
+LAYER_MEMORY_ATTRS = ('record_T', 'record_attn_weight')
+
+
+def get_memory_state(lstt):
+    return (
+        [getattr(lstt, name, None) for name in LSTT_MEMORY_ATTRS],
+        [[getattr(layer, name, None) for name in LAYER_MEMORY_ATTRS]
+         for layer in lstt.layers],
+    )
+
+
+def set_memory_state(lstt, state):
+    # None leaves the LSTT without memories, as before the first reference frame
+    if state is None:
+        state = ([None] * len(LSTT_MEMORY_ATTRS),
+                 [[None] * len(LAYER_MEMORY_ATTRS)] * len(lstt.layers))
+    lstt_values, layer_values = state
+    for name, value in zip(LSTT_MEMORY_ATTRS, lstt_values):
+        setattr(lstt, name, value)
+    for layer, values in zip(lstt.layers, layer_values):
+        for name, value in zip(LAYER_MEMORY_ATTRS, values):
+            setattr(layer, name, value)
+
+
+# Moving mean of the attention mass and UCB bonus of the long-term memory slots
+ATTN_MOVING_MEAN = 0.8
+UCB_ADD_ITEM = 8
+UCB_MUL_ITEM = 1.5
+
+
+def score_long_memories(attn_weight, stored_attn_weight, stored_frame_times, num_fixed):
+    """
+    Eviction scores of the long-term memory slots, kept as device tensors.
+    attn_weight: [T - 1] attention mass of all slots but the newest one.
+    stored_attn_weight, stored_frame_times: the state of the leading slots
+    from the last call, or None.
+    Returns the new state and the [T - 1] scores. The first num_fixed slots
+    count as visited by every frame. The state stays in float32, half
+    precision visit counts stop at 2048.
+    """
+    attn_weight = attn_weight.float()
+    num_scored = attn_weight.size(0)
+    if stored_attn_weight is not None:
+        num_seen = min(stored_attn_weight.size(0), num_scored)
+        attn_weight = torch.cat([
+            (1 - ATTN_MOVING_MEAN) * stored_attn_weight[:num_seen] +
+            ATTN_MOVING_MEAN * attn_weight[:num_seen],
+            attn_weight[num_seen:],
+        ])
+    frame_times = torch.ones(num_scored + 1, device=attn_weight.device)
+    if stored_frame_times is not None:
+        num_seen = min(stored_frame_times.size(0), num_scored + 1)
+        frame_times[:num_seen] += stored_frame_times[:num_seen]
+    visits = frame_times[:-1].clone()
+    visits[:num_fixed] = num_scored
+    ucb = UCB_MUL_ITEM * torch.sqrt(torch.log(visits.sum()) / (visits + UCB_ADD_ITEM))
+    return attn_weight, frame_times, attn_weight + ucb
+
+
+def drop_memory_scores(lstt, slot):
+    for name in ('stored_attn_weight', 'stored_frame_times'):
+        scores = getattr(lstt, name)
+        if scores is None or (not torch.is_tensor(slot) and slot >= scores.size(0)):
+            continue
+        setattr(lstt, name, drop_slot(scores, slot))
+
+
 class ConvGRUCell(nn.Module):
     def __init__(self, input_dim, hidden_dim, kernel_size, bias):
         """
@@ -152,6 +226,7 @@ class LongShortTermTransformer(nn.Module):
         norm_inp=False,
         time_encode=False,
         gru_memory=False,
+        checkpoint_layers=(),
     ):
 
         super().__init__()
@@ -159,6 +234,8 @@ class LongShortTermTransformer(nn.Module):
         self.final_norm = final_norm
         self.num_layers = num_layers
         self.return_intermediate = return_intermediate
+        # indices of the layers recomputed in backward
+        self.checkpoint_layers = set(checkpoint_layers)
 
         self.emb_dropout = nn.Dropout(emb_dropout, True)
         self.gru_memory = gru_memory
@@ -216,7 +293,8 @@ class LongShortTermTransformer(nn.Module):
 
         for idx, layer in enumerate(self.layers):
             if is_outer_memory:
-                output, memories = layer(
+                output, memories = checkpointed(
+                    layer, idx in self.checkpoint_layers,
                     output,
                     outer_long_memories[idx],
                     outer_short_memories[idx],
@@ -227,7 +305,8 @@ class LongShortTermTransformer(nn.Module):
                     save_atten_weights=save_atten_weights,
                 )
             else:
-                output, memories = layer(
+                output, memories = checkpointed(
+                    layer, idx in self.checkpoint_layers,
                     output,
                     self.long_term_memories[idx] if
                     self.long_term_memories is not None else None,
@@ -291,9 +370,6 @@ class LongShortTermTransformer(nn.Module):
             ])
 
         self.short_term_memories_list.append(lstt_curr_memories_2d)
-        for temp in self.short_term_memories_list[0]:
-            for x in temp:
-                x.cpu()
         self.short_term_memories_list = self.short_term_memories_list[
             -short_term_mem_skip:]
         self.short_term_memories = self.short_term_memories_list[0]
@@ -307,6 +383,13 @@ class LongShortTermTransformer(nn.Module):
         self,
         new_long_term_memories,
     ):
+        if self.long_term_banks is not None:
+            for new_long_term_memory, bank in zip(
+                    new_long_term_memories, self.long_term_banks):
+                bank.append(new_long_term_memory)
+            self.long_term_memories = [
+                bank.views() for bank in self.long_term_banks]
+            return
         updated_long_term_memories = []
         max_size = 48840
         for new_long_term_memory, last_long_term_memory in zip(
@@ -338,78 +421,29 @@ class LongShortTermTransformer(nn.Module):
         if use_atten_weight:
             # record_attn_weight [HW, T]
             # record_attn_weight.sum(dim=-1) = [1, 1, ... 1]
-            attn_weight = torch.stack([
-                self.layers[0].record_attn_weight,
-                self.layers[0].record_attn_weight,
-                # self.layers[1].record_attn_weight,
-                # self.layers[2].record_attn_weight,
-            ]).mean(dim=0)
+            attn_weight = self.layers[0].record_attn_weight
             if foreground_proba is not None:
-                foreground_proba = foreground_proba.squeeze().flatten().unsqueeze(-1)
-                # print(f"{foreground_proba.size() = }")
-                attn_weight = attn_weight * foreground_proba
+                attn_weight = attn_weight * foreground_proba.flatten().unsqueeze(-1)
             attn_weight = attn_weight.sum(dim=0)
             attn_weight = attn_weight / attn_weight.sum()
-            attn_weight = attn_weight.cpu()
-            # print(f"{attn_weight = }")
-
-            # moving mean
-            attn_weight_dict = {
-                long_memories_indexes[i]: attn
-                for i, attn in enumerate(attn_weight)
-            }
-            # print(f"{attn_weight_dict = }")
-            last_attn_weight_dict = self.stored_attn_weight_dict
-            moving_mean_factor = 0.8
-            # print(f"{moving_mean_factor = } x {last_attn_weight_dict = }")
-            attn_weight_dict = {
-                frame_idx:
-                    (1-moving_mean_factor)*last_attn_weight_dict[frame_idx] + moving_mean_factor*attn
-                    if frame_idx in last_attn_weight_dict else attn
-                for frame_idx, attn in attn_weight_dict.items()
-            }
-            # print(f"{attn_weight_dict = }")
-            self.stored_attn_weight_dict = attn_weight_dict
-            for i, _ in enumerate(attn_weight):
-                attn_weight[i] = attn_weight_dict[long_memories_indexes[i]]
-            # print(f"{attn_weight = }")
-
-            # UCB
-            frame_times = {
-                mem_idx: 1
-                for mem_idx in long_memories_indexes
-            }
-            # print(f"{self.stored_frame_times = }")
-            frame_times = {
-                mem_idx: (time + self.stored_frame_times[mem_idx]) if mem_idx in self.stored_frame_times else time
-                for mem_idx, time in frame_times.items()
-            }
-            # print(f"{frame_times = }")
-            self.stored_frame_times = frame_times
-            frame_times_np = torch.Tensor([
-                frame_times[mem_idx]
-                for mem_idx in long_memories_indexes[:-1]
-            ])
-            # print(f"{frame_times_np = }")
-            frame_times_np[0] = len(frame_times_np)
-            if (self.gru_memory) and len(frame_times_np) > 1:
-                frame_times_np[1] = len(frame_times_np)
-            add_item = 8
-            mul_item = 1.5
-            frame_times_param = mul_item * torch.sqrt(torch.log(frame_times_np.sum()) / (frame_times_np + add_item))
-            # print(f"{frame_times_param = }  +  {add_item = }  *  {mul_item = }")
-            attn_weight = attn_weight + frame_times_param
-            # print(f"{attn_weight = }")
-
-            # print(f"{attn_weight = }")
+
             ignore_former_size = 1
             if self.gru_memory:
                 ignore_former_size += 1
-            attn_weight_remove_0 = attn_weight[ignore_former_size:]
-            if attn_weight_remove_0.size(0) > 0:
-                to_drop_idx = torch.argmin(attn_weight_remove_0).item()
-                to_drop_idx += ignore_former_size
+            self.stored_attn_weight, self.stored_frame_times, scores = score_long_memories(
+                attn_weight, self.stored_attn_weight, self.stored_frame_times,
+                ignore_former_size)
+            if scores.size(0) > ignore_former_size:
+                # Kept on the device, the eviction below indexes with it
+                to_drop_idx = torch.argmin(
+                    scores[ignore_former_size:]) + ignore_former_size
         # print(f"{to_drop_idx = }")
+        if self.long_term_banks is not None:
+            self._evict_from_banks(
+                to_drop_idx, former_memory_len + latter_memory_len)
+            drop_memory_scores(self, to_drop_idx)
+            long_memories_indexes.remove(long_memories_indexes[to_drop_idx])
+            return
         is_drop = False
         for layer_idx in range(len(self.layers)):
             memory_k_v = self.long_term_memories[layer_idx]
@@ -422,25 +456,52 @@ class LongShortTermTransformer(nn.Module):
                         # gru = mean_gru
                         hidden_state = self.long_term_memory_hidden_states[layer_idx][i]
                         size_2d = self.long_term_memory_hidden_states[0][0].size()[2:]
-                        gru_input = lbc_2_bchw(mem[to_drop_idx, ...], size_2d)
+                        gru_input = lbc_2_bchw(take_slot(mem, to_drop_idx), size_2d)
                         hidden_state, gru_output = gru(gru_input, hidden_state)
                         gru_output = bchw_2_lbc(gru_output)
+                        new_mem = drop_slot(mem, to_drop_idx)
                         new_mem = torch.cat(
-                            [mem[0:1, ...], gru_output[None, ...], mem[2:to_drop_idx, ...], mem[to_drop_idx+1:, ...]], dim=0)
+                            [new_mem[0:1, ...], gru_output[None, ...], new_mem[2:, ...]], dim=0)
                         self.long_term_memory_hidden_states[layer_idx][i] = hidden_state
                     else:
-                        new_mem = torch.cat(
-                            [mem[0:to_drop_idx, ...], mem[to_drop_idx+1:, ...]], dim=0)
+                        new_mem = drop_slot(mem, to_drop_idx)
                     self.long_term_memories[layer_idx][i] = new_mem
         if is_drop:
+            drop_memory_scores(self, to_drop_idx)
             long_memories_indexes.remove(long_memories_indexes[to_drop_idx])
 
-    def init_memory(self, size_2d=(30, 30)):
+    def _evict_from_banks(self, to_drop_idx, max_memory_len):
+        for layer_idx, bank in enumerate(self.long_term_banks):
+            if bank.length <= max_memory_len:
+                continue
+            if self.gru_memory:
+                size_2d = self.long_term_memory_hidden_states[0][0].size()[2:]
+                for i, mem in enumerate(bank.views()):
+                    gru = self.layers[layer_idx].memory_grus[i]
+                    hidden_state = self.long_term_memory_hidden_states[layer_idx][i]
+                    gru_input = lbc_2_bchw(take_slot(mem, to_drop_idx), size_2d)
+                    hidden_state, gru_output = gru(gru_input, hidden_state)
+                    bank.write(1, i, bchw_2_lbc(gru_output))
+                    self.long_term_memory_hidden_states[layer_idx][i] = hidden_state
+            bank.evict(to_drop_idx)
+        self.long_term_memories = [
+            bank.views() for bank in self.long_term_banks]
+
+    def init_memory(self, size_2d=(30, 30), memory_capacity=None):
         self.long_term_memories = self.lstt_long_memories
+        self.long_term_banks = None
+        if memory_capacity is not None and not torch.is_grad_enabled():
+            # Inference only: in-place slot writes would break autograd.
+            self.long_term_banks = [
+                LongTermMemoryBank(list(mem), max_capacity=memory_capacity)
+                for mem in self.lstt_long_memories
+            ]
+            self.long_term_memories = [
+                bank.views() for bank in self.long_term_banks]
         self.short_term_memories_list = [self.lstt_short_memories]
         self.short_term_memories = self.lstt_short_memories
-        self.stored_attn_weight_dict = {}
-        self.stored_frame_times = {}
+        self.stored_attn_weight = None
+        self.stored_frame_times = None
         if self.gru_memory:
             l, b, c = self.short_term_memories[0][0].size()
             dtype = self.short_term_memories[0][0].dtype
@@ -460,6 +521,7 @@ class LongShortTermTransformer(nn.Module):
         self.short_term_memories_list = []
         self.short_term_memories = None
         self.long_term_memories = None
+        self.long_term_banks = None
         self.long_term_memory_hidden_states = None
 
 
@@ -631,22 +693,12 @@ class SimplifiedTransformerBlock(nn.Module):
 
         tgt2, attn = self.long_term_attn(
             curr_Q_add_time, flatten_global_K, flatten_global_V,
-            is_return_attn_weight=save_atten_weights,
+            is_return_frame_mass=save_atten_weights,
         )
         if save_atten_weights:
-            bs, head, hw, thw = attn.size()
-            self.record_T = thw // hw
-            attn = attn.view((bs, head, hw, self.record_T, hw))
-            attn = attn.mean(dim=1) # bs, hw, T, hw
-            attn = attn[0:1,:]
-            assert attn.size(0) == 1 # only for evaluation
-            attn = attn.squeeze(0) # hw, T, hw
-            self.record_attn_weight = attn.sum(dim=2)
-            self.attn_values, self.attn_indices = \
-                attn.detach().view((hw, thw)).topk(32, dim=-1)
-            self.attn_values, self.attn_indices = \
-                self.attn_values.cpu().numpy(), self.attn_indices.cpu().numpy()
-            self.attn_indices = np.unravel_index(self.attn_indices, (self.record_T, hw))
+            # attn: bs, hw, T
+            self.record_T = attn.size(2)
+            self.record_attn_weight = attn[0].detach() # hw, T
 
         if self.linear_q:
             tgt3 = self.short_term_attn(
@@ -655,22 +707,11 @@ class SimplifiedTransformerBlock(nn.Module):
                 torch.cat((local_V, curr_V), 0),
             )[0]
         else:
-            tgt3, short_attn = self.short_term_attn(
+            tgt3, _ = self.short_term_attn(
                 local_Q,
                 self.norm4(local_K + curr_K),
                 self.norm4(local_V + curr_V),
-                is_return_attn_weight=save_atten_weights,
             )
-        if save_atten_weights:
-            # bs, head, hw, hw
-            short_attn = short_attn.mean(dim=1) # bs, hw, hw
-            short_attn = short_attn[0:1, :]
-            assert short_attn.size(0) == 1 # only for evaluation
-            short_attn = short_attn.squeeze(0) # hw, hw
-            self.short_attn_values, self.short_attn_indices = \
-                short_attn.detach().topk(32, dim=-1)
-            self.short_attn_values, self.short_attn_indices = \
-                self.short_attn_values.cpu().numpy(), self.short_attn_indices.cpu().numpy()
 
         _tgt3 = tgt3
 
@@ -715,13 +756,16 @@ class DualBranchGPM(nn.Module):
                  activation="gelu",
                  return_intermediate=False,
                  intermediate_norm=True,
-                 final_norm=True):
+                 final_norm=True,
+                 checkpoint_layers=()):
 
         super().__init__()
         self.intermediate_norm = intermediate_norm
         self.final_norm = final_norm
         self.num_layers = num_layers
         self.return_intermediate = return_intermediate
+        # indices of the layers recomputed in backward
+        self.checkpoint_layers = set(checkpoint_layers)
 
         self.emb_dropout = nn.Dropout(emb_dropout, True)
         # self.mask_token = nn.Parameter(torch.randn([1, 1, d_model]))
@@ -785,7 +829,8 @@ class DualBranchGPM(nn.Module):
         output_id = None
 
         for idx, layer in enumerate(self.layers):
-            output, output_id, memories = layer(
+            output, output_id, memories = checkpointed(
+                layer, idx in self.checkpoint_layers,
                 output,
                 output_id,
                 self.long_term_memories[idx]
@@ -862,6 +907,13 @@ class DualBranchGPM(nn.Module):
         self,
         new_long_term_memories,
     ):
+        if self.long_term_banks is not None:
+            for new_long_term_memory, bank in zip(
+                    new_long_term_memories, self.long_term_banks):
+                bank.append(new_long_term_memory)
+            self.long_term_memories = [
+                bank.views() for bank in self.long_term_banks]
+            return
         updated_long_term_memories = []
         max_size = 48840
         for new_long_term_memory, last_long_term_memory in zip(
@@ -893,78 +945,35 @@ class DualBranchGPM(nn.Module):
         if use_atten_weight:
             # record_attn_weight [HW, T]
             # record_attn_weight.sum(dim=-1) = [1, 1, ... 1]
-            attn_weight = torch.stack([
-                self.layers[0].record_attn_weight,
-                self.layers[0].record_attn_weight,
-                # self.layers[1].record_attn_weight,
-                # self.layers[2].record_attn_weight,
-            ]).mean(dim=0)
+            attn_weight = self.layers[0].record_attn_weight
             if foreground_proba is not None:
-                foreground_proba = foreground_proba.squeeze().flatten().unsqueeze(-1)
-                # print(f"{foreground_proba.size() = }")
-                attn_weight = attn_weight * foreground_proba
+                attn_weight = attn_weight * foreground_proba.flatten().unsqueeze(-1)
             attn_weight = attn_weight.sum(dim=0)
             attn_weight = attn_weight / attn_weight.sum()
-            attn_weight = attn_weight.cpu()
-            # print(f"{attn_weight = }")
-
-            # moving mean
-            attn_weight_dict = {
-                long_memories_indexes[i]: attn
-                for i, attn in enumerate(attn_weight)
-            }
-            # print(f"{attn_weight_dict = }")
-            last_attn_weight_dict = self.stored_attn_weight_dict
-            moving_mean_factor = 0.8
-            # print(f"{moving_mean_factor = } x {last_attn_weight_dict = }")
-            attn_weight_dict = {
-                frame_idx:
-                    (1-moving_mean_factor)*last_attn_weight_dict[frame_idx] + moving_mean_factor*attn
-                    if frame_idx in last_attn_weight_dict else attn
-                for frame_idx, attn in attn_weight_dict.items()
-            }
-            # print(f"{attn_weight_dict = }")
-            self.stored_attn_weight_dict = attn_weight_dict
-            for i, _ in enumerate(attn_weight):
-                attn_weight[i] = attn_weight_dict[long_memories_indexes[i]]
-            # print(f"{attn_weight = }")
-
-            # UCB
-            frame_times = {
-                mem_idx: 1
-                for mem_idx in long_memories_indexes
-            }
-            # print(f"{self.stored_frame_times = }")
-            frame_times = {
-                mem_idx: (time + self.stored_frame_times[mem_idx]) if mem_idx in self.stored_frame_times else time
-                for mem_idx, time in frame_times.items()
-            }
-            # print(f"{frame_times = }")
-            self.stored_frame_times = frame_times
-            frame_times_np = torch.Tensor([
-                frame_times[mem_idx]
-                for mem_idx in long_memories_indexes[:-1]
-            ])
-            # print(f"{frame_times_np = }")
-            frame_times_np[0] = len(frame_times_np)
-            if (self.gru_memory) and len(frame_times_np) > 1:
-                frame_times_np[1] = len(frame_times_np)
-            add_item = 8
-            mul_item = 1.5
-            frame_times_param = mul_item * torch.sqrt(torch.log(frame_times_np.sum()) / (frame_times_np + add_item))
-            # print(f"{frame_times_param = }  +  {add_item = }  *  {mul_item = }")
-            attn_weight = attn_weight + frame_times_param
-            # print(f"{attn_weight = }")
-
-            # print(f"{attn_weight = }")
+
             ignore_former_size = 1
             if self.gru_memory:
                 ignore_former_size += 1
-            attn_weight_remove_0 = attn_weight[ignore_former_size:]
-            if attn_weight_remove_0.size(0) > 0:
-                to_drop_idx = torch.argmin(attn_weight_remove_0).item()
-                to_drop_idx += ignore_former_size
+            self.stored_attn_weight, self.stored_frame_times, scores = score_long_memories(
+                attn_weight, self.stored_attn_weight, self.stored_frame_times,
+                ignore_former_size)
+            if scores.size(0) > ignore_former_size:
+                # Kept on the device, the eviction below indexes with it
+                to_drop_idx = torch.argmin(
+                    scores[ignore_former_size:]) + ignore_former_size
         # print(f"{to_drop_idx = }")
+        if self.long_term_banks is not None:
+            is_drop = False
+            for bank in self.long_term_banks:
+                if bank.length > (former_memory_len + latter_memory_len):
+                    is_drop = True
+                    bank.evict(to_drop_idx)
+            self.long_term_memories = [
+                bank.views() for bank in self.long_term_banks]
+            if is_drop:
+                drop_memory_scores(self, to_drop_idx)
+                long_memories_indexes.remove(long_memories_indexes[to_drop_idx])
+            return
         is_drop = False
         for layer_idx in range(len(self.layers)):
             memory_k_v = self.long_term_memories[layer_idx]
@@ -979,25 +988,34 @@ class DualBranchGPM(nn.Module):
                         # gru = mean_gru
                         hidden_state = self.long_term_memory_hidden_states[layer_idx][i]
                         size_2d = self.long_term_memory_hidden_states[0][0].size()[2:]
-                        gru_input = lbc_2_bchw(mem[to_drop_idx, ...], size_2d)
+                        gru_input = lbc_2_bchw(take_slot(mem, to_drop_idx), size_2d)
                         hidden_state, gru_output = gru(gru_input, hidden_state)
                         gru_output = bchw_2_lbc(gru_output)
+                        new_mem = drop_slot(mem, to_drop_idx)
                         new_mem = torch.cat(
-                            [mem[0:1, ...], gru_output[None, ...], mem[2:to_drop_idx, ...], mem[to_drop_idx+1:, ...]], dim=0)
+                            [new_mem[0:1, ...], gru_output[None, ...], new_mem[2:, ...]], dim=0)
                         self.long_term_memory_hidden_states[layer_idx][i] = hidden_state
                     else:
-                        new_mem = torch.cat(
-                            [mem[0:to_drop_idx, ...], mem[to_drop_idx+1:, ...]], dim=0)
+                        new_mem = drop_slot(mem, to_drop_idx)
                     self.long_term_memories[layer_idx][i] = new_mem
         if is_drop:
+            drop_memory_scores(self, to_drop_idx)
             long_memories_indexes.remove(long_memories_indexes[to_drop_idx])
 
-    def init_memory(self, size_2d=(30, 30)):
+    def init_memory(self, size_2d=(30, 30), memory_capacity=None):
         self.long_term_memories = self.lstt_long_memories
+        self.long_term_banks = None
+        if memory_capacity is not None and not torch.is_grad_enabled():
+            self.long_term_banks = [
+                LongTermMemoryBank(list(mem), max_capacity=memory_capacity)
+                for mem in self.lstt_long_memories
+            ]
+            self.long_term_memories = [
+                bank.views() for bank in self.long_term_banks]
         self.short_term_memories_list = [self.lstt_short_memories]
         self.short_term_memories = self.lstt_short_memories
-        self.stored_attn_weight_dict = {}
-        self.stored_frame_times = {}
+        self.stored_attn_weight = None
+        self.stored_frame_times = None
 
     def clear_memory(self):
         self.lstt_curr_memories = None
@@ -1007,6 +1025,7 @@ class DualBranchGPM(nn.Module):
         self.short_term_memories_list = []
         self.short_term_memories = None
         self.long_term_memories = None
+        self.long_term_banks = None
 
 
 class GatedPropagationModule(nn.Module):
@@ -1183,33 +1202,15 @@ class GatedPropagationModule(nn.Module):
         cat_local_V = torch.cat([local_V, local_ID_V], dim=1)
 
         cat_tgt2, attn = self.long_term_attn(curr_Q_add_time, flatten_global_K, cat_global_V,
-                                          cat_curr_U, size_2d, is_return_attn_weight=save_atten_weights)
+                                          cat_curr_U, size_2d, is_return_frame_mass=save_atten_weights)
         if save_atten_weights:
-            bs, head, hw, thw = attn.size()
-            self.record_T = thw // hw
-            attn = attn.view((bs, head, hw, self.record_T, hw))
-            attn = attn.mean(dim=1) # bs, hw, T, hw
+            # attn: bs, hw, T
             assert attn.size(0) == 1 # only for evaluation
-            attn = attn.squeeze(0) # hw, T, hw
-            self.record_attn_weight = attn.sum(dim=2)
-            self.attn_values, self.attn_indices = \
-                attn.detach().view((hw, thw)).topk(32, dim=-1)
-            self.attn_values, self.attn_indices = \
-                self.attn_values.cpu().numpy(), self.attn_indices.cpu().numpy()
-            self.attn_indices = np.unravel_index(self.attn_indices, (self.record_T, hw))
-
-        cat_tgt3, short_attn = self.short_term_attn(local_Q, local_K, cat_local_V,
-                                           cat_curr_U, size_2d)
+            self.record_T = attn.size(2)
+            self.record_attn_weight = attn[0].detach() # hw, T
 
-        if save_atten_weights:
-            # bs, head, hw, hw
-            short_attn = short_attn.mean(dim=1) # bs, hw, hw
-            assert short_attn.size(0) == 1 # only for evaluation
-            short_attn = short_attn.squeeze(0) # hw, hw
-            self.short_attn_values, self.short_attn_indices = \
-                short_attn.detach().topk(32, dim=-1)
-            self.short_attn_values, self.short_attn_indices = \
-                self.short_attn_values.cpu().numpy(), self.short_attn_indices.cpu().numpy()
+        cat_tgt3, _ = self.short_term_attn(local_Q, local_K, cat_local_V,
+                                           cat_curr_U, size_2d)
 
         tgt2, tgt_id2 = torch.split(cat_tgt2, self.d_model, dim=-1)
         tgt3, tgt_id3 = torch.split(cat_tgt3, self.d_model, dim=-1)
@@ -1,6 +1,6 @@
-import copy
 import gc
 import os
+import contextlib
 import time
 import datetime as datetime
 import json
@@ -18,13 +18,54 @@ from tqdm import tqdm
 from dataloaders.eval_datasets import YOUTUBEVOS_Test, YOUTUBEVOS_DenseTest, DAVIS_Test, EVAL_TEST, VOST_Test, LONG_VIDEOS_Test, ROVES_Test
 import dataloaders.video_transforms as tr
 
-from utils.image import flip_tensor, save_mask
+from utils.image import flip_tensor, AsyncMaskWriter
 from utils.checkpoint import load_network
+from utils.device import get_device, Timer, max_memory_gb
 from utils.eval import zip_folder
+from utils.sync_audit import SyncAuditor
 
 from networks.models import build_vos_model
 from networks.engines import build_engine
-from networks.engines.aot_engine import AOTEngine, AOTInferEngine
+from networks.engines.aot_engine import AOTEngine, AOTInferEngine, batch_encode_images
+
+
+def sequence_frame_num(dataset, seq_idx):
+    # Cheap frame count without building the sequence dataset
+    seq_name = dataset.seqs[seq_idx]
+    if hasattr(dataset, 'ann_f'):
+        objects = dataset.ann_f[seq_name]['objects'].values()
+        return len(set(frame for obj in objects for frame in obj['frames']))
+    if hasattr(dataset, 'image_root'):
+        return len(os.listdir(os.path.join(dataset.image_root, seq_name)))
+    return 0
+
+
+def claim_sequences(dataset, seq_queue=None, rank=0, gpu_num=1):
+    """
+    Yield (seq_idx, seq_dataset) for the sequences claimed by this rank.
+    With a queue, rank 0 fills it longest first and every rank takes the next
+    sequence when it is free, the sequence dataset is only built once claimed.
+    """
+    if seq_queue is None:
+        for seq_idx in range(len(dataset)):
+            yield seq_idx, dataset[seq_idx]
+        return
+
+    if rank == 0:
+        frame_nums = [
+            sequence_frame_num(dataset, seq_idx)
+            for seq_idx in range(len(dataset))
+        ]
+        for seq_idx in sorted(range(len(dataset)),
+                              key=lambda idx: -frame_nums[idx]):
+            seq_queue.put(seq_idx)
+        for _ in range(gpu_num):
+            seq_queue.put('END')
+    while True:
+        seq_idx = seq_queue.get()
+        if seq_idx == 'END':
+            return
+        yield seq_idx, dataset[seq_idx]
 
 
 class Evaluator(object):
@@ -46,11 +87,17 @@ class Evaluator(object):
         self.print_log(
             json.dumps(cfg.__dict__, indent=4, sort_keys=True))
 
-        print(f"Use GPU {self.gpu} for evaluating.")
-        torch.cuda.set_device(self.gpu)
+        self.device = get_device(
+            cfg.TEST_DEVICE if hasattr(cfg, "TEST_DEVICE") else 'cuda',
+            self.gpu)
+        if self.device.type == 'cuda':
+            print(f"Use GPU {self.gpu} for evaluating.")
+            torch.cuda.set_device(self.gpu)
+        else:
+            print(f"Use CPU with {torch.get_num_threads()} threads for evaluating.")
 
         self.print_log('Build VOS model.')
-        self.model = build_vos_model(cfg.MODEL_VOS, cfg).cuda(self.gpu)
+        self.model = build_vos_model(cfg.MODEL_VOS, cfg).to(self.device)
 
         self.process_pretrained_model()
 
@@ -90,7 +137,7 @@ class Evaluator(object):
             self.model, removed_dict = load_network(
                 self.model,
                 cfg.TEST_CKPT_PATH,
-                self.gpu,
+                self.device,
             )
             if len(removed_dict) > 0:
                 self.print_log(
@@ -103,7 +150,7 @@ class Evaluator(object):
             self.model, removed_dict = load_network(
                 self.model,
                 cfg.TEST_CKPT_PATH,
-                self.gpu,
+                self.device,
             )
             if len(removed_dict) > 0:
                 self.print_log(
@@ -306,7 +353,6 @@ class Evaluator(object):
     def evaluating(self):
         cfg = self.cfg
         self.model.eval()
-        video_num = 0
         processed_video_num = 0
         total_time = 0
         total_frame = 0
@@ -314,27 +360,20 @@ class Evaluator(object):
         total_video_num = len(self.dataset)
         start_eval_time = time.time()
 
-        if self.seq_queue is not None:
-            if self.rank == 0:
-                for seq_idx in range(total_video_num):
-                    self.seq_queue.put(seq_idx)
-                for _ in range(self.gpu_num):
-                    self.seq_queue.put('END')
-            coming_seq_idx = self.seq_queue.get()
-
         all_engines: List[AOTInferEngine] = []
-        with torch.no_grad():
-            for seq_idx, seq_dataset in enumerate(self.dataset):
-                video_num += 1
-
-                if self.seq_queue is not None:
-                    if coming_seq_idx == 'END':
-                        break
-                    elif coming_seq_idx != seq_idx:
-                        continue
-                    else:
-                        coming_seq_idx = self.seq_queue.get()
-
+        timer = Timer(self.device)
+        mask_writer = AsyncMaskWriter(
+            num_workers=cfg.TEST_MASK_WRITERS if hasattr(
+                cfg, "TEST_MASK_WRITERS") else 4,
+            compress_level=cfg.TEST_MASK_COMPRESS_LEVEL if hasattr(
+                cfg, "TEST_MASK_COMPRESS_LEVEL") else None,
+        )
+        sync_auditor = SyncAuditor() if hasattr(
+            cfg, "TEST_AUDIT_SYNCS") and cfg.TEST_AUDIT_SYNCS else None
+        with torch.no_grad(), (sync_auditor or contextlib.nullcontext()):
+            for seq_idx, seq_dataset in claim_sequences(
+                    self.dataset, self.seq_queue, self.rank, self.gpu_num):
+                video_num = seq_idx + 1
                 processed_video_num += 1
 
                 for engine in all_engines:
@@ -347,14 +386,15 @@ class Evaluator(object):
                 # mark_path = os.path.join(self.result_root, f"{seq_name}_mark")
                 # open(mark_path, 'w')
                 gc.collect()
-                torch.cuda.empty_cache()
+                if self.device.type == 'cuda':
+                    torch.cuda.empty_cache()
 
                 seq_dataloader = DataLoader(
                     seq_dataset,
                     batch_size=1,
                     shuffle=False,
                     num_workers=cfg.TEST_WORKERS,
-                    pin_memory=True,
+                    pin_memory=self.device.type == 'cuda',
                 )
 
                 if 'all_frames' in cfg.TEST_DATASET_SPLIT:
@@ -368,7 +408,6 @@ class Evaluator(object):
 
                 seq_total_time = 0
                 seq_total_frame = 0
-                seq_pred_masks = {'dense': [], 'sparse': []}
                 seq_timers = []
 
                 num_frames = len(seq_dataset)
@@ -385,19 +424,34 @@ class Evaluator(object):
                     all_preds = []
                     new_obj_label = None
 
+                    if frame_idx > 0:
+                        seq_timers.append([timer.record()])
+                    if sync_auditor is not None:
+                        sync_auditor.start_frame()
+                    for sample in samples:
+                        sample['current_img'] = sample['current_img'].to(
+                            self.device,
+                            non_blocking=True,
+                        )
+                    all_img_embs = batch_encode_images(
+                        self.model, [sample['current_img'] for sample in samples])
+
                     # ??? batch_size = 1 应该不会有aug_idx >= 1的时候吧
                     for aug_idx in range(len(samples)):
                         if len(all_engines) <= aug_idx:
+                            # All augmentations share the model, the engines keep their own memories
                             all_engines.append(
                                 build_engine(
                                     cfg.MODEL_ENGINE,
                                     phase='eval',
-                                    aot_model=self.model if aug_idx==0 else copy.deepcopy(self.model),
+                                    aot_model=self.model,
                                     gpu_id=self.gpu,
                                     long_term_mem_gap=self.cfg.
                                     TEST_LONG_TERM_MEM_GAP,
                                 ))
                             all_engines[-1].eval()
+                            if sync_auditor is not None:
+                                sync_auditor.watch(all_engines[-1])
 
                         engine = all_engines[aug_idx]
                         engine.long_term_mem_gap = gap
@@ -417,15 +471,10 @@ class Evaluator(object):
                         obj_idx = [int(_obj_idx) for _obj_idx in obj_idx]
 
                         current_img = sample['current_img']
-                        current_img = current_img.cuda(
-                            self.gpu,
-                            non_blocking=True,
-                        )
-                        sample['current_img'] = current_img
 
                         if 'current_label' in sample.keys():
-                            current_label = sample['current_label'].cuda(
-                                self.gpu, non_blocking=True).float()
+                            current_label = sample['current_label'].to(
+                                self.device, non_blocking=True).float()
                         else:
                             current_label = None
                         #############################################################
@@ -440,16 +489,10 @@ class Evaluator(object):
                                 _current_label,
                                 frame_step=0,
                                 obj_nums=obj_nums,
+                                img_embs=all_img_embs[aug_idx],
                             )
                             pred_prob = _current_label
                         else:
-                            if aug_idx == 0:
-                                seq_timers.append([])
-                                now_timer = torch.cuda.Event(
-                                    enable_timing=True)
-                                now_timer.record()
-                                seq_timers[-1].append((now_timer))
-
                             if self.cfg.USE_MASK:
                                 if self.cfg.PREV_PROBE:
                                     pred_logit = engine.match_propogate_one_frame(
@@ -467,7 +510,8 @@ class Evaluator(object):
                                     raise Exception("Unexpeted !")
                             else:
                                 pred_logit = engine.match_propogate_one_frame(
-                                    current_img, output_size=(ori_height, ori_width))
+                                    current_img, output_size=(ori_height, ori_width),
+                                    img_embs=all_img_embs[aug_idx])
                             if cfg.DEBUG_FIX_RANDOM:
                                 print(f"\n [{self.rank}] : {frame_idx = } {pred_logit[0, :7, 100, 100] = }")
 
@@ -554,6 +598,7 @@ class Evaluator(object):
                                     current_label,
                                     obj_nums=new_obj_nums,
                                     frame_step=frame_idx,
+                                    img_embs=all_img_embs[aug_idx],
                                 )
                         else:
                             if cfg.TEST_FLIP:
@@ -571,55 +616,38 @@ class Evaluator(object):
                                 )
                                 engine.update_memory(current_label)
 
-                        now_timer = torch.cuda.Event(enable_timing=True)
-                        now_timer.record()
-                        seq_timers[-1].append((now_timer))
+                        seq_timers[-1].append(timer.record())
 
                         if cfg.TEST_FRAME_LOG:
-                            torch.cuda.synchronize()
-                            one_frametime = seq_timers[-1][0].elapsed_time(
-                                seq_timers[-1][1]) / 1e3
+                            one_frametime = seq_timers[-1][1] - seq_timers[-1][0]
                             obj_num = obj_nums[0]
                             print(
                                 f"GPU {self.gpu} - Frame: {imgname[0].split('.')[0]} - Obj Num: {obj_num}, Time: {int(one_frametime * 1e3)}ms")
 
                         # Save result
-                        seq_pred_masks['dense'].append({
-                            'path':
+                        pred_mask = pred_label.squeeze(0).squeeze(0).cpu()
+                        mask_writer.write(
+                            pred_mask,
                             os.path.join(
                                 self.result_root, seq_name,
                                 imgname[0].split('.')[0] + '.png',
                             ),
-                            'mask':
-                            pred_label.detach().cpu(),
-                            'obj_idx':
-                            obj_idx
-                        })
+                            obj_idx,
+                        )
                         if 'all_frames' in cfg.TEST_DATASET_SPLIT and imgname in images_sparse:
-                            seq_pred_masks['sparse'].append({
-                                'path':
+                            mask_writer.write(
+                                pred_mask,
                                 os.path.join(
                                     self.result_root_sparse, seq_name,
                                     imgname[0].split('.')[0] + '.png',
                                 ),
-                                'mask':
-                                pred_label.detach().cpu(),
-                                'obj_idx':
-                                obj_idx
-                            })
-
-                # Save result
-                for mask_result in seq_pred_masks['dense'] + seq_pred_masks[
-                        'sparse']:
-                    save_mask(
-                        mask_result['mask'].squeeze(0).squeeze(0),
-                        mask_result['path'], mask_result['obj_idx'],
-                    )
-                del (seq_pred_masks)
+                                obj_idx,
+                            )
 
-                for timer in seq_timers:
-                    torch.cuda.synchronize()
-                    one_frametime = timer[0].elapsed_time(timer[1]) / 1e3
+                mask_writer.flush()
+
+                for frame_timer in seq_timers:
+                    one_frametime = frame_timer[1] - frame_timer[0]
                     seq_total_time += one_frametime
                     seq_total_frame += 1
                 del (seq_timers)
@@ -630,12 +658,16 @@ class Evaluator(object):
                 total_avg_time_per_frame = total_time / total_frame
                 total_sfps += seq_avg_time_per_frame
                 avg_sfps = total_sfps / processed_video_num
-                max_mem = torch.cuda.max_memory_allocated(
-                    device=self.gpu) / (1024.**3)
+                max_mem = max_memory_gb(self.device)
                 print(
                     f"GPU {self.gpu} - Seq {seq_name} - FPS: {1. / seq_avg_time_per_frame:.2f}. All-Frame FPS: {1. / total_avg_time_per_frame:.2f}, All-Seq FPS: {1. / avg_sfps:.2f}, Max Mem: {max_mem:.2f}G")
+                if sync_auditor is not None:
+                    print(f"GPU {self.gpu} - Seq {seq_name} - {sync_auditor.summary()}")
+                    sync_auditor.reset()
                 # os.remove(mark_path)
 
+        mask_writer.close()
+
         if self.seq_queue is not None:
             if self.rank != 0:
                 self.info_queue.put({
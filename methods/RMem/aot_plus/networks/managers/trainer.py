@@ -17,10 +17,11 @@ import dataloaders.video_transforms as tr
 
 from utils.meters import AverageMeter
 from utils.image import label2colormap, masked_image, save_image
-from utils.checkpoint import load_network_and_optimizer, load_network, save_network
+from utils.checkpoint import load_network_and_optimizer, load_network, save_network, load_ema_state
 from utils.learning import adjust_learning_rate, get_trainable_params
 from utils.metric import pytorch_iou
 from utils.ema import ExponentialMovingAverage, get_param_buffer_for_ema
+from utils.phase_profiler import PhaseProfiler
 
 from networks.models import build_vos_model
 from networks.engines import build_engine
@@ -128,9 +129,12 @@ class Trainer(object):
                 ema_decay = 1. - 1. / (total_steps * cfg.TRAIN_EMA_RATIO)
                 self.ema_params = get_param_buffer_for_ema(
                     self.model, update_buffer=(not cfg.MODEL_FREEZE_BN))
+                ema_update_every = cfg.TRAIN_EMA_UPDATE_EVERY if hasattr(
+                    cfg, 'TRAIN_EMA_UPDATE_EVERY') else 1
                 self.ema = ExponentialMovingAverage(
                     self.ema_params,
                     decay=ema_decay,
+                    update_every=ema_update_every,
                 )
                 self.ema_dir = cfg.DIR_EMA_CKPT
             except Exception as inst:
@@ -210,6 +214,7 @@ class Trainer(object):
                         self.print_log(
                             'Remove {} from EMA model.'.format(removed_dict))
                     ema_decay = self.ema.decay
+                    ema_update_every = self.ema.update_every
                     del (self.ema)
 
                     ema_params = get_param_buffer_for_ema(
@@ -217,8 +222,14 @@ class Trainer(object):
                     self.ema = ExponentialMovingAverage(
                         ema_params,
                         decay=ema_decay,
+                        update_every=ema_update_every,
                     )
-                    self.ema.num_updates = cfg.TRAIN_RESUME_CKPT
+                    ema_state = load_ema_state(ema_ckpt_dir)
+                    if ema_state is not None:
+                        self.ema.load_state_dict(ema_state)
+                    else:
+                        self.ema.num_updates = cfg.TRAIN_RESUME_CKPT
+                        self.ema.num_steps = cfg.TRAIN_RESUME_CKPT
                 except Exception as inst:
                     self.print_log(inst)
                     self.print_log('Error: EMA model not found!')
@@ -297,6 +308,9 @@ class Trainer(object):
             tr.ToTensor(),
         ])
 
+        # read the frames from tools/build_shards.py shards, not loose files
+        use_shards = hasattr(cfg, 'DATA_USE_SHARDS') and cfg.DATA_USE_SHARDS
+
         train_datasets = []
         if 'static' in cfg.DATASETS:
             pretrain_vos_dataset = StaticTrain(
@@ -334,6 +348,7 @@ class Trainer(object):
                 max_obj_n=cfg.MODEL_MAX_OBJ_NUM,
                 ignore_thresh=cfg.DATA_VOST_IGNORE_THRESH,
                 ignore_in_merge=cfg.IGNORE_IN_MERGE,
+                use_shards=use_shards,
             )
             train_datasets.append(train_vost_dataset)
 
@@ -348,6 +363,7 @@ class Trainer(object):
                 merge_prob=cfg.DATA_DYNAMIC_MERGE_PROB,
                 max_obj_n=cfg.MODEL_MAX_OBJ_NUM,
                 ignore_thresh=cfg.DATA_VISOR_IGNORE_THRESH,
+                use_shards=use_shards,
             )
             train_datasets.append(train_vost_dataset)
 
@@ -360,6 +376,7 @@ class Trainer(object):
                 rand_reverse=cfg.DATA_RANDOM_REVERSE_SEQ,
                 merge_prob=cfg.DATA_DYNAMIC_MERGE_PROB,
                 max_obj_n=cfg.MODEL_MAX_OBJ_NUM,
+                use_shards=use_shards,
             )
             train_datasets.append(train_ytb_dataset)
 
@@ -504,6 +521,15 @@ class Trainer(object):
         max_itr = cfg.TRAIN_TOTAL_STEPS
         start_seq_training_step = int(
             cfg.TRAIN_SEQ_TRAINING_START_RATIO * max_itr)
+        profile_dump_step = cfg.TRAIN_PROFILE_DUMP_STEP if hasattr(
+            cfg, 'TRAIN_PROFILE_DUMP_STEP') else 0
+        # dumping implies profiling
+        profiler = PhaseProfiler(
+            enabled=(hasattr(cfg, 'TRAIN_PROFILE_PHASES')
+                     and cfg.TRAIN_PROFILE_PHASES) or profile_dump_step > 0,
+            dump_dir=cfg.DIR_LOG,
+            dump_step=profile_dump_step,
+            rank=self.rank)
 
         self.print_log('Start training:')
         model.train()
@@ -513,7 +539,9 @@ class Trainer(object):
             epoch += 1
             print(f"{epoch = }")
             last_time = time.time()
+            profiler.start()
             for frame_idx, sample in enumerate(train_loader):
+                profiler.lap('data')
                 if step > cfg.TRAIN_TOTAL_STEPS:
                     print(
                         f"{step = } is larger than {cfg.TRAIN_TOTAL_STEPS = }, Break !")
@@ -569,6 +597,7 @@ class Trainer(object):
                 ]
                 obj_nums = list(obj_nums)
                 obj_nums = [int(obj_num) for obj_num in obj_nums]
+                profiler.lap('h2d')
 
                 batch_size = ref_imgs.size(0)
 
@@ -602,8 +631,10 @@ class Trainer(object):
                         if cfg.DEBUG_FIX_RANDOM:
                             print(f"[{self.rank}] : Loss {loss} | ")
                         loss = torch.mean(loss)
+                    profiler.lap('forward')
 
                     self.scaler.scale(loss).backward()
+                    profiler.lap('backward')
                     self.scaler.unscale_(optimizer)
                     torch.nn.utils.clip_grad_norm_(
                         model.parameters(),
@@ -611,6 +642,7 @@ class Trainer(object):
                     )
                     self.scaler.step(optimizer)
                     self.scaler.update()
+                    profiler.lap('optimizer')
                 else:
                     loss, all_pred, all_loss, boards = model(
                         all_frames,
@@ -624,13 +656,16 @@ class Trainer(object):
                     if cfg.DEBUG_FIX_RANDOM:
                         print(f"Loss {loss} | ")
                     loss = torch.mean(loss)
+                    profiler.lap('forward')
 
                     torch.nn.utils.clip_grad_norm_(
                         model.parameters(),
                         cfg.TRAIN_CLIP_GRAD_NORM,
                     )
                     loss.backward()
+                    profiler.lap('backward')
                     optimizer.step()
+                    profiler.lap('optimizer')
 
                 for idx in range(seq_len):
                     now_pred = all_pred[idx].detach()
@@ -651,9 +686,11 @@ class Trainer(object):
                     if self.rank == 0:
                         running_losses[idx].update(now_loss.item())
                         running_ious[idx].update(now_iou.item())
+                profiler.lap('metrics')
 
                 if self.rank == 0:
                     self.ema.update(self.ema_params)
+                    profiler.lap('ema')
 
                     avg_obj.update(sum(obj_nums) / float(len(obj_nums)))
                     curr_time = time.time()
@@ -691,6 +728,8 @@ class Trainer(object):
                             running_ious[idx].reset()
 
                         self.print_log(strs)
+                        if profiler.enabled:
+                            self.print_log(profiler.summary())
 
                 step += 1
 
@@ -720,7 +759,9 @@ class Trainer(object):
                         self.ema.store(self.ema_params)
                         # Copy EMA parameters to model
                         self.ema.copy_to(self.ema_params)
-                        # Save EMA model
+                        # Save EMA model, the shadow parameters are its weights
+                        ema_state = self.ema.state_dict()
+                        del ema_state['shadow_buffers']
                         save_network(
                             self.model,
                             optimizer,
@@ -729,6 +770,7 @@ class Trainer(object):
                             cfg.TRAIN_MAX_KEEP_CKPT,
                             backup_dir='./saved_ema_models',
                             scaler=self.scaler,
+                            ema=ema_state,
                         )
                         # Restore original parameters to resume training later
                         self.ema.restore(self.ema_params)
@@ -736,6 +778,8 @@ class Trainer(object):
                         self.print_log(inst)
                         self.print_log('Error: failed to save EMA model!')
 
+                profiler.end_step(step)
+
         self.print_log('Stop training!')
 
     def print_log(self, string):
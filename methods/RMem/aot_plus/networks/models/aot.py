@@ -2,8 +2,9 @@ import torch
 import torch.nn as nn
 
 from networks.encoders import build_encoder
-from networks.layers.transformer import LongShortTermTransformer
+from networks.layers.transformer import LongShortTermTransformer, get_memory_state, set_memory_state
 from networks.decoders import build_decoder
+from networks.layers.basic import checkpointed
 from networks.layers.position import PositionEmbeddingSine
 from utils.tensor import bchw_2_lbc
 from timm.models.layers import trunc_normal_
@@ -28,6 +29,12 @@ class AOT(nn.Module):
             kernel_size=1,
         )
 
+        # blocks whose activations are recomputed in backward
+        self.checkpoint_lstt_layers = cfg.TRAIN_CHECKPOINT_LSTT_LAYERS if hasattr(
+            cfg, 'TRAIN_CHECKPOINT_LSTT_LAYERS') else ()
+        self.checkpoint_decoder = hasattr(
+            cfg, 'TRAIN_CHECKPOINT_DECODER') and cfg.TRAIN_CHECKPOINT_DECODER
+
         self.LSTT = LongShortTermTransformer(
             cfg.MODEL_LSTT_NUM,
             cfg.MODEL_ENCODER_EMBEDDING_DIM,
@@ -45,6 +52,7 @@ class AOT(nn.Module):
             norm_inp=cfg.MODEL_NORM_INP,
             time_encode=cfg.TIME_ENCODE,
             gru_memory=cfg.GRU_MEMORY,
+            checkpoint_layers=self.checkpoint_lstt_layers,
         )
 
         decoder_indim = cfg.MODEL_ENCODER_EMBEDDING_DIM * \
@@ -142,7 +150,7 @@ class AOT(nn.Module):
         for emb in lstt_emb:
             decoder_inputs.append(emb.view(h, w, n, c).permute(2, 3, 0, 1))
         # decdoer_input: [tensor(N, fea_C, fea_H, fea_W)]
-        pred_logit = self.decoder(decoder_inputs, shortcuts) # (N,  fea_C = 11  , (fea_H * 2 - 1)*2 -1, (fea_H * 2 - 1)*2 -1   )
+        pred_logit = checkpointed(self.decoder, self.checkpoint_decoder, decoder_inputs, shortcuts) # (N,  fea_C = 11  , (fea_H * 2 - 1)*2 -1, (fea_H * 2 - 1)*2 -1   )
         return pred_logit
 
     def LSTT_forward(
@@ -187,12 +195,18 @@ class AOT(nn.Module):
         self.__var_losses = []
         return var_loss
 
-    def init_LSTT_memory(self, size_2d=(30, 30)):
-        self.LSTT.init_memory(size_2d)
+    def init_LSTT_memory(self, size_2d=(30, 30), memory_capacity=None):
+        self.LSTT.init_memory(size_2d, memory_capacity=memory_capacity)
 
     def clear_LSTT_memory(self):
         self.LSTT.clear_memory()
 
+    def get_LSTT_memory_state(self):
+        return get_memory_state(self.LSTT)
+
+    def set_LSTT_memory_state(self, state):
+        set_memory_state(self.LSTT, state)
+
     def update_short_term_memory(
             self,
             curr_id_emb,
@@ -4,6 +4,7 @@ import torch.nn as nn
 from networks.layers.transformer import DualBranchGPM
 from networks.models.aot import AOT
 from networks.decoders import build_decoder
+from networks.layers.basic import checkpointed
 from timm.models.layers import trunc_normal_
 
 
@@ -23,7 +24,8 @@ class DeAOT(AOT):
             droppath_lst=cfg.TRAIN_LSTT_DROPPATH_LST,
             droppath_scaling=cfg.TRAIN_LSTT_DROPPATH_SCALING,
             intermediate_norm=cfg.MODEL_DECODER_INTERMEDIATE_LSTT,
-            return_intermediate=True)
+            return_intermediate=True,
+            checkpoint_layers=self.checkpoint_lstt_layers)
 
         decoder_indim = cfg.MODEL_ENCODER_EMBEDDING_DIM * \
             (cfg.MODEL_LSTT_NUM * 2 +
@@ -59,7 +61,8 @@ class DeAOT(AOT):
         decoder_inputs = [shortcuts[-1]]
         for emb in lstt_emb:
             decoder_inputs.append(emb.view(h, w, n, -1).permute(2, 3, 0, 1))
-        pred_logit = self.decoder(decoder_inputs, shortcuts)
+        pred_logit = checkpointed(self.decoder, self.checkpoint_decoder,
+                                  decoder_inputs, shortcuts)
         return pred_logit
 
     def get_id_emb(self, x):
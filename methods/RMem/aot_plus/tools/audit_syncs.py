@@ -0,0 +1,64 @@
+import sys
+import argparse
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+import torch.nn.functional as F
+
+import networks.debug
+from networks.models import build_vos_model
+from networks.engines import build_engine
+from tools.benchmark_tta import tiny_config, synthetic_sequence
+from utils.sync_audit import SyncAuditor
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Count the host syncs per frame of the inference engine "
+        "on a synthetic sequence and fail above a budget")
+    parser.add_argument('--engine', type=str, default='aotengine')
+    parser.add_argument('--frames', type=int, default=16)
+    parser.add_argument('--size', type=int, default=161)
+    parser.add_argument('--obj_num', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='frames before the steady state')
+    parser.add_argument('--max_syncs', type=int, default=1,
+                        help='budget of host syncs per steady-state frame')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    networks.debug.GLOBAL_IS_DEBUG = False
+    cfg = tiny_config(args)
+    cfg.MODEL_ENGINE = args.engine
+    model = build_vos_model(cfg.MODEL_VOS, cfg).eval()
+    engine = build_engine(cfg.MODEL_ENGINE, phase='eval', aot_model=model,
+                          long_term_mem_gap=cfg.TEST_LONG_TERM_MEM_GAP).eval()
+    frames, mask = synthetic_sequence(args.frames, args.size, args.obj_num)
+    output_size = frames[0].size()[2:]
+
+    with torch.no_grad(), SyncAuditor() as auditor:
+        auditor.watch(engine)
+        for frame_idx, img in enumerate(frames):
+            auditor.start_frame()
+            if frame_idx == 0:
+                engine.add_reference_frame(img, mask, obj_nums=[args.obj_num],
+                                           frame_step=0)
+                continue
+            pred_logit = engine.match_propogate_one_frame(
+                img, output_size=output_size)
+            pred_label = torch.argmax(pred_logit, dim=1, keepdim=True).float()
+            engine.update_memory(
+                F.interpolate(pred_label, size=engine.input_size_2d,
+                              mode='nearest'))
+
+    print(auditor.summary(skip_frames=args.warmup, top=args.top))
+    steady = auditor.frame_counts()[args.warmup:]
+    assert max(steady) <= args.max_syncs, \
+        f"{max(steady)} host syncs in a steady-state frame, budget {args.max_syncs}"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import sys
+import time
+import argparse
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+
+from networks.layers.attention import frame_attention_mass
+
+
+def dense_attention_mass(Q, K, frame_num):
+    # reference: the explicit softmax path used before
+    bs, num_head, hw, _ = Q.size()
+    attn = torch.softmax(Q @ K.transpose(-1, -2), dim=-1)
+    attn = attn.view(bs, num_head, hw, frame_num, -1).mean(dim=1)
+    return attn.sum(dim=-1)
+
+
+def timeit(func, repeat):
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = func()
+    return out, (time.perf_counter() - start) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark per-frame attention mass on CPU")
+    parser.add_argument('--size', nargs='+', type=int, default=[30, 45])
+    parser.add_argument('--frames', nargs='+', type=int, default=[2, 8, 16])
+    parser.add_argument('--heads', type=int, default=8)
+    parser.add_argument('--dim', type=int, default=32)
+    parser.add_argument('--chunk_size', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    print(f"{'hw':>6} {'T':>4} {'dense ms':>10} {'chunked ms':>11} "
+          f"{'dense attn MB':>14} {'max abs err':>12}")
+    with torch.no_grad():
+        for size in args.size:
+            hw = size * size
+            for frame_num in args.frames:
+                Q = torch.randn(1, args.heads, hw, args.dim) / args.dim**0.5
+                K = torch.randn(1, args.heads, frame_num * hw, args.dim)
+                ref, dense_ms = timeit(
+                    lambda: dense_attention_mass(Q, K, frame_num),
+                    args.repeat)
+                out, chunk_ms = timeit(
+                    lambda: frame_attention_mass(Q, K, frame_num,
+                                                 args.chunk_size),
+                    args.repeat)
+                err = (ref - out).abs().max().item()
+                dense_mb = args.heads * hw * frame_num * hw * 4 / 1024.**2
+                print(f"{hw:>6} {frame_num:>4} {dense_ms:>10.2f} "
+                      f"{chunk_ms:>11.2f} {dense_mb:>14.1f} {err:>12.2e}")
+                assert err < 1e-5, "chunked attention mass does not match"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import re
+import sys
+import time
+import argparse
+import multiprocessing as mp
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+
+import networks.debug
+from configs.default import DefaultEngineConfig
+from networks.models import build_vos_model
+from networks.engines import build_engine
+
+MODES = {
+    'none': ([], False),
+    'lstt': (None, False),
+    'lstt+decoder': (None, True),
+}
+
+
+def train_config(args, model_name, mode):
+    cfg = DefaultEngineConfig('benchmark', model_name)
+    cfg.MODEL_ENCODER = 'mobilenetv2'
+    cfg.MODEL_ENCODER_DIM = [24, 32, 96, 1280]
+    # dropout and droppath everywhere, so the replayed RNG state matters
+    cfg.TRAIN_LSTT_DROPPATH = 0.1
+    cfg.TRAIN_LSTT_LT_DROPOUT = 0.1
+    cfg.TRAIN_LSTT_ST_DROPOUT = 0.1
+    cfg.TRAIN_LSTT_DROPPATH_LST = True
+    layers, decoder = MODES[mode]
+    cfg.TRAIN_CHECKPOINT_LSTT_LAYERS = list(range(
+        cfg.MODEL_LSTT_NUM)) if layers is None else layers
+    cfg.TRAIN_CHECKPOINT_DECODER = decoder
+    return cfg
+
+
+def synthetic_clip(seq_len, size, obj_num):
+    torch.manual_seed(1)
+    frames = torch.randn(seq_len, 3, size, size)
+    labels = torch.zeros(seq_len, 1, size, size)
+    step = size // (obj_num + 1)
+    for obj_idx in range(obj_num):
+        start = obj_idx * step
+        labels[:, :, start:start + step, start:start + step] = obj_idx + 1
+    return frames, labels
+
+
+def build(args, model_name, mode):
+    torch.manual_seed(0)
+    networks.debug.GLOBAL_IS_DEBUG = False
+    cfg = train_config(args, model_name, mode)
+    model = build_vos_model(cfg.MODEL_VOS, cfg)
+    engine = build_engine(cfg.MODEL_ENGINE, 'train', aot_model=model,
+                          long_term_mem_gap=cfg.TRAIN_LONG_TERM_MEM_GAP)
+    return model, engine.train()
+
+
+def train_step(engine, frames, labels, obj_num):
+    # identity shuffling draws its permutations on CUDA
+    engine.restart_engine(1, False)
+    torch.manual_seed(2)
+    loss, _, _, _ = engine(frames, labels, 1, obj_nums=[obj_num], step=0)
+    loss = torch.mean(loss)
+    loss.backward()
+    return loss.detach()
+
+
+def check_gradients(args, model_name):
+    frames, labels = synthetic_clip(args.check_seq_len, args.check_size,
+                                    args.obj_num)
+    results = []
+    for mode in ['none', 'lstt+decoder']:
+        model, engine = build(args, model_name, mode)
+        loss = train_step(engine, frames, labels, args.obj_num)
+        grads = {name: param.grad.clone()
+                 for name, param in model.named_parameters()
+                 if param.grad is not None}
+        results.append((loss, grads))
+    (ref_loss, ref_grads), (loss, grads) = results
+    assert ref_grads.keys() == grads.keys()
+    err = max((ref_grads[name] - grads[name]).abs().max().item()
+              for name in ref_grads)
+    return (ref_loss - loss).abs().item(), err, len(grads)
+
+
+def memory_status(field):
+    with open('/proc/self/status') as f:
+        return int(re.search(field + r':\s+(\d+)', f.read()).group(1)) / 1024.
+
+
+def run_case(args, model_name, mode, seq_len, queue):
+    torch.set_num_threads(args.threads)
+    model, engine = build(args, model_name, mode)
+    frames, labels = synthetic_clip(seq_len, args.size, args.obj_num)
+    # reset the peak RSS, building the model peaks higher than a small step
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    base_rss = memory_status('VmRSS')
+    start = time.perf_counter()
+    train_step(engine, frames, labels, args.obj_num)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, memory_status('VmHWM') - base_rss))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Gradient checkpointing of the LSTT blocks and the "
+        "decoder: identical gradients, and the peak CPU memory of a training "
+        "step across sequence lengths")
+    parser.add_argument('--models', nargs='+', type=str,
+                        default=['r50_aotl', 'r50_deaotl'])
+    parser.add_argument('--seq_lens', nargs='+', type=int, default=[3, 5, 8])
+    parser.add_argument('--size', type=int, default=241)
+    parser.add_argument('--obj_num', type=int, default=3)
+    parser.add_argument('--check_seq_len', type=int, default=4)
+    parser.add_argument('--check_size', type=int, default=97)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    for model_name in args.models:
+        loss_err, grad_err, num = check_gradients(args, model_name)
+        assert loss_err == 0. and grad_err == 0., \
+            f"{model_name}: loss differs by {loss_err}, gradients by {grad_err}"
+        print(f"{model_name}: loss and {num} gradients identical with the "
+              f"LSTT blocks and the decoder checkpointed")
+
+    ctx = mp.get_context('spawn')
+    print(f"{'model':>11} {'frames':>7} {'checkpoint':>13} {'s/step':>7} "
+          f"{'peak RSS MB':>12}")
+    for model_name in args.models:
+        for seq_len in args.seq_lens:
+            for mode in MODES:
+                queue = ctx.Queue()
+                process = ctx.Process(target=run_case,
+                                      args=(args, model_name, mode, seq_len,
+                                            queue))
+                process.start()
+                elapsed, peak_rss = queue.get()
+                process.join()
+                print(f"{model_name:>11} {seq_len:>7} {mode:>13} "
+                      f"{elapsed:>7.2f} {peak_rss:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
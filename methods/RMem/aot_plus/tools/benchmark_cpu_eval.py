@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append('.')
+sys.path.append('..')
+
+import numpy as np
+import torch
+from PIL import Image
+
+from configs.default import DefaultEngineConfig
+from networks.managers.evaluator import Evaluator
+from utils.image import _palette
+
+
+def make_synthetic_vost(root, seq_num, frame_num, size, obj_num):
+    # random images with drifting rectangles as the first-frame objects
+    rng = np.random.default_rng(0)
+    os.makedirs(os.path.join(root, 'ImageSets'))
+    seqs = [f'synthetic_{seq_idx:02d}' for seq_idx in range(seq_num)]
+    with open(os.path.join(root, 'ImageSets', 'val.txt'), 'w') as f:
+        f.write('\n'.join(seqs))
+    for seq in seqs:
+        image_dir = os.path.join(root, 'JPEGImages_10fps', seq)
+        label_dir = os.path.join(root, 'Annotations', seq)
+        os.makedirs(image_dir)
+        os.makedirs(label_dir)
+        for frame_idx in range(frame_num):
+            image = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+            Image.fromarray(image).save(
+                os.path.join(image_dir, f'{frame_idx:05d}.jpg'))
+        label = np.zeros((size, size), dtype=np.uint8)
+        for obj_idx in range(obj_num):
+            y, x = rng.integers(0, size // 2, 2)
+            label[y:y + size // 4, x:x + size // 4] = obj_idx + 1
+        label = Image.fromarray(label).convert('P')
+        label.putpalette(_palette)
+        label.save(os.path.join(label_dir, '00000.png'))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="CPU throughput of the evaluation path")
+    parser.add_argument('--model', type=str, default='r50_aotl')
+    parser.add_argument('--engine', type=str, default='aotengine')
+    parser.add_argument('--seqs', type=int, default=2)
+    parser.add_argument('--frames', type=int, default=8)
+    parser.add_argument('--size', type=int, default=240)
+    parser.add_argument('--obj_num', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    with tempfile.TemporaryDirectory() as root:
+        make_synthetic_vost(os.path.join(root, 'VOST'), args.seqs,
+                            args.frames, args.size, args.obj_num)
+        cfg = DefaultEngineConfig('benchmark', args.model)
+        cfg.MODEL_ENGINE = args.engine
+        cfg.TEST_DEVICE = 'cpu'
+        cfg.TEST_CKPT_PATH = 'test'
+        cfg.TEST_EMA = False
+        cfg.TEST_DATASET = 'vost'
+        cfg.TEST_DATASET_SPLIT = 'val'
+        cfg.TEST_MAX_SIZE = args.size
+        cfg.TEST_WORKERS = 0
+        cfg.DIR_VOST = os.path.join(root, 'VOST')
+        cfg.DIR_EVALUATION = os.path.join(root, 'eval')
+        cfg.EVAL_NAME = 'benchmark'
+        cfg.DEBUG_FIX_RANDOM = False
+        cfg.FORMER_MEM_LEN = 1
+        cfg.LATTER_MEM_LEN = 9999
+
+        evaluator = Evaluator(cfg)
+        start = time.perf_counter()
+        evaluator.evaluating()
+        elapsed = time.perf_counter() - start
+        result_root = os.path.join(cfg.DIR_EVALUATION, 'vost', 'benchmark')
+        written = sum(
+            len(os.listdir(os.path.join(result_root, seq)))
+            for seq in os.listdir(result_root))
+        assert written == args.seqs * args.frames, "missing predicted masks"
+        print(f"{args.seqs * args.frames / elapsed:.2f} frames/s end to end "
+              f"on {args.threads} threads")
+
+
+if __name__ == '__main__':
+    main()
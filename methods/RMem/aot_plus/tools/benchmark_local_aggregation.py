@@ -0,0 +1,151 @@
+import sys
+import time
+import resource
+import argparse
+import multiprocessing as mp
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+
+from networks.layers.attention import LocalGatedPropagation
+
+
+class DenseLocalGatedPropagation(LocalGatedPropagation):
+    # The previous aggregation, through the local attention expanded to
+    # [hw, (h + 2d)(w + 2d)] and a dense matmul
+    def local_aggregate(self, local_attn, v, height, width):
+        batch_size = local_attn.size()[0]
+        pad_height = height + 2 * self.max_dis
+        pad_width = width + 2 * self.max_dis
+        ky, kx = torch.meshgrid([
+            torch.arange(0, pad_height, device=local_attn.device),
+            torch.arange(0, pad_width, device=local_attn.device)
+        ], indexing='ij')
+        qy, qx = torch.meshgrid([
+            torch.arange(0, height, device=local_attn.device),
+            torch.arange(0, width, device=local_attn.device)
+        ], indexing='ij')
+        offset_y = qy.reshape(-1, 1) - ky.reshape(1, -1) + self.max_dis
+        offset_x = qx.reshape(-1, 1) - kx.reshape(1, -1) + self.max_dis
+        local_mask = (offset_y.abs() <= self.max_dis) & (offset_x.abs() <=
+                                                         self.max_dis)
+        local_mask = local_mask.view(1, 1, height * width, pad_height,
+                                     pad_width)
+        global_attn = torch.zeros(
+            (batch_size, self.num_head, height * width, pad_height, pad_width),
+            device=local_attn.device)
+        global_attn[local_mask.expand(batch_size, self.num_head,
+                                      -1, -1, -1)] = local_attn.transpose(
+                                          -1, -2).reshape(-1)
+        global_attn = global_attn[:, :, :, self.max_dis:-self.max_dis,
+                                  self.max_dis:-self.max_dis].reshape(
+                                      batch_size, self.num_head,
+                                      height * width, height * width)
+        return (global_attn @ v.transpose(-2, -1)).transpose(-2, -1)
+
+
+def build(args, dense, max_dis, dilation):
+    # the short-term propagation of the DeAOT layers
+    torch.manual_seed(0)
+    module_cls = DenseLocalGatedPropagation if dense else LocalGatedPropagation
+    return module_cls(d_qk=args.d_model,
+                      d_vu=args.d_model * 2,
+                      num_head=1,
+                      dilation=dilation,
+                      use_linear=False,
+                      enable_corr=False,
+                      d_att=args.d_model // 2,
+                      max_dis=max_dis)
+
+
+def make_inputs(args, module, size, requires_grad=False):
+    h, w = size
+    torch.manual_seed(1)
+    q = torch.randn(1, module.d_middle, h, w, requires_grad=requires_grad)
+    v = torch.randn(1, module.expand_d_vu, h, w, requires_grad=requires_grad)
+    u = torch.randn(h * w, 1, module.expand_d_vu)
+    return q, v, u
+
+
+def check_equivalence(args, max_dis, dilation):
+    outputs = []
+    for dense in [True, False]:
+        module = build(args, dense, max_dis, dilation)
+        q, v, u = make_inputs(args, module, args.check_size, True)
+        output, _ = module(q, q, v, u, args.check_size)
+        output.square().sum().backward()
+        outputs.append((output.detach(), q.grad, v.grad))
+    return max((ref - out).abs().max().item()
+               for ref, out in zip(*outputs))
+
+
+def run_case(args, dense, max_dis, dilation, size, part, queue):
+    torch.set_num_threads(args.threads)
+    module = build(args, dense, max_dis, dilation).eval()
+    q, v, u = make_inputs(args, module, size)
+    h, w = size
+    if part == 'aggregate':
+        window_num = module.window_size * module.window_size
+        local_attn = torch.softmax(torch.randn(1, 1, window_num, h * w), dim=2)
+        v = v.view(1, 1, module.expand_d_vu, h * w)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    with torch.no_grad():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            if part == 'aggregate':
+                module.local_aggregate(local_attn, v, h, w)
+            else:
+                module(q, q, v, u, size)
+        elapsed = (time.perf_counter() - start) / args.repeat
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    queue.put((elapsed * 1e3, peak_rss - base_rss))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="CPU benchmark of the local value aggregation of "
+        "LocalGatedPropagation: dense local2global vs windowed")
+    parser.add_argument('--sizes', nargs='+', type=str,
+                        default=['30x54', '45x80'])
+    parser.add_argument('--windows', nargs='+', type=str,
+                        default=['7x1', '7x2', '3x1'],
+                        help='max_dis x dilation')
+    parser.add_argument('--d_model', type=int, default=256)
+    parser.add_argument('--check_size', nargs=2, type=int, default=[13, 17])
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    windows = [tuple(map(int, window.split('x'))) for window in args.windows]
+    sizes = [tuple(map(int, size.split('x'))) for size in args.sizes]
+    for max_dis, dilation in windows:
+        err = check_equivalence(args, max_dis, dilation)
+        assert err < 1e-3, f"windowed aggregation differs by {err}"
+        print(f"max_dis {max_dis} dilation {dilation}: output and gradients "
+              f"match, max abs err {err:.2e}")
+
+    ctx = mp.get_context('spawn')
+    print(f"{'size':>7} {'max_dis':>8} {'dilation':>9} {'part':>10} "
+          f"{'path':>9} {'ms':>8} {'peak RSS MB':>12}")
+    for size in sizes:
+        for max_dis, dilation in windows:
+            for part in ['aggregate', 'forward']:
+                for dense in [True, False]:
+                    queue = ctx.Queue()
+                    process = ctx.Process(
+                        target=run_case,
+                        args=(args, dense, max_dis, dilation, size, part,
+                              queue))
+                    process.start()
+                    ms, peak_rss = queue.get()
+                    process.join()
+                    print(f"{size[0]:>3}x{size[1]:<3} {max_dis:>8} "
+                          f"{dilation:>9} {part:>10} "
+                          f"{'dense' if dense else 'windowed':>9} {ms:>8.1f} "
+                          f"{peak_rss:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
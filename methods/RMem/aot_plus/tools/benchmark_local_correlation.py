@@ -0,0 +1,115 @@
+import sys
+import time
+import resource
+import argparse
+import multiprocessing as mp
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+
+from networks.layers.attention import LocalGatedPropagation
+
+
+class UnfoldLocalGatedPropagation(LocalGatedPropagation):
+    # The previous CPU fallback, every window of the key map unfolded at once
+    def local_correlation(self, q, k):
+        n, d_att, h, w = q.size()
+        unfolded_k = self.pad_and_unfold(k).view(
+            n, d_att, self.window_size * self.window_size, h, w)
+        return (q.unsqueeze(2) * unfolded_k).sum(dim=1)
+
+
+def build(args, unfold, max_dis, dilation):
+    # the short-term propagation of the DeAOT layers
+    torch.manual_seed(0)
+    module_cls = UnfoldLocalGatedPropagation if unfold else LocalGatedPropagation
+    return module_cls(d_qk=args.d_model,
+                      d_vu=args.d_model * 2,
+                      num_head=1,
+                      dilation=dilation,
+                      use_linear=False,
+                      enable_corr=False,
+                      d_att=args.d_model // 2,
+                      max_dis=max_dis)
+
+
+def check_equivalence(args, max_dis, dilation):
+    # whole forward and backward of the module, both correlations
+    h, w = args.check_size
+    outputs = []
+    for unfold in [True, False]:
+        module = build(args, unfold, max_dis, dilation)
+        torch.manual_seed(1)
+        q = torch.randn(1, module.d_middle, h, w, requires_grad=True)
+        k = torch.randn(1, module.d_middle, h, w, requires_grad=True)
+        v = torch.randn(1, module.expand_d_vu, h, w)
+        u = torch.randn(h * w, 1, module.expand_d_vu)
+        output, local_attn = module(q, k, v, u, (h, w))
+        output.square().sum().backward()
+        outputs.append((output.detach(), local_attn.detach(), q.grad, k.grad))
+    return max((ref - out).abs().max().item()
+               for ref, out in zip(*outputs))
+
+
+def run_case(args, unfold, max_dis, dilation, size, queue):
+    torch.set_num_threads(args.threads)
+    module = build(args, unfold, max_dis, dilation)
+    h, w = size
+    torch.manual_seed(1)
+    q = torch.randn(1, module.d_att, h, w)
+    k = torch.randn(1, module.d_att, h, w)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    with torch.no_grad():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            module.local_correlation(q, k)
+        elapsed = (time.perf_counter() - start) / args.repeat
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    queue.put((elapsed * 1e3, peak_rss - base_rss))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="CPU benchmark of the local correlation of "
+        "LocalGatedPropagation: unfold fallback vs shifted views")
+    parser.add_argument('--sizes', nargs='+', type=str,
+                        default=['30x54', '45x80', '68x120'])
+    parser.add_argument('--windows', nargs='+', type=str,
+                        default=['3x1', '7x1', '7x2'],
+                        help='max_dis x dilation')
+    parser.add_argument('--d_model', type=int, default=256)
+    parser.add_argument('--check_size', nargs=2, type=int, default=[13, 17])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    windows = [tuple(map(int, window.split('x'))) for window in args.windows]
+    sizes = [tuple(map(int, size.split('x'))) for size in args.sizes]
+    for max_dis, dilation in windows:
+        err = check_equivalence(args, max_dis, dilation)
+        assert err < 1e-3, f"shifted-view correlation differs by {err}"
+        print(f"max_dis {max_dis} dilation {dilation}: outputs and gradients "
+              f"match, max abs err {err:.2e}")
+
+    ctx = mp.get_context('spawn')
+    print(f"{'size':>7} {'max_dis':>8} {'dilation':>9} {'path':>8} "
+          f"{'ms':>8} {'peak RSS MB':>12}")
+    for size in sizes:
+        for max_dis, dilation in windows:
+            for unfold in [True, False]:
+                queue = ctx.Queue()
+                process = ctx.Process(
+                    target=run_case,
+                    args=(args, unfold, max_dis, dilation, size, queue))
+                process.start()
+                ms, peak_rss = queue.get()
+                process.join()
+                print(f"{size[0]:>3}x{size[1]:<3} {max_dis:>8} {dilation:>9} "
+                      f"{'unfold' if unfold else 'shifted':>8} {ms:>8.1f} "
+                      f"{peak_rss:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import sys
+import time
+import resource
+import argparse
+import multiprocessing as mp
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+
+from networks.layers.transformer import LongShortTermTransformer
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def run_case(args, frame_num, use_bank, result_queue):
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    lstt = LongShortTermTransformer(num_layers=args.layers,
+                                    d_model=args.channels)
+    lstt.eval()
+
+    def new_memories():
+        return [[
+            torch.randn(args.tokens, 1, args.channels),
+            torch.randn(args.tokens, 1, args.channels),
+        ] for _ in range(args.layers)]
+
+    capacity = args.former_mem_len + args.latter_mem_len + 1
+    long_memories_indexes = [0]
+    with torch.no_grad():
+        lstt.lstt_long_memories = [[mem[None, ...] for mem in layer_mem]
+                                   for layer_mem in new_memories()]
+        lstt.lstt_short_memories = new_memories()
+        lstt.init_memory(memory_capacity=capacity if use_bank else None)
+        base_rss = _peak_rss_mb()
+
+        latency = 0.
+        for frame_step in range(1, frame_num + 1):
+            curr_memories = new_memories()
+            start = time.perf_counter()
+            lstt.update_long_term_memory(curr_memories)
+            long_memories_indexes.append(frame_step)
+            lstt.restrict_long_memories(
+                former_memory_len=args.former_mem_len,
+                latter_memory_len=args.latter_mem_len,
+                use_atten_weight=False,
+                long_memories_indexes=long_memories_indexes,
+            )
+            latency += time.perf_counter() - start
+
+    result_queue.put({
+        'latency_ms': latency / frame_num * 1e3,
+        'peak_rss_mb': _peak_rss_mb() - base_rss,
+        'memory_len': lstt.long_term_memories[0][0].size(0),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark long-term memory updates on CPU")
+    parser.add_argument('--frames', nargs='+', type=int,
+                        default=[100, 500, 2000])
+    parser.add_argument('--layers', type=int, default=3)
+    parser.add_argument('--tokens', type=int, default=256)
+    parser.add_argument('--channels', type=int, default=256)
+    parser.add_argument('--former_mem_len', type=int, default=1)
+    parser.add_argument('--latter_mem_len', type=int, default=9999)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    print(f"{'frames':>8} {'path':>6} {'update ms/frame':>16} "
+          f"{'peak RSS MB':>12} {'mem len':>8}")
+    for frame_num in args.frames:
+        for use_bank in [False, True]:
+            result_queue = ctx.Queue()
+            # A fresh process per case keeps the peak RSS numbers apart.
+            proc = ctx.Process(target=run_case,
+                               args=(args, frame_num, use_bank, result_queue))
+            proc.start()
+            result = result_queue.get()
+            proc.join()
+            print(f"{frame_num:>8} {'bank' if use_bank else 'cat':>6} "
+                  f"{result['latency_ms']:>16.3f} "
+                  f"{result['peak_rss_mb']:>12.1f} "
+                  f"{result['memory_len']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.append('.')
+sys.path.append('..')
+
+import numpy as np
+import torch
+
+from utils.image import AsyncMaskWriter, _save_mask
+
+
+class ThreadMonitor(object):
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        return self.peak
+
+
+def thread_per_mask(masks, out_dir, squeeze_idx):
+    # the previous save_mask: one thread per frame
+    threads = []
+    for idx, mask_tensor in enumerate(masks):
+        mask = mask_tensor.cpu().numpy().astype('uint8')
+        thread = threading.Thread(
+            target=_save_mask,
+            args=[mask, os.path.join(out_dir, f'{idx:05d}.png'), squeeze_idx])
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+
+def async_writer(masks, out_dir, squeeze_idx, num_workers, compress_level):
+    with AsyncMaskWriter(num_workers=num_workers,
+                         compress_level=compress_level) as writer:
+        for idx, mask_tensor in enumerate(masks):
+            writer.write(mask_tensor, os.path.join(out_dir, f'{idx:05d}.png'),
+                         squeeze_idx)
+        writer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mask saving")
+    parser.add_argument('--masks', type=int, default=5000)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--width', type=int, default=854)
+    parser.add_argument('--obj_num', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--compress_level', nargs='+', type=int,
+                        default=[6, 1])
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    # a few distinct masks, shared to keep the input small
+    base = [
+        torch.randint(0, args.obj_num + 1, (args.height // 16,
+                                            args.width // 16)).repeat_interleave(
+                                                16, 0).repeat_interleave(16, 1).float()
+        for _ in range(8)
+    ]
+    masks = [base[idx % len(base)] for idx in range(args.masks)]
+    squeeze_idx = [0] + list(range(1, args.obj_num + 1))
+
+    cases = [('thread/mask', None,
+              lambda out_dir: thread_per_mask(masks, out_dir, squeeze_idx))]
+    for level in args.compress_level:
+        cases.append((f'writer z{level}', level,
+                      lambda out_dir, level=level: async_writer(
+                          masks, out_dir, squeeze_idx, args.workers, level)))
+
+    print(f"{'path':>12} {'masks/s':>9} {'peak threads':>13}")
+    with tempfile.TemporaryDirectory() as root:
+        for name, level, func in cases:
+            out_dir = os.path.join(root, name.replace('/', '_').replace(' ', '_'))
+            os.makedirs(out_dir)
+            base_threads = threading.active_count()
+            monitor = ThreadMonitor()
+            start = time.perf_counter()
+            func(out_dir)
+            elapsed = time.perf_counter() - start
+            peak = monitor.stop() - base_threads
+            print(f"{name:>12} {args.masks / elapsed:>9.1f} {peak:>13}")
+            if level is not None:
+                # the monitor thread itself is counted too
+                assert peak <= args.workers + 1, "writer threads are not bounded"
+                written = sorted(os.listdir(out_dir))
+                assert len(written) == args.masks, "missing masks"
+
+
+if __name__ == '__main__':
+    main()
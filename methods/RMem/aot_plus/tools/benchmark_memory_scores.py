@@ -0,0 +1,186 @@
+import sys
+import time
+import argparse
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+
+from networks.layers.transformer import LongShortTermTransformer, score_long_memories
+
+
+def legacy_drop_idx(state, attn_weight, long_memories_indexes, gru_memory):
+    # The dict bookkeeping restrict_long_memories used before, on the host
+    attn_weight = attn_weight.cpu()
+    attn_weight_dict = {
+        long_memories_indexes[i]: attn
+        for i, attn in enumerate(attn_weight)
+    }
+    last_attn_weight_dict = state.get('attn', {})
+    moving_mean_factor = 0.8
+    attn_weight_dict = {
+        frame_idx:
+            (1-moving_mean_factor)*last_attn_weight_dict[frame_idx] + moving_mean_factor*attn
+            if frame_idx in last_attn_weight_dict else attn
+        for frame_idx, attn in attn_weight_dict.items()
+    }
+    state['attn'] = attn_weight_dict
+    for i, _ in enumerate(attn_weight):
+        attn_weight[i] = attn_weight_dict[long_memories_indexes[i]]
+
+    last_frame_times = state.get('times', {})
+    frame_times = {
+        mem_idx: (1 + last_frame_times[mem_idx]) if mem_idx in last_frame_times else 1
+        for mem_idx in long_memories_indexes
+    }
+    state['times'] = frame_times
+    frame_times_np = torch.Tensor([
+        frame_times[mem_idx]
+        for mem_idx in long_memories_indexes[:-1]
+    ])
+    frame_times_np[0] = len(frame_times_np)
+    if gru_memory and len(frame_times_np) > 1:
+        frame_times_np[1] = len(frame_times_np)
+    add_item = 8
+    mul_item = 1.5
+    frame_times_param = mul_item * torch.sqrt(torch.log(frame_times_np.sum()) / (frame_times_np + add_item))
+    attn_weight = attn_weight + frame_times_param
+
+    ignore_former_size = 2 if gru_memory else 1
+    return torch.argmin(attn_weight[ignore_former_size:]).item() + ignore_former_size
+
+
+def check_decisions(args, gru_memory, use_bank):
+    # Drives restrict_long_memories on recorded-like attention statistics and
+    # compares every evicted frame with the dict implementation
+    torch.manual_seed(0)
+    size_2d = (4, 4)
+    tokens = size_2d[0] * size_2d[1]
+    lstt = LongShortTermTransformer(num_layers=1, d_model=args.channels,
+                                    gru_memory=gru_memory).eval()
+
+    def new_memories():
+        return [[torch.randn(tokens, 1, args.channels),
+                 torch.randn(tokens, 1, args.channels)]]
+
+    max_len = args.former_mem_len + args.latter_mem_len
+    long_memories_indexes = [0]
+    legacy_state = {}
+    with torch.no_grad():
+        lstt.lstt_long_memories = [[mem[None, ...] for mem in new_memories()[0]]]
+        lstt.lstt_short_memories = new_memories()
+        lstt.init_memory(size_2d=size_2d,
+                         memory_capacity=max_len + 1 if use_bank else None)
+        for frame_step in range(1, args.updates + 1):
+            mem_len = lstt.long_term_memories[0][0].size(0)
+            # sharp attention so that the moving mean and the UCB term both matter
+            lstt.layers[0].record_attn_weight = torch.softmax(
+                4 * torch.randn(tokens, mem_len), dim=-1)
+            foreground_proba = torch.rand(1, 1, *size_2d)
+            lstt.update_long_term_memory(new_memories())
+            long_memories_indexes.append(frame_step)
+            if mem_len + 1 <= max_len:
+                continue
+            attn_weight = lstt.layers[0].record_attn_weight * \
+                foreground_proba.flatten().unsqueeze(-1)
+            attn_weight = attn_weight.sum(dim=0)
+            attn_weight = attn_weight / attn_weight.sum()
+            expected = long_memories_indexes[legacy_drop_idx(
+                legacy_state, attn_weight, long_memories_indexes, gru_memory)]
+            before = list(long_memories_indexes)
+            lstt.restrict_long_memories(
+                former_memory_len=args.former_mem_len,
+                latter_memory_len=args.latter_mem_len,
+                use_atten_weight=True,
+                long_memories_indexes=long_memories_indexes,
+                foreground_proba=foreground_proba,
+            )
+            dropped = sorted(set(before) - set(long_memories_indexes))
+            assert dropped == [expected], \
+                f"frame {frame_step}: evicted {dropped}, dict evicts {expected}"
+            assert lstt.long_term_memories[0][0].size(0) == max_len
+
+
+def check_half(args):
+    # Under --amp the attention comes in half precision, the visit counts
+    # must still go past 2048 and the scores follow the float32 ones
+    torch.manual_seed(0)
+    mem_len = 8
+    states = [{}, {}]
+    for _ in range(args.half_updates):
+        attn = torch.softmax(4 * torch.randn(mem_len), dim=-1)
+        for state, dtype in zip(states, [torch.float32, torch.float16]):
+            state['attn'], state['times'], state['scores'] = score_long_memories(
+                attn.to(dtype), state.get('attn'), state.get('times'), 1)
+    ref, half = states
+    assert half['attn'].dtype == half['times'].dtype == torch.float32
+    assert torch.equal(ref['times'], half['times']), half['times']
+    assert half['times'][0].item() == args.half_updates
+    return (ref['scores'] - half['scores']).abs().max().item()
+
+
+def legacy_scoring(state, attn_weight, long_memories_indexes):
+    return legacy_drop_idx(state, attn_weight, long_memories_indexes, False)
+
+
+def device_scoring(state, attn_weight, long_memories_indexes):
+    state['attn'], state['times'], scores = score_long_memories(
+        attn_weight, state.get('attn'), state.get('times'), 1)
+    return torch.argmin(scores[1:]) + 1
+
+
+def time_scoring(func, mem_len, repeat, device):
+    state = {}
+    indexes = list(range(mem_len + 1))
+    attn = torch.softmax(torch.randn(repeat, mem_len, device=device), dim=-1)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for idx in range(repeat):
+        func(state, attn[idx], indexes)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the on-device memory eviction scores against the "
+        "dict implementation and time both")
+    parser.add_argument('--mem_len', nargs='+', type=int,
+                        default=[8, 32, 128, 512])
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--half_updates', type=int, default=3000)
+    parser.add_argument('--channels', type=int, default=32)
+    parser.add_argument('--former_mem_len', type=int, default=2)
+    parser.add_argument('--latter_mem_len', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    for gru_memory in [False, True]:
+        for use_bank in [False, True]:
+            check_decisions(args, gru_memory, use_bank)
+    print(f"identical evictions over {args.updates} updates "
+          f"(gru memory and bank on/off)")
+    half_err = check_half(args)
+    assert half_err < 1e-2, f"half precision scores differ by {half_err}"
+    print(f"half precision attention: float32 state, visit counts reach "
+          f"{args.half_updates}, scores within {half_err:.1e}")
+
+    devices = [torch.device('cpu')]
+    if torch.cuda.is_available():
+        devices.append(torch.device('cuda'))
+    print(f"{'device':>7} {'mem len':>8} {'dict ms':>9} {'tensor ms':>10}")
+    for device in devices:
+        for mem_len in args.mem_len:
+            legacy_ms = time_scoring(legacy_scoring, mem_len, args.repeat, device)
+            device_ms = time_scoring(device_scoring, mem_len, args.repeat, device)
+            print(f"{device.type:>7} {mem_len:>8} {legacy_ms:>9.3f} "
+                  f"{device_ms:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
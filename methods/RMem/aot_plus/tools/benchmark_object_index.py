@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append('.')
+sys.path.append('..')
+
+import numpy as np
+from PIL import Image
+
+from dataloaders.train_datasets import VOST_Train
+from dataloaders.object_index import INDEX_DIR, index_sequence, \
+    write_sequence_index
+from utils.image import _palette
+
+
+def make_sparse_vost(root, seq_num, frame_num, size, obj_num):
+    # objects leave the view for long stretches, as in VOST
+    os.makedirs(os.path.join(root, 'ImageSets'))
+    seqs = [f'synthetic_{seq_idx:02d}' for seq_idx in range(seq_num)]
+    with open(os.path.join(root, 'ImageSets', 'train.txt'), 'w') as f:
+        f.write('\n'.join(seqs))
+    height, width = size
+    rng = np.random.RandomState(0)
+    image = Image.fromarray(
+        rng.randint(255, size=(height, width, 3), dtype=np.uint8))
+    for seq in seqs:
+        image_dir = os.path.join(root, 'JPEGImages', seq)
+        label_dir = os.path.join(root, 'Annotations', seq)
+        os.makedirs(image_dir)
+        os.makedirs(label_dir)
+        for frame_idx in range(frame_num):
+            label = np.zeros((height, width), dtype=np.uint8)
+            for obj_id in range(1, obj_num + 1):
+                if rng.rand() < 0.7:
+                    continue
+                y, x = rng.randint(height // 2), rng.randint(width // 2)
+                label[y:y + height // 3, x:x + width // 3] = obj_id
+            if rng.rand() < 0.2:
+                label[:height // 4] = 255
+            label = Image.fromarray(label).convert('P')
+            label.putpalette(_palette)
+            image.save(os.path.join(image_dir, f'{frame_idx:05d}.jpg'))
+            label.save(os.path.join(label_dir, f'{frame_idx:05d}.png'))
+    return seqs
+
+
+def decoded_stats(label_root, seq, labels):
+    # what the sampler used to compute on every draw
+    fg_pixels, ignore_pixels = [], []
+    for label_name in labels:
+        label = np.array(Image.open(os.path.join(label_root, seq, label_name)),
+                         dtype=np.uint8)
+        fg_pixels.append(len(np.nonzero(label)[0]))
+        ignore_pixels.append(len(np.nonzero(label == 255)[0]))
+    return fg_pixels, ignore_pixels
+
+
+class DecodeCounter(object):
+    def __init__(self):
+        self.count = 0
+        self._open = Image.open
+
+    def __enter__(self):
+        def counted_open(fp, *args, **kwargs):
+            if str(fp).endswith('.png'):
+                self.count += 1
+            return self._open(fp, *args, **kwargs)
+
+        Image.open = counted_open
+        return self
+
+    def __exit__(self, *exc):
+        Image.open = self._open
+        return False
+
+
+def build_dataset(args, root, use_index):
+    dataset = VOST_Train(root=root,
+                         transform=None,
+                         seq_len=args.seq_len,
+                         dynamic_merge=False,
+                         ignore_thresh=args.ignore_thresh)
+    if not use_index:
+        dataset.index_root = None
+    return dataset
+
+
+def check_equivalence(args, root, seqs):
+    label_root = os.path.join(root, 'Annotations')
+    for seq in seqs:
+        labels = sorted(os.listdir(os.path.join(label_root, seq)))
+        index = index_sequence(label_root, seq)
+        fg_pixels, ignore_pixels = decoded_stats(label_root, seq, labels)
+        assert list(index['labels']) == labels
+        assert index['fg_pixels'].tolist() == fg_pixels
+        assert index['ignore_pixels'].tolist() == ignore_pixels
+
+    # the same draws pick the same reference frames, reversed clips included
+    datasets = [build_dataset(args, root, use_index) for use_index in
+                [False, True]]
+    for trial in range(args.check_draws):
+        seq = seqs[trial % len(seqs)]
+        lablist = datasets[0].imglistdic[seq][1]
+        if trial % 2:
+            lablist = lablist[::-1]
+        ref_indices = []
+        for dataset in datasets:
+            np.random.seed(trial)
+            ref_indices.append(dataset.get_ref_index_v2(
+                seq, lablist, ignore_thresh=args.ignore_thresh,
+                total_gap=args.seq_len))
+        assert ref_indices[0] == ref_indices[1], \
+            f"{seq}: reference {ref_indices[1]} instead of {ref_indices[0]}"
+
+    # and the same samples, retries rejected by the index included
+    for sample_idx in range(args.check_samples):
+        samples = []
+        for dataset in datasets:
+            np.random.seed(sample_idx)
+            samples.append(dataset[sample_idx])
+        for key in ['ref_label', 'prev_label', 'curr_label', 'ref_img']:
+            assert all(np.array_equal(ref, out) for ref, out in zip(
+                np.atleast_1d(samples[0][key]), np.atleast_1d(samples[1][key]))), \
+                f"sample {sample_idx}: {key} differs"
+
+
+def run(args, root, use_index):
+    dataset = build_dataset(args, root, use_index)
+    np.random.seed(0)
+    dataset[0]
+    with DecodeCounter() as counter:
+        start = time.perf_counter()
+        for sample_idx in range(args.samples):
+            dataset[sample_idx]
+        elapsed = time.perf_counter() - start
+    return args.samples / elapsed, counter.count / args.samples
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Throughput of VOST_Train sampling on a synthetic on-disk "
+        "dataset, with and without the object presence index")
+    parser.add_argument('--seqs', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--size', nargs=2, type=int, default=[480, 854])
+    parser.add_argument('--obj_num', type=int, default=3)
+    parser.add_argument('--seq_len', type=int, default=5)
+    parser.add_argument('--ignore_thresh', type=float, default=0.2)
+    parser.add_argument('--samples', type=int, default=40)
+    parser.add_argument('--check_draws', type=int, default=200)
+    parser.add_argument('--check_samples', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        seqs = make_sparse_vost(root, args.seqs, args.frames, args.size,
+                                args.obj_num)
+        start = time.perf_counter()
+        for seq in seqs:
+            write_sequence_index(os.path.join(root, 'Annotations'),
+                                 os.path.join(root, INDEX_DIR), seq)
+        print(f"Indexed {len(seqs)} sequences of {args.frames} frames in "
+              f"{time.perf_counter() - start:.1f} s")
+        check_equivalence(args, root, seqs)
+        print(f"Index statistics match the decoded annotations, "
+              f"{args.check_draws} reference draws and {args.check_samples} samples "
+              f"identical")
+
+        print(f"{'path':>8} {'samples/s':>10} {'PNG decodes/sample':>19}")
+        for use_index in [False, True]:
+            throughput, decodes = run(args, root, use_index)
+            print(f"{'index' if use_index else 'decode':>8} "
+                  f"{throughput:>10.2f} {decodes:>19.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append('.')
+sys.path.append('..')
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from dataloaders.train_datasets import VOST_Train
+from dataloaders.shard import SHARD_DIR, write_shard
+from utils.image import _palette
+
+
+def make_vost(root, seq_num, frame_num, size, obj_num):
+    os.makedirs(os.path.join(root, 'ImageSets'))
+    seqs = [f'synthetic_{seq_idx:02d}' for seq_idx in range(seq_num)]
+    with open(os.path.join(root, 'ImageSets', 'train.txt'), 'w') as f:
+        f.write('\n'.join(seqs))
+    height, width = size
+    rng = np.random.RandomState(0)
+    for seq in seqs:
+        image_dir = os.path.join(root, 'JPEGImages', seq)
+        label_dir = os.path.join(root, 'Annotations', seq)
+        os.makedirs(image_dir)
+        os.makedirs(label_dir)
+        for frame_idx in range(frame_num):
+            # textured enough for realistic JPEG sizes
+            image = cv2.resize(
+                rng.randint(255, size=(height // 8, width // 8, 3),
+                            dtype=np.uint8), (width, height))
+            cv2.imwrite(os.path.join(image_dir, f'{frame_idx:05d}.jpg'), image)
+            label = np.zeros((height, width), dtype=np.uint8)
+            for obj_id in range(1, obj_num + 1):
+                y, x = rng.randint(height // 2), rng.randint(width // 2)
+                label[y:y + height // 3, x:x + width // 3] = obj_id
+            label = Image.fromarray(label).convert('P')
+            label.putpalette(_palette)
+            label.save(os.path.join(label_dir, f'{frame_idx:05d}.png'))
+    return seqs
+
+
+def evict(paths):
+    # drop the files from the page cache, as on a cold networked or
+    # spinning disk
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def dataset_files(root, use_shards):
+    dirs = [SHARD_DIR] if use_shards else ['JPEGImages', 'Annotations']
+    return [os.path.join(path, name) for dir_name in dirs
+            for path, _, names in os.walk(os.path.join(root, dir_name))
+            for name in names]
+
+
+def build_dataset(args, root, use_shards):
+    return VOST_Train(root=root,
+                      transform=None,
+                      seq_len=args.seq_len,
+                      dynamic_merge=False,
+                      use_shards=use_shards)
+
+
+def check_equivalence(args, root):
+    datasets = [build_dataset(args, root, use_shards) for use_shards in
+                [False, True]]
+    assert datasets[0].imglistdic == datasets[1].imglistdic
+    for sample_idx in range(args.check_samples):
+        samples = []
+        for dataset in datasets:
+            np.random.seed(sample_idx)
+            samples.append(dataset[sample_idx])
+        for key in ['ref_img', 'prev_img', 'curr_img', 'ref_label',
+                    'prev_label', 'curr_label']:
+            assert all(np.array_equal(ref, out) for ref, out in zip(
+                np.atleast_1d(samples[0][key]), np.atleast_1d(samples[1][key]))), \
+                f"sample {sample_idx}: {key} differs"
+
+
+def run(args, root, use_shards, cold):
+    dataset = build_dataset(args, root, use_shards)
+    if cold:
+        evict(dataset_files(root, use_shards))
+    np.random.seed(0)
+    sample_indices = np.random.randint(len(dataset), size=args.samples)
+    start = time.perf_counter()
+    for sample_idx in sample_indices:
+        dataset[sample_idx]
+    return args.samples / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Random-sample throughput of VOST_Train on a synthetic "
+        "on-disk dataset, loose files vs per-sequence shards")
+    parser.add_argument('--seqs', type=int, default=16)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--size', nargs=2, type=int, default=[480, 854])
+    parser.add_argument('--obj_num', type=int, default=2)
+    parser.add_argument('--seq_len', type=int, default=5)
+    parser.add_argument('--samples', type=int, default=40)
+    parser.add_argument('--check_samples', type=int, default=10)
+    parser.add_argument('--dir', type=str, default=None,
+                        help='where to write the dataset, a temporary '
+                        'directory by default')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        seqs = make_vost(root, args.seqs, args.frames, args.size,
+                         args.obj_num)
+        start = time.perf_counter()
+        for seq in seqs:
+            write_shard(os.path.join(root, 'JPEGImages'),
+                        os.path.join(root, 'Annotations'),
+                        os.path.join(root, SHARD_DIR), seq)
+        print(f"Packed {len(seqs)} sequences of {args.frames} frames in "
+              f"{time.perf_counter() - start:.1f} s")
+        check_equivalence(args, root)
+        print(f"{args.check_samples} samples identical from loose files and "
+              f"shards")
+
+        print(f"{'cache':>6} {'layout':>7} {'samples/s':>10}")
+        for cold in [True, False]:
+            for use_shards in [False, True]:
+                throughput = run(args, root, use_shards, cold)
+                print(f"{'cold' if cold else 'warm':>6} "
+                      f"{'shards' if use_shards else 'loose':>7} "
+                      f"{throughput:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
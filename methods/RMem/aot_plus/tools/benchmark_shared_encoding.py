@@ -0,0 +1,119 @@
+import sys
+import time
+import argparse
+
+sys.path.append('.')
+sys.path.append('..')
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from configs.default import DefaultEngineConfig
+from networks.models import build_vos_model
+from networks.engines import build_engine
+from networks.engines.aot_engine import AOTEngine
+from networks.engines.deaot_engine import DeAOTEngine, DeAOTInferEngine
+
+
+def per_engine_reference_frame(engine, img, mask, obj_num):
+    # the path before shared encoding: every sub-engine runs the backbone
+    engine_class = DeAOTEngine if isinstance(engine,
+                                             DeAOTInferEngine) else AOTEngine
+    aot_num = max(int(np.ceil(obj_num / engine.max_aot_obj_num)), 1)
+    while aot_num > len(engine.aot_engines):
+        new_engine = engine_class(engine.AOT, engine.gpu_id,
+                                  engine.long_term_mem_gap,
+                                  engine.short_term_mem_skip)
+        new_engine.eval()
+        engine.aot_engines.append(new_engine)
+    for aot_engine, separated_mask in zip(engine.aot_engines,
+                                          engine.separate_mask(mask)):
+        aot_engine.add_reference_frame(img, separated_mask,
+                                       obj_nums=[engine.max_aot_obj_num],
+                                       frame_step=0)
+    engine.update_size()
+
+
+def per_engine_match_propogate(engine, img, output_size):
+    all_logits = []
+    for aot_engine in engine.aot_engines:
+        all_logits.append(
+            aot_engine.match_propogate_one_frame(img,
+                                                 output_size=output_size))
+    return engine.soft_logit_aggregation(all_logits)
+
+
+def synthetic_mask(obj_num, size):
+    # one vertical stripe per object
+    mask = torch.zeros(1, 1, size, size)
+    width = size // obj_num
+    for obj_idx in range(obj_num):
+        mask[..., obj_idx * width:(obj_idx + 1) * width] = obj_idx + 1
+    return mask
+
+
+def run(cfg, model, frames, mask, obj_num, shared):
+    engine = build_engine(cfg.MODEL_ENGINE, phase='eval', aot_model=model,
+                          long_term_mem_gap=cfg.TEST_LONG_TERM_MEM_GAP)
+    engine.eval()
+    calls = [0]
+    handle = model.encoder.register_forward_hook(
+        lambda *_: calls.__setitem__(0, calls[0] + 1))
+    output_size = frames[0].size()[2:]
+    with torch.no_grad():
+        if shared:
+            engine.add_reference_frame(frames[0], mask, obj_nums=[obj_num],
+                                       frame_step=0)
+        else:
+            per_engine_reference_frame(engine, frames[0], mask, obj_num)
+        ref_calls = calls[0]
+        start = time.perf_counter()
+        for img in frames[1:]:
+            if shared:
+                pred_logit = engine.match_propogate_one_frame(
+                    img, output_size=output_size)
+            else:
+                pred_logit = per_engine_match_propogate(
+                    engine, img, output_size)
+            pred_label = torch.argmax(pred_logit, dim=1,
+                                      keepdim=True).float()
+            engine.update_memory(
+                F.interpolate(pred_label, size=engine.input_size_2d,
+                              mode="nearest"))
+        elapsed = time.perf_counter() - start
+    handle.remove()
+    return ref_calls, calls[0] - ref_calls, (len(frames) - 1) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark backbone sharing between AOT sub-engines")
+    parser.add_argument('--model', type=str, default='r50_aotl')
+    parser.add_argument('--obj_num', type=int, default=30)
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--size', type=int, default=241)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    cfg = DefaultEngineConfig('benchmark', args.model)
+    model = build_vos_model(cfg.MODEL_VOS, cfg).eval()
+
+    frames = [
+        torch.randn(1, 3, args.size, args.size) for _ in range(args.frames)
+    ]
+    mask = synthetic_mask(args.obj_num, args.size)
+
+    print(f"{'path':>10} {'ref backbone calls':>19} "
+          f"{'backbone calls/frame':>21} {'FPS':>7}")
+    for shared in [False, True]:
+        ref_calls, calls, fps = run(cfg, model, frames, mask, args.obj_num,
+                                    shared)
+        print(f"{'shared' if shared else 'per-engine':>10} {ref_calls:>19} "
+              f"{calls / (args.frames - 1):>21.1f} {fps:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import sys
+import copy
+import time
+import resource
+import argparse
+import multiprocessing as mp
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+import torch.nn.functional as F
+
+import networks.debug
+from configs.default import DefaultEngineConfig
+from networks.models import build_vos_model
+from networks.engines import build_engine
+from networks.engines.aot_engine import batch_encode_images
+from utils.image import flip_tensor
+
+AUGMENTATIONS = {
+    1: ([1.], False),
+    2: ([1.], True),
+    4: ([1., 1.3], True),
+}
+
+
+def tiny_config(args):
+    cfg = DefaultEngineConfig('benchmark', 'r50_aotl')
+    cfg.MODEL_ENCODER = 'mobilenetv2'
+    cfg.MODEL_ENCODER_DIM = [24, 32, 96, 1280]
+    cfg.MODEL_LSTT_NUM = 1
+    # a short long-term memory so that frames are evicted during the run
+    cfg.FORMER_MEM_LEN = 1
+    cfg.LATTER_MEM_LEN = 3
+    cfg.TEST_LONG_TERM_MEM_GAP = 2
+    return cfg
+
+
+def synthetic_sequence(frame_num, size, obj_num):
+    # a random image drifting to the right and one square per object
+    base = torch.randn(1, 3, size, size)
+    frames = [torch.roll(base, 2 * idx, dims=3) for idx in range(frame_num)]
+    mask = torch.zeros(1, 1, size, size)
+    step = size // (obj_num + 1)
+    for obj_idx in range(obj_num):
+        mask[..., obj_idx * step:obj_idx * step + step,
+             obj_idx * step:obj_idx * step + step] = obj_idx + 1
+    return frames, mask
+
+
+def augment(img, scales, flip):
+    # sizes aligned like the evaluation transforms, 16x + 1
+    augs = []
+    for scale in scales:
+        size = [int(round(s * scale / 16)) * 16 + 1 for s in img.size()[2:]]
+        scaled = F.interpolate(img, size=size, mode='bilinear',
+                               align_corners=True)
+        augs.append((scaled, False))
+        if flip:
+            augs.append((flip_tensor(scaled, 3), True))
+    return augs
+
+
+def run(args, num_augs, shared, queue):
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    networks.debug.GLOBAL_IS_DEBUG = False
+    cfg = tiny_config(args)
+    model = build_vos_model(cfg.MODEL_VOS, cfg).eval()
+    frames, mask = synthetic_sequence(args.frames, args.size, args.obj_num)
+    scales, flip = AUGMENTATIONS[num_augs]
+    # the old evaluator deep-copied the model for every augmentation
+    models = [model] * num_augs if shared else \
+        [model] + [copy.deepcopy(model) for _ in range(num_augs - 1)]
+    engines = [
+        build_engine(cfg.MODEL_ENGINE, phase='eval', aot_model=aug_model,
+                     long_term_mem_gap=cfg.TEST_LONG_TERM_MEM_GAP).eval()
+        for aug_model in models
+    ]
+    output_size = frames[0].size()[2:]
+
+    all_probs = []
+    start = None
+    with torch.no_grad():
+        for frame_idx, img in enumerate(frames):
+            if frame_idx == 1:
+                start = time.perf_counter()
+            augs = augment(img, scales, flip)
+            if shared:
+                all_img_embs = batch_encode_images(
+                    model, [aug_img for aug_img, _ in augs])
+            else:
+                all_img_embs = [None] * num_augs
+            if frame_idx == 0:
+                for engine, (aug_img, flipped), img_embs in zip(
+                        engines, augs, all_img_embs):
+                    label = flip_tensor(mask, 3) if flipped else mask
+                    label = F.interpolate(label, size=aug_img.size()[2:],
+                                          mode='nearest')
+                    engine.add_reference_frame(aug_img, label,
+                                               obj_nums=[args.obj_num],
+                                               frame_step=0,
+                                               img_embs=img_embs)
+                continue
+            preds = []
+            for engine, (aug_img, flipped), img_embs in zip(
+                    engines, augs, all_img_embs):
+                pred_logit = engine.match_propogate_one_frame(
+                    aug_img, output_size=output_size, img_embs=img_embs)
+                if flipped:
+                    pred_logit = flip_tensor(pred_logit, 3)
+                preds.append(torch.softmax(pred_logit, dim=1))
+            pred_prob = torch.mean(torch.cat(preds, dim=0), dim=0,
+                                   keepdim=True)
+            pred_label = torch.argmax(pred_prob, dim=1, keepdim=True).float()
+            for engine, (_, flipped) in zip(engines, augs):
+                label = flip_tensor(pred_label, 3) if flipped else pred_label
+                engine.update_memory(
+                    F.interpolate(label, size=engine.input_size_2d,
+                                  mode='nearest'))
+            all_probs.append(pred_prob.numpy())
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    queue.put((elapsed / (args.frames - 1) * 1e3, peak_rss, all_probs))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="CPU benchmark of test-time augmentation: a model copy "
+        "per augmentation vs one shared model with batched encoding")
+    parser.add_argument('--augs', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--frames', type=int, default=16)
+    parser.add_argument('--size', type=int, default=161)
+    parser.add_argument('--obj_num', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    print(f"{'augs':>5} {'path':>7} {'ms/frame':>9} {'peak RSS MB':>12} "
+          f"{'max abs err':>12}")
+    for num_augs in args.augs:
+        results = {}
+        for shared in [False, True]:
+            queue = ctx.Queue()
+            process = ctx.Process(target=run,
+                                  args=(args, num_augs, shared, queue))
+            process.start()
+            results[shared] = queue.get()
+            process.join()
+        err = max(
+            abs(ref - out).max()
+            for ref, out in zip(results[False][2], results[True][2]))
+        for shared in [False, True]:
+            ms, peak_rss, _ = results[shared]
+            print(f"{num_augs:>5} {'shared' if shared else 'copies':>7} "
+                  f"{ms:>9.1f} {peak_rss:>12.1f} {err:>12.2e}")
+        assert err < 1e-4, "shared engines do not match the model copies"
+
+
+if __name__ == '__main__':
+    main()
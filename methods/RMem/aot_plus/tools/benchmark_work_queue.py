@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+
+sys.path.append('.')
+sys.path.append('..')
+
+import numpy as np
+from PIL import Image
+
+from dataloaders.eval_datasets import VOST_Test
+from networks.managers.evaluator import claim_sequences
+from utils.image import _palette
+
+
+def make_skewed_vost(root, frame_nums, size):
+    # a few long clips sorted last by name, as np.unique orders the split
+    os.makedirs(os.path.join(root, 'ImageSets'))
+    seqs = [f'synthetic_{seq_idx:02d}' for seq_idx in range(len(frame_nums))]
+    with open(os.path.join(root, 'ImageSets', 'val.txt'), 'w') as f:
+        f.write('\n'.join(seqs))
+    image = Image.fromarray(np.zeros((size, size, 3), dtype=np.uint8))
+    label = Image.fromarray(np.ones((size, size), dtype=np.uint8)).convert('P')
+    label.putpalette(_palette)
+    for seq, frame_num in zip(seqs, frame_nums):
+        image_dir = os.path.join(root, 'JPEGImages_10fps', seq)
+        label_dir = os.path.join(root, 'Annotations', seq)
+        os.makedirs(image_dir)
+        os.makedirs(label_dir)
+        for frame_idx in range(frame_num):
+            image.save(os.path.join(image_dir, f'{frame_idx:05d}.jpg'))
+        label.save(os.path.join(label_dir, '00000.png'))
+
+
+class CountingDataset(VOST_Test):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.built = 0
+
+    def __getitem__(self, idx):
+        self.built += 1
+        return super().__getitem__(idx)
+
+
+def legacy_sequences(dataset, seq_queue, rank, gpu_num):
+    # the previous loop, sequences queued in order and built before skipping
+    if rank == 0:
+        for seq_idx in range(len(dataset)):
+            seq_queue.put(seq_idx)
+        for _ in range(gpu_num):
+            seq_queue.put('END')
+    coming_seq_idx = seq_queue.get()
+    for seq_idx, seq_dataset in enumerate(dataset):
+        if coming_seq_idx == 'END':
+            break
+        elif coming_seq_idx != seq_idx:
+            continue
+        coming_seq_idx = seq_queue.get()
+        yield seq_idx, seq_dataset
+
+
+def worker(rank, args, root, legacy, seq_queue, barrier, queue):
+    dataset = CountingDataset(split=['val'], root=root,
+                              result_root=os.path.join(root, 'results'))
+    claim = legacy_sequences if legacy else claim_sequences
+    barrier.wait()
+    start = time.perf_counter()
+    claimed = []
+    for seq_idx, seq_dataset in claim(dataset, seq_queue, rank, args.ranks):
+        # the per-rank device time, the ranks run on separate GPUs
+        time.sleep(len(seq_dataset) * args.frame_ms / 1e3)
+        claimed.append(seq_idx)
+    queue.put((start, time.perf_counter(), claimed, dataset.built))
+
+
+def run(args, root, legacy):
+    ctx = mp.get_context('spawn')
+    seq_queue = ctx.Queue()
+    queue = ctx.Queue()
+    barrier = ctx.Barrier(args.ranks)
+    processes = [
+        ctx.Process(target=worker,
+                    args=(rank, args, root, legacy, seq_queue, barrier, queue))
+        for rank in range(args.ranks)
+    ]
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    makespan = max(r[1] for r in results) - min(r[0] for r in results)
+    claimed = sorted(seq_idx for r in results for seq_idx in r[2])
+    built = sum(r[3] for r in results)
+    return makespan, claimed, built
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Makespan of the multi-rank evaluation queue on skewed "
+        "sequence lengths: in-order static queue vs longest-first claims")
+    parser.add_argument('--ranks', type=int, default=2)
+    parser.add_argument('--short_seqs', type=int, default=10)
+    parser.add_argument('--short_frames', type=int, default=20)
+    parser.add_argument('--long_seqs', type=int, default=1)
+    parser.add_argument('--long_frames', type=int, default=200)
+    parser.add_argument('--frame_ms', type=float, default=5.)
+    parser.add_argument('--size', type=int, default=16)
+    args = parser.parse_args()
+
+    frame_nums = [args.short_frames] * args.short_seqs + \
+        [args.long_frames] * args.long_seqs
+    print(f"{'queue':>13} {'makespan s':>11} {'ideal s':>8} "
+          f"{'datasets built':>15}")
+    ideal = max(max(frame_nums), sum(frame_nums) / args.ranks) * \
+        args.frame_ms / 1e3
+    makespans = {}
+    with tempfile.TemporaryDirectory() as root:
+        make_skewed_vost(root, frame_nums, args.size)
+        for legacy in [True, False]:
+            makespan, claimed, built = run(args, root, legacy)
+            assert claimed == list(range(len(frame_nums))), \
+                "every sequence must be processed exactly once"
+            makespans[legacy] = makespan
+            print(f"{'in order' if legacy else 'longest first':>13} "
+                  f"{makespan:>11.2f} {ideal:>8.2f} {built:>15}")
+    assert makespans[False] < makespans[True], "no makespan reduction"
+
+
+if __name__ == '__main__':
+    main()
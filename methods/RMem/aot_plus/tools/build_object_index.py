@@ -0,0 +1,32 @@
+import os
+import sys
+import argparse
+
+sys.path.append('.')
+sys.path.append('..')
+
+from dataloaders.object_index import INDEX_DIR, write_sequence_index
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write the object presence sidecars read by the training "
+        "datasets to <root>/" + INDEX_DIR)
+    parser.add_argument('--root', type=str, required=True,
+                        help='dataset root containing Annotations')
+    parser.add_argument('--seqs', nargs='+', type=str, default=None,
+                        help='sequences to index, all of them by default')
+    args = parser.parse_args()
+
+    label_root = os.path.join(args.root, 'Annotations')
+    index_root = os.path.join(args.root, INDEX_DIR)
+    seqs = args.seqs if args.seqs is not None else sorted(
+        os.listdir(label_root))
+    for seq_idx, seq_name in enumerate(seqs):
+        index = write_sequence_index(label_root, index_root, seq_name)
+        print(f"[{seq_idx + 1}/{len(seqs)}] {seq_name}: "
+              f"{len(index['labels'])} frames, {len(index['obj_ids'])} objects")
+
+
+if __name__ == '__main__':
+    main()
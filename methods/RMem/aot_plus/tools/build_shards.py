@@ -0,0 +1,34 @@
+import os
+import sys
+import argparse
+
+sys.path.append('.')
+sys.path.append('..')
+
+from dataloaders.shard import SHARD_DIR, IMAGE_DIR, LABEL_DIR, write_shard
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack every sequence of a training set into one shard "
+        "under <root>/" + SHARD_DIR + ", read with DATA_USE_SHARDS")
+    parser.add_argument('--root', type=str, required=True,
+                        help='dataset root containing JPEGImages and '
+                        'Annotations, e.g. VOST or youtube-vos/2019/train')
+    parser.add_argument('--seqs', nargs='+', type=str, default=None,
+                        help='sequences to pack, all of them by default')
+    args = parser.parse_args()
+
+    image_root = os.path.join(args.root, IMAGE_DIR)
+    label_root = os.path.join(args.root, LABEL_DIR)
+    shard_root = os.path.join(args.root, SHARD_DIR)
+    seqs = args.seqs if args.seqs is not None else sorted(
+        os.listdir(image_root))
+    for seq_idx, seq_name in enumerate(seqs):
+        index = write_shard(image_root, label_root, shard_root, seq_name)
+        print(f"[{seq_idx + 1}/{len(seqs)}] {seq_name}: "
+              f"{len(index[IMAGE_DIR])} images, {len(index[LABEL_DIR])} labels")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ import sys
 import importlib
 import sys
 import os
+import random
 from pathlib import Path
 
 sys.path.append('.')
@@ -10,6 +11,7 @@ sys.path.append('..')
 sys.path.append("./aot_plus")
 from utils.utils import Tee, copy_codes, make_log_dir
 
+import numpy as np
 import torch
 import torch.multiprocessing as mp
 
@@ -17,18 +19,16 @@ from networks.managers.evaluator import Evaluator
 from get_config import get_config
 
 def main_worker(gpu, cfg, seq_queue=None, info_queue=None, enable_amp=False):
+    if cfg.TEST_CPU_THREADS is not None:
+        torch.set_num_threads(cfg.TEST_CPU_THREADS)
     if cfg.FIX_RANDOM:
         random_seed = 1
         print(f"[{gpu}] : Fix random seed {random_seed}")
-        import os
         os.environ['CUDNN_DETERMINISTIC'] = '1'
         os.environ['PYTHONHASHSEED'] = str(random_seed)
         # os.environ['CUBLAS_WORKSPACE_CONFIG']=":4096:8"
-        import random
         random.seed(random_seed+1)
-        import numpy as np
         np.random.seed(random_seed+2)
-        import torch
         torch.manual_seed(random_seed+3)
         torch.cuda.manual_seed(random_seed+4)
         torch.cuda.manual_seed_all(random_seed+5)
@@ -60,6 +60,12 @@ def main():
 
     parser.add_argument('--gpu_id', type=int, default=0)
     parser.add_argument('--gpu_num', type=int, default=1)
+    parser.add_argument('--device', type=str, default='cuda',
+                        choices=['cuda', 'cpu'])
+    parser.add_argument('--threads', type=int, default=None,
+                        help='torch CPU threads per evaluation process')
+    parser.add_argument('--audit_syncs', action='store_true',
+                        help='report the host syncs of every sequence')
 
     parser.add_argument('--ckpt_path', type=str, default='')
     parser.add_argument('--ckpt_step', type=int, default=-1)
@@ -113,6 +119,9 @@ def main():
 
     cfg.TEST_GPU_ID = args.gpu_id
     cfg.TEST_GPU_NUM = args.gpu_num
+    cfg.TEST_DEVICE = args.device
+    cfg.TEST_CPU_THREADS = args.threads
+    cfg.TEST_AUDIT_SYNCS = args.audit_syncs
     cfg.WEEK_NUM = args.week_num
     cfg.FPS  = args.dataset_fps
 
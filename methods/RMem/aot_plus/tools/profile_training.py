@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+sys.path.append('.')
+sys.path.append('..')
+
+import torch
+import torch.optim as optim
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+import networks.debug
+import dataloaders.video_transforms as tr
+from dataloaders.train_datasets import VOST_Train
+from dataloaders.object_index import INDEX_DIR, write_sequence_index
+from networks.models import build_vos_model
+from networks.engines import build_engine
+from utils.ema import ExponentialMovingAverage, get_param_buffer_for_ema
+from utils.phase_profiler import PhaseProfiler
+from tools.benchmark_tta import tiny_config
+from tools.benchmark_object_index import make_sparse_vost
+
+
+def build_loader(args, cfg, root):
+    # the training transforms of the trainer
+    composed_transforms = transforms.Compose([
+        tr.RandomScale(cfg.DATA_MIN_SCALE_FACTOR, cfg.DATA_MAX_SCALE_FACTOR,
+                       cfg.DATA_SHORT_EDGE_LEN),
+        tr.BalancedRandomCrop(cfg.DATA_RANDOMCROP,
+                              max_obj_num=cfg.MODEL_MAX_OBJ_NUM),
+        tr.RandomHorizontalFlip(cfg.DATA_RANDOMFLIP),
+        tr.Resize(cfg.DATA_RANDOMCROP, use_padding=True),
+        tr.ToTensor(),
+    ])
+    dataset = VOST_Train(root=root,
+                         transform=composed_transforms,
+                         seq_len=cfg.DATA_SEQ_LEN,
+                         rand_gap=cfg.DATA_RANDOM_GAP_VOST,
+                         merge_prob=cfg.DATA_DYNAMIC_MERGE_PROB,
+                         max_obj_n=cfg.MODEL_MAX_OBJ_NUM,
+                         ignore_thresh=cfg.DATA_VOST_IGNORE_THRESH)
+    return DataLoader(dataset,
+                      batch_size=args.batch_size,
+                      shuffle=True,
+                      num_workers=args.workers,
+                      drop_last=True)
+
+
+def train(args, cfg, loader, profiler):
+    # the step of Trainer.sequential_training, without distribution
+    model = build_vos_model(cfg.MODEL_VOS, cfg)
+    engine = build_engine(cfg.MODEL_ENGINE, 'train', aot_model=model,
+                          long_term_mem_gap=cfg.TRAIN_LONG_TERM_MEM_GAP)
+    engine.train()
+    optimizer = optim.AdamW(model.parameters(), lr=cfg.TRAIN_LR)
+    ema_params = get_param_buffer_for_ema(model, update_buffer=True)
+    ema = ExponentialMovingAverage(ema_params, decay=0.999)
+
+    step = 0
+    while step < args.steps:
+        profiler.start()
+        for sample in loader:
+            profiler.lap('data')
+            if step >= args.steps:
+                break
+            all_frames = torch.cat([sample['ref_img'], sample['prev_img']] +
+                                   sample['curr_img'], dim=0)
+            all_labels = torch.cat(
+                [sample['ref_label'], sample['prev_label']] +
+                sample['curr_label'], dim=0)
+            obj_nums = [int(obj_num) for obj_num in sample['meta']['obj_num']]
+            profiler.lap('h2d')
+
+            # identity shuffling draws its permutations on CUDA
+            engine.restart_engine(args.batch_size, False)
+            optimizer.zero_grad(set_to_none=True)
+            loss, all_pred, all_loss, boards = engine(all_frames, all_labels,
+                                                      args.batch_size,
+                                                      obj_nums=obj_nums,
+                                                      step=step)
+            loss = torch.mean(loss)
+            profiler.lap('forward')
+            loss.backward()
+            profiler.lap('backward')
+            torch.nn.utils.clip_grad_norm_(model.parameters(),
+                                           cfg.TRAIN_CLIP_GRAD_NORM)
+            optimizer.step()
+            profiler.lap('optimizer')
+            losses = [torch.mean(frame_loss.detach()).item()
+                      for frame_loss in all_loss]
+            profiler.lap('metrics')
+            ema.update(ema_params)
+            profiler.lap('ema')
+
+            step += 1
+            profiler.end_step(step)
+    return losses
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="CPU smoke run of the training step phase profiler: a "
+        "tiny model on a synthetic on-disk VOST")
+    parser.add_argument('--steps', type=int, default=12)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--crop', type=int, default=129)
+    parser.add_argument('--seqs', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=40)
+    parser.add_argument('--size', nargs=2, type=int, default=[240, 427])
+    parser.add_argument('--object_index', action='store_true',
+                        help='sample with the object presence index')
+    parser.add_argument('--dump_step', type=int, default=4)
+    parser.add_argument('--dump_dir', type=str, default=None,
+                        help='where the json and the Chrome trace go, a '
+                        'temporary directory by default')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    networks.debug.GLOBAL_IS_DEBUG = False
+    cfg = tiny_config(args)
+    cfg.DATA_RANDOMCROP = (args.crop, args.crop)
+    cfg.DATA_SHORT_EDGE_LEN = args.crop + args.crop // 8
+    cfg.DATA_SEQ_LEN = 3
+    cfg.MODEL_MAX_OBJ_NUM = 3
+
+    with tempfile.TemporaryDirectory() as root:
+        seqs = make_sparse_vost(root, args.seqs, args.frames, args.size, 3)
+        if args.object_index:
+            for seq in seqs:
+                write_sequence_index(os.path.join(root, 'Annotations'),
+                                     os.path.join(root, INDEX_DIR), seq)
+        dump_dir = args.dump_dir or os.path.join(root, 'log')
+        profiler = PhaseProfiler(dump_dir=dump_dir, dump_step=args.dump_step,
+                                 sync=False)
+        losses = train(args, cfg, build_loader(args, cfg, root), profiler)
+        print(profiler.summary())
+
+        assert all(loss == loss for loss in losses), 'non-finite loss'
+        with open(os.path.join(dump_dir, 'phase_profile_rank0.json')) as f:
+            report = json.load(f)
+        with open(os.path.join(dump_dir, 'phase_trace_rank0.json')) as f:
+            trace = json.load(f)
+        dumped = args.steps // args.dump_step * args.dump_step
+        assert report['step'] == dumped, report['step']
+        assert set(report['phases']) == {
+            'data', 'h2d', 'forward', 'backward', 'optimizer', 'metrics',
+            'ema', 'other'
+        }, sorted(report['phases'])
+        assert len(trace['traceEvents']) == dumped * len(report['phases'])
+        print(f"Step {report['step']} report and a Chrome trace of "
+              f"{len(trace['traceEvents'])} events written to {dump_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -70,6 +70,9 @@ def main():
     parser.set_defaults(debug_fix_random=False)
     parser.add_argument('--fix_random', action='store_true')
     parser.set_defaults(fix_random=False)
+    parser.add_argument('--profile_phases', action='store_true')
+    parser.set_defaults(profile_phases=False)
+    parser.add_argument('--profile_dump_step', type=int, default=0)
 
     args = parser.parse_args()
 
@@ -100,6 +103,12 @@ def main():
     if args.start_step > 0:
         cfg.TRAIN_START_STEP = args.start_step
 
+    if args.profile_phases:
+        cfg.TRAIN_PROFILE_PHASES = True
+
+    if args.profile_dump_step > 0:
+        cfg.TRAIN_PROFILE_DUMP_STEP = args.profile_dump_step
+
     if args.dist_url == '':
         cfg.DIST_URL = 'tcp://127.0.0.1:123' + str(random.randint(0, 9)) + str(
             random.randint(0, 9))
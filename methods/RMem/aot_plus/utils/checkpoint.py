@@ -3,9 +3,16 @@ import os
 import numpy as np
 
 
+def _to_device(gpu):
+    # gpu: cuda index or torch.device
+    if isinstance(gpu, torch.device):
+        return gpu
+    return torch.device("cuda:" + str(gpu))
+
+
 def load_network_and_optimizer(net, opt, pretrained_dir, gpu, scaler=None):
     pretrained = torch.load(pretrained_dir,
-                            map_location=torch.device("cuda:" + str(gpu)))
+                            map_location=_to_device(gpu))
     pretrained_dict = pretrained['state_dict']
     model_dict = net.state_dict()
     pretrained_dict_update = {}
@@ -24,12 +31,12 @@ def load_network_and_optimizer(net, opt, pretrained_dir, gpu, scaler=None):
     if scaler is not None and 'scaler' in pretrained.keys():
         scaler.load_state_dict(pretrained['scaler'])
     del (pretrained)
-    return net.cuda(gpu), opt, pretrained_dict_remove
+    return net.to(_to_device(gpu)), opt, pretrained_dict_remove
 
 
 def load_network_and_optimizer_v2(net, opt, pretrained_dir, gpu, scaler=None):
     pretrained = torch.load(pretrained_dir,
-                            map_location=torch.device("cuda:" + str(gpu)))
+                            map_location=_to_device(gpu))
     # load model
     pretrained_dict = pretrained['state_dict']
     model_dict = net.state_dict()
@@ -69,12 +76,12 @@ def load_network_and_optimizer_v2(net, opt, pretrained_dir, gpu, scaler=None):
     if scaler is not None and 'scaler' in pretrained.keys():
         scaler.load_state_dict(pretrained['scaler'])
     del (pretrained)
-    return net.cuda(gpu), opt, pretrained_dict_remove
+    return net.to(_to_device(gpu)), opt, pretrained_dict_remove
 
 
 def load_network(net, pretrained_dir, gpu):
     pretrained = torch.load(pretrained_dir,
-                            map_location=torch.device("cuda:" + str(gpu)))
+                            map_location=_to_device(gpu))
     if 'state_dict' in pretrained.keys():
         pretrained_dict = pretrained['state_dict']
     elif 'model' in pretrained.keys():
@@ -98,7 +105,13 @@ def load_network(net, pretrained_dir, gpu):
     model_dict.update(pretrained_dict_update)
     net.load_state_dict(model_dict)
     del (pretrained)
-    return net.cuda(gpu), pretrained_dict_remove
+    return net.to(_to_device(gpu)), pretrained_dict_remove
+
+
+def load_ema_state(pretrained_dir):
+    # the EMA counters saved along the averaged weights, or None
+    pretrained = torch.load(pretrained_dir, map_location='cpu')
+    return pretrained.get('ema')
 
 
 def save_network(net,
@@ -107,10 +120,13 @@ def save_network(net,
                  save_path,
                  max_keep=8,
                  backup_dir='./saved_models',
-                 scaler=None):
+                 scaler=None,
+                 ema=None):
     ckpt = {'state_dict': net.state_dict(), 'optimizer': opt.state_dict()}
     if scaler is not None:
         ckpt['scaler'] = scaler.state_dict()
+    if ema is not None:
+        ckpt['ema'] = ema
 
     try:
         if not os.path.exists(save_path):
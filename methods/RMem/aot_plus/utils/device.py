@@ -0,0 +1,31 @@
+import time
+import resource
+
+import torch
+
+
+def get_device(device='cuda', gpu_id=0):
+    if device == 'cpu':
+        return torch.device('cpu')
+    return torch.device('cuda', gpu_id)
+
+
+class Timer(object):
+    """Wall clock timer, waits for the queued CUDA kernels before reading."""
+    def __init__(self, device, sync=True):
+        self.device = torch.device(device)
+        self.sync = sync and self.device.type == 'cuda'
+
+    def record(self):
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+        return time.perf_counter()
+
+
+def max_memory_gb(device):
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device=device) / (1024.**3)
+    # CPU tensors do not go through the Python allocator, so tracemalloc
+    # misses them; the peak resident set size covers everything.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.**2)
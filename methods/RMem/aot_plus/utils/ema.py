@@ -19,11 +19,21 @@ def get_param_buffer_for_ema(model,
     return all_param_buffer
 
 
+def group_by_device_dtype(tensors):
+    # indices of the tensors sharing a device and dtype, in order
+    groups = {}
+    for idx, tensor in enumerate(tensors):
+        groups.setdefault((tensor.device, tensor.dtype), []).append(idx)
+    return list(groups.values())
+
+
 class ExponentialMovingAverage:
     """
     Maintains (exponential) moving average of a set of parameters.
+    The shadow parameters are views into one contiguous buffer per device and
+    dtype, updated with multi-tensor (foreach) ops.
     """
-    def __init__(self, parameters, decay, use_num_updates=True):
+    def __init__(self, parameters, decay, use_num_updates=True, update_every=1):
         """
         Args:
           parameters: Iterable of `torch.nn.Parameter`; usually the result of
@@ -31,12 +41,30 @@ class ExponentialMovingAverage:
           decay: The exponential decay.
           use_num_updates: Whether to use number of updates when computing
             averages.
+          update_every: Average every N calls of `update` only, with the decay
+            raised to the power N.
         """
         if decay < 0.0 or decay > 1.0:
             raise ValueError('Decay must be between 0 and 1')
+        if update_every < 1:
+            raise ValueError('update_every must be at least 1')
         self.decay = decay
         self.num_updates = 0 if use_num_updates else None
-        self.shadow_params = [p.clone().detach() for p in parameters]
+        self.update_every = update_every
+        self.num_steps = 0
+        parameters = [p.detach() for p in parameters]
+        self.groups = group_by_device_dtype(parameters)
+        self.shadow_buffers = []
+        self.shadow_params = [None] * len(parameters)
+        for indices in self.groups:
+            buffer = torch.cat([parameters[idx].reshape(-1) for idx in indices])
+            offset = 0
+            for idx in indices:
+                numel = parameters[idx].numel()
+                self.shadow_params[idx] = buffer[offset:offset + numel].view_as(
+                    parameters[idx])
+                offset += numel
+            self.shadow_buffers.append(buffer)
         self.collected_params = []
 
     def update(self, parameters):
@@ -53,10 +81,37 @@ class ExponentialMovingAverage:
             self.num_updates += 1
             decay = min(decay,
                         (1 + self.num_updates) / (10 + self.num_updates))
-        one_minus_decay = 1.0 - decay
+        self.num_steps += 1
+        if self.num_steps % self.update_every != 0:
+            return
+        # the decay of the skipped steps folded into this one
+        decay = decay**self.update_every
+        parameters = list(parameters)
         with torch.no_grad():
-            for s_param, param in zip(self.shadow_params, parameters):
-                s_param.sub_(one_minus_decay * (s_param - param))
+            for buffer, indices in zip(self.shadow_buffers, self.groups):
+                buffer.mul_(decay)
+                torch._foreach_add_([self.shadow_params[idx] for idx in indices],
+                                    [parameters[idx] for idx in indices],
+                                    alpha=1.0 - decay)
+
+    def state_dict(self):
+        return {
+            'decay': self.decay,
+            'num_updates': self.num_updates,
+            'update_every': self.update_every,
+            'num_steps': self.num_steps,
+            'shadow_buffers': self.shadow_buffers,
+        }
+
+    def load_state_dict(self, state_dict):
+        self.decay = state_dict['decay']
+        self.num_updates = state_dict['num_updates']
+        self.update_every = state_dict['update_every']
+        self.num_steps = state_dict['num_steps']
+        # without buffers, the shadow parameters are kept as they are
+        for buffer, saved in zip(self.shadow_buffers,
+                                 state_dict.get('shadow_buffers', [])):
+            buffer.copy_(saved)
 
     def copy_to(self, parameters):
         """
@@ -1,6 +1,8 @@
 import numpy as np
 from PIL import Image
 import torch
+import atexit
+import queue
 import threading
 
 _palette = [
@@ -87,7 +89,7 @@ def save_image(image, path):
     im.save(path)
 
 
-def _save_mask(mask, path, squeeze_idx=None):
+def _save_mask(mask, path, squeeze_idx=None, compress_level=None):
     if squeeze_idx is not None:
         unsqueezed_mask = mask * 0
         for idx in range(1, len(squeeze_idx)):
@@ -97,13 +99,88 @@ def _save_mask(mask, path, squeeze_idx=None):
         mask = unsqueezed_mask
     mask = Image.fromarray(mask).convert('P')
     mask.putpalette(_palette)
-    mask.save(path)
+    if compress_level is None:
+        mask.save(path)
+    else:
+        mask.save(path, compress_level=compress_level)
+
+
+class AsyncMaskWriter(object):
+    """Save masks with a fixed pool of threads.
+
+    `write` blocks while `max_queue` masks are pending, so a slow disk can not
+    pile up predictions in memory. `flush` waits for every pending mask and
+    re-raises the first error hit by a worker.
+    """
+    def __init__(self, num_workers=4, max_queue=64, compress_level=None):
+        self.compress_level = compress_level
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.error_lock = threading.Lock()
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                # drop the remaining jobs once an error is pending
+                if self.error is None:
+                    _save_mask(*job)
+            except Exception as inst:
+                with self.error_lock:
+                    if self.error is None:
+                        self.error = inst
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        with self.error_lock:
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def write(self, mask_tensor, path, squeeze_idx=None):
+        self._raise_error()
+        mask = mask_tensor.cpu().numpy().astype('uint8')
+        self.queue.put((mask, path, squeeze_idx, self.compress_level))
+
+    def flush(self):
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if not self.workers:
+            return
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_default_mask_writer = None
 
 
 def save_mask(mask_tensor, path, squeeze_idx=None):
-    mask = mask_tensor.cpu().numpy().astype('uint8')
-    threading.Thread(target=_save_mask, args=[mask, path, squeeze_idx]).start()
-    # _save_mask(mask, path, squeeze_idx)
+    global _default_mask_writer
+    if _default_mask_writer is None:
+        _default_mask_writer = AsyncMaskWriter()
+        atexit.register(_default_mask_writer.close)
+    _default_mask_writer.write(mask_tensor, path, squeeze_idx)
 
 
 def flip_tensor(tensor, dim=0):
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+from collections import deque
+
+import numpy as np
+import torch
+
+# Phases of a training step, in order
+TRAIN_PHASES = ('data', 'h2d', 'forward', 'backward', 'optimizer', 'metrics',
+                'ema', 'other')
+
+
+def _write_json(path, content):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f)
+    os.replace(tmp_path, path)
+
+
+class PhaseProfiler(object):
+    """
+    Wall-clock time of the phases of every training step, with percentiles
+    over the last `window` steps.
+
+        profiler.start()
+        for sample in train_loader:
+            profiler.lap('data')
+            ...
+            profiler.lap('forward')
+            ...
+            step += 1
+            profiler.end_step(step)
+
+    A lap closes the phase that began at the previous lap. CUDA is
+    synchronized first so that each phase owns its kernels. Every `dump_step`
+    steps the statistics and a Chrome trace of the window are written to
+    `dump_dir`. A disabled profiler does nothing.
+    """
+    def __init__(self,
+                 enabled=True,
+                 window=200,
+                 dump_dir=None,
+                 dump_step=0,
+                 rank=0,
+                 sync=None):
+        self.enabled = enabled
+        self.window = window
+        self.dump_dir = dump_dir
+        self.dump_step = dump_step
+        self.rank = rank
+        self.sync = torch.cuda.is_available() if sync is None else sync
+        self.times = {}
+        self.step_times = deque(maxlen=window)
+        self.events = deque()
+        self._last = None
+        self._laps = []
+
+    def _now(self):
+        if self.sync:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._last = self._now()
+        self._laps = []
+
+    def lap(self, phase):
+        if not self.enabled:
+            return
+        now = self._now()
+        if self._last is None:
+            self._last = now
+        self._laps.append((phase, self._last, now))
+        self._last = now
+
+    def end_step(self, step):
+        if not self.enabled:
+            return
+        self.lap('other')
+        step_phases = {}
+        for phase, begin, end in self._laps:
+            step_phases[phase] = step_phases.get(phase, 0.) + end - begin
+            self.events.append({
+                'name': phase,
+                'ph': 'X',
+                'ts': begin * 1e6,
+                'dur': (end - begin) * 1e6,
+                'pid': self.rank,
+                'tid': 0,
+                'args': {'step': step},
+            })
+        for phase, seconds in step_phases.items():
+            if phase not in self.times:
+                self.times[phase] = deque(maxlen=self.window)
+            self.times[phase].append(seconds)
+        self.step_times.append(self._laps[-1][2] - self._laps[0][1])
+        # the trace keeps the laps of the last window steps
+        while self.events and \
+                self.events[0]['args']['step'] <= step - self.window:
+            self.events.popleft()
+        self._laps = []
+        if self.dump_step > 0 and self.dump_dir is not None and \
+                step % self.dump_step == 0:
+            self.dump(step)
+
+    def phases(self):
+        return [phase for phase in TRAIN_PHASES if phase in self.times] + \
+            sorted(phase for phase in self.times if phase not in TRAIN_PHASES)
+
+    def stats(self):
+        # milliseconds, and the share of the total step time
+        total = max(sum(self.step_times) * 1e3, 1e-9)
+        stats = {}
+        for phase in self.phases():
+            times = np.array(self.times[phase]) * 1e3
+            stats[phase] = {
+                'mean': float(times.mean()),
+                'p50': float(np.percentile(times, 50)),
+                'p90': float(np.percentile(times, 90)),
+                'p99': float(np.percentile(times, 99)),
+                'max': float(times.max()),
+                'share': float(times.sum() / total),
+            }
+        return stats
+
+    def summary(self):
+        if not self.step_times:
+            return 'No profiled steps.'
+        lines = [
+            f"Step phases over the last {len(self.step_times)} steps, "
+            f"{np.mean(self.step_times) * 1e3:.1f} ms/step:",
+            f"{'phase':>10} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} "
+            f"{'share':>6}"
+        ]
+        for phase, stat in self.stats().items():
+            lines.append(f"{phase:>10} {stat['mean']:>8.1f} {stat['p50']:>8.1f} "
+                         f"{stat['p90']:>8.1f} {stat['p99']:>8.1f} "
+                         f"{stat['share'] * 100:>5.1f}%")
+        return '\n'.join(lines)
+
+    def dump(self, step):
+        os.makedirs(self.dump_dir, exist_ok=True)
+        _write_json(
+            os.path.join(self.dump_dir, f'phase_profile_rank{self.rank}.json'),
+            {
+                'step': step,
+                'steps': len(self.step_times),
+                'step_mean': float(np.mean(self.step_times)) * 1e3,
+                'phases': self.stats(),
+            })
+        _write_json(
+            os.path.join(self.dump_dir, f'phase_trace_rank{self.rank}.json'),
+            {
+                'traceEvents': list(self.events),
+                'displayTimeUnit': 'ms',
+            })
@@ -0,0 +1,135 @@
+import os
+import sys
+import functools
+import threading
+from collections import Counter
+
+import torch
+
+# Tensor methods that read tensor values on the host
+SYNC_METHODS = ('item', 'cpu', 'numpy', 'tolist', '__bool__', '__int__',
+                '__float__', '__index__')
+# Steps of AOTEngine / AOTInferEngine a sync is attributed to
+ENGINE_STEPS = ('add_reference_frame', 'match_propogate_one_frame',
+                'update_memory', 'update_short_term_memory')
+
+_TORCH_DIR = os.path.dirname(torch.__file__)
+
+
+class SyncAuditor(object):
+    """
+    Opt-in counter of the device-to-host reads of the inference loop.
+
+    While active, torch.Tensor is patched so that every call in SYNC_METHODS
+    made from the entering thread is counted for the current frame, with the
+    engine step running it and the first stack frames outside torch.
+
+        with SyncAuditor() as auditor:
+            auditor.watch(engine)
+            for frame in frames:
+                auditor.start_frame()
+                ...
+        print(auditor.summary())
+    """
+    def __init__(self, stack_depth=2):
+        self.stack_depth = stack_depth
+        self.reset()
+        self._patched = {}
+        self._local = threading.local()
+        self._thread = None
+
+    def reset(self):
+        self.frames = []
+        self.locations = Counter()
+
+    def __enter__(self):
+        self._thread = threading.get_ident()
+        for name in SYNC_METHODS:
+            self._patched[name] = name in torch.Tensor.__dict__
+            original = getattr(torch.Tensor, name)
+            setattr(torch.Tensor, name, self._wrap_method(name, original))
+        return self
+
+    def __exit__(self, *exc):
+        for name, own in self._patched.items():
+            wrapper = torch.Tensor.__dict__[name]
+            if own:
+                setattr(torch.Tensor, name, wrapper.__wrapped__)
+            else:
+                delattr(torch.Tensor, name)
+        self._patched = {}
+        return False
+
+    def _wrap_method(self, name, original):
+        auditor = self
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            if threading.get_ident() != auditor._thread or \
+                    getattr(auditor._local, 'busy', False):
+                return original(*args, **kwargs)
+            auditor._local.busy = True
+            try:
+                auditor._record(name)
+                return original(*args, **kwargs)
+            finally:
+                auditor._local.busy = False
+
+        return wrapper
+
+    def _record(self, name):
+        location = []
+        frame = sys._getframe(1)
+        while frame is not None and len(location) < self.stack_depth:
+            filename = frame.f_code.co_filename
+            if not filename.startswith(_TORCH_DIR) and filename != __file__:
+                location.append(f"{os.path.relpath(filename)}:{frame.f_lineno} "
+                                f"{frame.f_code.co_name}")
+            frame = frame.f_back
+        location = tuple(location)
+        step = getattr(self._local, 'step', None)
+        self.locations[(name, step, location)] += 1
+        if self.frames:
+            self.frames[-1][name] += 1
+
+    def watch(self, engine, steps=ENGINE_STEPS):
+        # Label the syncs with the outermost engine step running them
+        for step in steps:
+            if hasattr(engine, step):
+                setattr(engine, step, self._wrap_step(step, getattr(engine, step)))
+        return engine
+
+    def _wrap_step(self, step, method):
+        auditor = self
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            outer = getattr(auditor._local, 'step', None)
+            if outer is None:
+                auditor._local.step = step
+            try:
+                return method(*args, **kwargs)
+            finally:
+                auditor._local.step = outer
+
+        return wrapper
+
+    def start_frame(self):
+        self.frames.append(Counter())
+
+    def frame_counts(self):
+        return [sum(frame.values()) for frame in self.frames]
+
+    def summary(self, skip_frames=1, top=10):
+        counts = self.frame_counts()[skip_frames:]
+        kinds = sum(self.frames[skip_frames:], Counter())
+        lines = [
+            f"Host syncs over {len(counts)} frames: "
+            f"mean {sum(counts) / max(len(counts), 1):.1f}, "
+            f"max {max(counts, default=0)} per frame "
+            f"({', '.join(f'{name} {num}' for name, num in kinds.most_common())})"
+        ]
+        for (name, step, location), num in self.locations.most_common(top):
+            lines.append(f"{num:>6} {name:<10} {step or '-'}")
+            lines.extend(f"{'':>8}{frame}" for frame in location)
+        return '\n'.join(lines)
@@ -19,7 +19,8 @@ class KeyValueMemoryStore:
         self.count_usage = count_usage
 
         # keys are stored in a single tensor and are shared between groups/objects
-        # values are stored as a list indexed by object groups
+        # values are stored as a list indexed by object groups, N-major (num_objects*N*C)
+        # so that the top-k readout picks whole value vectors
         self.k = None
         self.v = []
         self.obj_groups = []
@@ -34,6 +35,7 @@ class KeyValueMemoryStore:
             self.use_count = self.life_count = None
 
     def add(self, key, value, shrinkage, selection, objects: List[int]):
+        # values are given as num_objects*C*N like the keys
         new_count = torch.zeros((key.shape[0], 1, key.shape[2]), device=key.device, dtype=torch.float32)
         new_life = torch.zeros((key.shape[0], 1, key.shape[2]), device=key.device, dtype=torch.float32) + 1e-7
 
@@ -59,6 +61,7 @@ class KeyValueMemoryStore:
         if objects is not None:
             # When objects is given, v is a tensor; used in working memory
             assert isinstance(value, torch.Tensor)
+            value = value.transpose(1, 2).contiguous()
             # First consume objects that are already in the memory bank
             # cannot use set here because we need to preserve order
             # shift by one as background is not part of value
@@ -67,7 +70,7 @@ class KeyValueMemoryStore:
                 for obj in group:
                     # should properly raise an error if there are overlaps in obj_groups
                     remaining_objects.remove(obj)
-                self.v[gi] = torch.cat([self.v[gi], value[group]], -1)
+                self.v[gi] = torch.cat([self.v[gi], value[group]], 1)
 
             # If there are remaining objects, add them as a new group
             if len(remaining_objects) > 0:
@@ -84,8 +87,9 @@ class KeyValueMemoryStore:
             for gi, gv in enumerate(value):
                 if gv is None:
                     continue
+                gv = gv.transpose(1, 2).contiguous()
                 if gi < self.num_groups:
-                    self.v[gi] = torch.cat([self.v[gi], gv], -1)
+                    self.v[gi] = torch.cat([self.v[gi], gv], 1)
                 else:
                     self.v.append(gv)
 
@@ -116,8 +120,8 @@ class KeyValueMemoryStore:
                 self.e = self.e[:,:,:start]
             
             for gi in range(self.num_groups):
-                if self.v[gi].shape[-1] >= min_size:
-                    self.v[gi] = self.v[gi][:,:,:start]
+                if self.v[gi].shape[1] >= min_size:
+                    self.v[gi] = self.v[gi][:,:start]
         else:
             self.k = torch.cat([self.k[:,:,:start], self.k[:,:,end:]], -1)
             if self.count_usage:
@@ -129,8 +133,8 @@ class KeyValueMemoryStore:
                 self.e = torch.cat([self.e[:,:,:start], self.e[:,:,end:]], -1)
             
             for gi in range(self.num_groups):
-                if self.v[gi].shape[-1] >= min_size:
-                    self.v[gi] = torch.cat([self.v[gi][:,:,:start], self.v[gi][:,:,end:]], -1)
+                if self.v[gi].shape[1] >= min_size:
+                    self.v[gi] = torch.cat([self.v[gi][:,:start], self.v[gi][:,end:]], 1)
 
     def remove_obsolete_features(self, max_size: int):
         # normalize with life duration
@@ -150,7 +154,7 @@ class KeyValueMemoryStore:
             Basically we need to remap the indices for keys to values
             """)
         for gi in range(self.num_groups):
-            self.v[gi] = self.v[gi][:, :, survived]
+            self.v[gi] = self.v[gi][:, survived]
 
         self.use_count = self.use_count[:, :, survived]
         self.life_count = self.life_count[:, :, survived]
@@ -181,7 +185,7 @@ class KeyValueMemoryStore:
         return k, sk, ek, usage
 
     def get_v_size(self, ni: int):
-        return self.v[ni].shape[2]
+        return self.v[ni].shape[1]
 
     def engaged(self):
         return self.k is not None
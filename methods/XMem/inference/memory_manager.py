@@ -50,9 +50,18 @@ class MemoryManager:
             self.num_prototypes = config['num_prototypes']
             self.max_long_elements = config['max_long_term_elements']
 
+    def _softmax(self, similarity, inplace=False, return_usage=False):
+        # with top_k the affinity stays sparse as an (indices, weights) pair
+        if self.top_k is None:
+            return do_softmax(similarity, inplace=inplace, return_usage=return_usage)
+        return do_sparse_softmax(similarity, self.top_k, return_usage=return_usage)
+
     def _readout(self, affinity, v):
         # this function is for a single object group
-        return v @ affinity
+        # v: num_objects*N*C, as in the memory stores
+        if isinstance(affinity, tuple):
+            return sparse_readout(v, *affinity)
+        return v.transpose(1, 2) @ affinity
 
     def match_memory(self, query_key, selection):
         # query_key: B x C^k x H x W
@@ -79,30 +88,30 @@ class MemoryManager:
 
             # get the usage with the first group
             # the first group always have all the keys valid
-            affinity, usage = do_softmax(
+            affinity, usage = self._softmax(
                     torch.cat([long_mem_similarity[:, -self.long_mem.get_v_size(0):], work_mem_similarity], 1), 
-                    top_k=self.top_k, inplace=True, return_usage=True)
+                    inplace=True, return_usage=True)
             affinity = [affinity]
 
             # compute affinity group by group as later groups only have a subset of keys
             for gi in range(1, num_groups):
                 if gi < self.long_mem.num_groups:
                     # merge working and lt similarities before softmax
-                    affinity_one_group = do_softmax(
+                    affinity_one_group = self._softmax(
                         torch.cat([long_mem_similarity[:, -self.long_mem.get_v_size(gi):], 
                                     work_mem_similarity[:, -self.work_mem.get_v_size(gi):]], 1), 
-                        top_k=self.top_k, inplace=True)
+                        inplace=True)
                 else:
                     # no long-term memory for this group
-                    affinity_one_group = do_softmax(work_mem_similarity[:, -self.work_mem.get_v_size(gi):], 
-                        top_k=self.top_k, inplace=(gi==num_groups-1))
+                    affinity_one_group = self._softmax(work_mem_similarity[:, -self.work_mem.get_v_size(gi):], 
+                        inplace=(gi==num_groups-1))
                 affinity.append(affinity_one_group)
 
             all_memory_value = []
             for gi, gv in enumerate(self.work_mem.value):
                 # merge the working and lt values before readout
                 if gi < self.long_mem.num_groups:
-                    all_memory_value.append(torch.cat([self.long_mem.value[gi], self.work_mem.value[gi]], -1))
+                    all_memory_value.append(torch.cat([self.long_mem.value[gi], self.work_mem.value[gi]], 1))
                 else:
                     all_memory_value.append(gv)
 
@@ -122,21 +131,21 @@ class MemoryManager:
             similarity = get_similarity(self.work_mem.key, self.work_mem.shrinkage, query_key, selection)
 
             if self.enable_long_term:
-                affinity, usage = do_softmax(similarity, inplace=(num_groups==1), 
-                    top_k=self.top_k, return_usage=True)
+                affinity, usage = self._softmax(similarity, inplace=(num_groups==1), 
+                    return_usage=True)
 
                 # Record memory usage for working memory
                 self.work_mem.update_usage(usage.flatten())
             else:
-                affinity = do_softmax(similarity, inplace=(num_groups==1), 
-                    top_k=self.top_k, return_usage=False)
+                affinity = self._softmax(similarity, inplace=(num_groups==1), 
+                    return_usage=False)
 
             affinity = [affinity]
 
             # compute affinity group by group as later groups only have a subset of keys
             for gi in range(1, num_groups):
-                affinity_one_group = do_softmax(similarity[:, -self.work_mem.get_v_size(gi):], 
-                    top_k=self.top_k, inplace=(gi==num_groups-1))
+                affinity_one_group = self._softmax(similarity[:, -self.work_mem.get_v_size(gi):], 
+                    inplace=(gi==num_groups-1))
                 affinity.append(affinity_one_group)
                 
             all_memory_value = self.work_mem.value
@@ -216,16 +225,16 @@ class MemoryManager:
             # Some object groups might be added later in the video
             # So not all keys have values associated with all objects
             # We need to keep track of the key->value validity
-            mem_size_in_this_group = gv.shape[-1]
+            mem_size_in_this_group = gv.shape[1]
             if mem_size_in_this_group == total_work_mem_size:
                 # full LT
-                candidate_value.append(gv[:,:,HW:-self.min_work_elements+HW])
+                candidate_value.append(gv[:,HW:-self.min_work_elements+HW])
             else:
                 # mem_size is smaller than total_work_mem_size, but at least HW
                 assert HW <= mem_size_in_this_group < total_work_mem_size
                 if mem_size_in_this_group > self.min_work_elements+HW:
                     # part of this object group still goes into LT
-                    candidate_value.append(gv[:,:,HW:-self.min_work_elements+HW])
+                    candidate_value.append(gv[:,HW:-self.min_work_elements+HW])
                 else:
                     # this object group cannot go to the LT at all
                     candidate_value.append(None)
@@ -242,7 +251,7 @@ class MemoryManager:
 
     def consolidation(self, candidate_key, candidate_shrinkage, candidate_selection, usage, candidate_value):
         # keys: 1*C*N
-        # values: num_objects*C*N
+        # values: num_objects*N*C
         N = candidate_key.shape[-1]
 
         # find the indices with max usage
@@ -250,7 +259,7 @@ class MemoryManager:
         prototype_indices = max_usage_indices.flatten()
 
         # Prototypes are invalid for out-of-bound groups
-        validity = [prototype_indices >= (N-gv.shape[2]) if gv is not None else None for gv in candidate_value]
+        validity = [prototype_indices >= (N-gv.shape[1]) if gv is not None else None for gv in candidate_value]
 
         prototype_key = candidate_key[:, :, prototype_indices]
         prototype_selection = candidate_selection[:, :, prototype_indices] if candidate_selection is not None else None
@@ -263,7 +272,7 @@ class MemoryManager:
         # convert similarity to affinity
         # need to do it group by group since the softmax normalization would be different
         affinity = [
-            do_softmax(similarity[:, -gv.shape[2]:, validity[gi]]) if gv is not None else None
+            do_softmax(similarity[:, -gv.shape[1]:, validity[gi]]) if gv is not None else None
             for gi, gv in enumerate(candidate_value)
         ]
 
@@ -279,6 +288,6 @@ class MemoryManager:
         ]
 
         # readout the shrinkage term
-        prototype_shrinkage = self._readout(affinity[0], candidate_shrinkage) if candidate_shrinkage is not None else None
+        prototype_shrinkage = self._readout(affinity[0], candidate_shrinkage.transpose(1, 2)) if candidate_shrinkage is not None else None
 
         return prototype_key, prototype_value, prototype_shrinkage
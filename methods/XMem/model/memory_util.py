@@ -1,6 +1,7 @@
 import math
 import numpy as np
 import torch
+import torch.nn.functional as F
 from typing import Optional
 
 
@@ -43,10 +44,7 @@ def do_softmax(similarity, top_k: Optional[int]=None, inplace=False, return_usag
     # similarity: B x N x [HW/P]
     # use inplace with care
     if top_k is not None:
-        values, indices = torch.topk(similarity, k=top_k, dim=1)
-
-        x_exp = values.exp_()
-        x_exp /= torch.sum(x_exp, dim=1, keepdim=True)
+        indices, x_exp = do_sparse_softmax(similarity, top_k)
         if inplace:
             similarity.zero_().scatter_(1, indices, x_exp) # B*N*HW
             affinity = similarity
@@ -64,6 +62,33 @@ def do_softmax(similarity, top_k: Optional[int]=None, inplace=False, return_usag
 
     return affinity
 
+def do_sparse_softmax(similarity, top_k: int, return_usage=False):
+    # top-k softmax without the dense affinity: indices and weights, B x top_k x [HW/P] each
+    values, indices = torch.topk(similarity, k=top_k, dim=1)
+
+    x_exp = values.exp_()
+    x_exp /= torch.sum(x_exp, dim=1, keepdim=True)
+
+    if return_usage:
+        usage = similarity.new_zeros(similarity.shape[:2]).scatter_add_(
+            1, indices.flatten(start_dim=1), x_exp.flatten(start_dim=1)) # B*N
+        return (indices, x_exp), usage
+
+    return indices, x_exp
+
+def sparse_readout(mv, indices, weights):
+    # readout with the top-k affinity, as a weighted sum of top_k value rows per query pixel
+    # mv: B x N x C - memory values, N-major
+    # indices, weights: (1 or B) x top_k x [HW/P]
+    # returns B x C x [HW/P]
+    B, N, C = mv.shape
+    top_k = indices.shape[1]
+    offsets = torch.arange(B, device=mv.device).view(B, 1, 1) * N
+    indices = (indices + offsets).transpose(1, 2).reshape(-1, top_k)
+    weights = weights.expand(B, -1, -1).transpose(1, 2).reshape(-1, top_k)
+    mem = F.embedding_bag(indices, mv.reshape(B*N, C), per_sample_weights=weights.to(mv.dtype), mode='sum')
+    return mem.view(B, -1, C).transpose(1, 2).contiguous()
+
 def get_affinity(mk, ms, qk, qe):
     # shorthand used in training with no top-k
     similarity = get_similarity(mk, ms, qk, qe)
@@ -0,0 +1,83 @@
+"""
+CPU benchmark of the top-k memory readout: dense scatter + matmul vs sparse gather
+Also checks that both paths give the same readout and usage
+
+python -m scripts.benchmark_sparse_readout
+"""
+import time
+import argparse
+
+import torch
+
+from model.memory_util import get_similarity, do_softmax, do_sparse_softmax, sparse_readout
+
+
+def topk_only(similarity, value, top_k):
+    # shared by both paths
+    return torch.topk(similarity, k=top_k, dim=1)
+
+
+def dense_path(similarity, value, top_k):
+    # value: num_objects*N*C as in the memory stores
+    affinity, usage = do_softmax(similarity, top_k=top_k, inplace=True, return_usage=True)
+    return value.transpose(1, 2) @ affinity, usage
+
+
+def sparse_path(similarity, value, top_k):
+    (indices, weights), usage = do_sparse_softmax(similarity, top_k, return_usage=True)
+    return sparse_readout(value, indices, weights), usage
+
+
+def timeit(func, similarity, value, top_k, repeat):
+    elapsed = 0
+    for _ in range(repeat):
+        sim = similarity.clone()
+        start = time.perf_counter()
+        out = func(sim, value, top_k)
+        elapsed += time.perf_counter() - start
+    return out, elapsed / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mem_size', nargs='+', type=int, default=[1000, 5000, 10000, 20000, 50000])
+    parser.add_argument('--size', nargs=2, type=int, default=[30, 54])
+    parser.add_argument('--key_dim', type=int, default=64)
+    parser.add_argument('--value_dim', type=int, default=512)
+    parser.add_argument('--num_objects', type=int, default=2)
+    parser.add_argument('--top_k', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    hw = args.size[0] * args.size[1]
+    print(f'{"N":>7} {"topk ms":>8} {"dense ms":>10} {"sparse ms":>10} {"dense aff MB":>13} '
+          f'{"sparse aff MB":>14} {"max abs err":>12}')
+    with torch.no_grad():
+        for n in args.mem_size:
+            mk = torch.randn(1, args.key_dim, n)
+            ms = torch.rand(1, 1, n) + 1
+            qk = torch.randn(1, args.key_dim, hw)
+            qe = torch.rand(1, args.key_dim, hw)
+            value = torch.randn(args.num_objects, n, args.value_dim)
+            similarity = get_similarity(mk, ms, qk, qe)
+
+            _, topk_ms = timeit(topk_only, similarity, value, args.top_k, args.repeat)
+            (ref, ref_usage), dense_ms = timeit(dense_path, similarity, value, args.top_k,
+                                                args.repeat)
+            (out, usage), sparse_ms = timeit(sparse_path, similarity, value, args.top_k,
+                                             args.repeat)
+
+            err = (ref - out).abs().max().item()
+            assert torch.allclose(ref, out, atol=1e-4, rtol=1e-4), 'sparse readout does not match'
+            assert torch.allclose(ref_usage, usage, atol=1e-4), 'sparse usage does not match'
+            dense_mb = n * hw * 4 / 1024**2
+            sparse_mb = args.top_k * hw * (8 + 4) / 1024**2
+            print(f'{n:>7} {topk_ms:>8.1f} {dense_ms:>10.1f} {sparse_ms:>10.1f} {dense_mb:>13.1f} '
+                  f'{sparse_mb:>14.2f} {err:>12.2e}')
+
+
+if __name__ == '__main__':
+    main()
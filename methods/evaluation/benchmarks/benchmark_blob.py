@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from scipy import ndimage
+
+from source.metrics import db_eval_blob_torch, db_eval_blob_sparse
+
+
+def fragmented_sequence(rng, num_frames, size, sigma, empty_ratio):
+    # Thresholded smooth noise gives many blobs per frame, the prediction
+    # drops and adds pixels so that components split and merge
+    noise = ndimage.gaussian_filter(rng.standard_normal((num_frames, size, size)), sigma=(0, sigma, sigma))
+    annotations = noise > noise.std()
+    segmentations = np.roll(annotations, 1, axis=2) ^ (rng.random(annotations.shape) < 0.002)
+    empty = rng.random(num_frames) < empty_ratio
+    annotations[empty[:len(empty) // 2].nonzero()[0]] = False
+    segmentations[len(empty) // 2 + empty[len(empty) // 2:].nonzero()[0]] = False
+    return annotations, segmentations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the blob (J_cc) metric")
+    parser.add_argument('--frames', nargs='+', type=int, default=[50, 200])
+    parser.add_argument('--size', type=int, default=240)
+    parser.add_argument('--sigma', type=float, default=2.)
+    parser.add_argument('--empty_ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'frames':>7} {'blobs/frame':>12} {'torch s':>8} {'sparse s':>9} {'speedup':>8} {'max abs err':>12}")
+    for num_frames in args.frames:
+        annotations, segmentations = fragmented_sequence(rng, num_frames, args.size, args.sigma, args.empty_ratio)
+        num_blobs = np.mean([ndimage.label(a, structure=np.ones((3, 3)))[1] for a in annotations])
+
+        start = time.perf_counter()
+        ref = np.array(db_eval_blob_torch(annotations, segmentations), dtype=np.float64)
+        torch_time = time.perf_counter() - start
+        start = time.perf_counter()
+        out = db_eval_blob_sparse(annotations, segmentations)
+        sparse_time = time.perf_counter() - start
+
+        err = np.abs(ref - out).max()
+        print(f"{num_frames:>7} {num_blobs:>12.1f} {torch_time:>8.2f} {sparse_time:>9.2f} "
+              f"{torch_time / sparse_time:>8.1f} {err:>12.2e}")
+        assert err < 1e-12, "sparse blob metric does not match db_eval_blob_torch"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from scipy import ndimage
+
+from source.metrics import db_eval_boundary_stack, f_measure
+
+
+def blob_sequence(rng, num_frames, height, width, empty_ratio):
+    # Smooth noise blobs, the prediction is shifted and noisy and some frames are empty
+    sigma = min(height, width) / 40
+    noise = ndimage.gaussian_filter(rng.standard_normal((num_frames, height // 4, width // 4)),
+                                    sigma=(0, sigma / 4, sigma / 4))
+    noise = noise.repeat(4, axis=1).repeat(4, axis=2)[:, :height, :width]
+    annotations = noise > noise.std()
+    segmentations = np.roll(annotations, 3, axis=2) ^ (rng.random(annotations.shape) < 0.001)
+    empty = rng.random(num_frames) < empty_ratio
+    annotations[empty[:len(empty) // 2].nonzero()[0]] = False
+    segmentations[len(empty) // 2 + empty[len(empty) // 2:].nonzero()[0]] = False
+    void_pixels = np.zeros_like(annotations)
+    void_pixels[:, :height // 10] = True
+    return annotations, segmentations, void_pixels
+
+
+def peak_memory(func):
+    # Peak of the numpy allocations while func runs, in MB
+    tracemalloc.start()
+    try:
+        out = func()
+        return out, tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the boundary F metric")
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--sizes', nargs='+', type=str, default=['480x854', '1080x1920'])
+    parser.add_argument('--empty_ratio', type=float, default=0.2)
+    parser.add_argument('--memory_frames', type=int, default=100)
+    parser.add_argument('--memory_size', type=str, default='1080x1920')
+    parser.add_argument('--chunk_size', type=int, default=32)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>10} {'void':>5} {'per-frame ms':>13} {'stack ms':>9} {'speedup':>8} {'max abs err':>12}")
+    for size in args.sizes:
+        height, width = map(int, size.split('x'))
+        annotations, segmentations, void_pixels = blob_sequence(rng, args.frames, height, width,
+                                                                args.empty_ratio)
+        for void in [None, void_pixels]:
+            start = time.perf_counter()
+            ref = np.array([
+                f_measure(segmentations[t], annotations[t], None if void is None else void[t])
+                for t in range(args.frames)
+            ])
+            ref_time = (time.perf_counter() - start) / args.frames * 1e3
+            start = time.perf_counter()
+            out = db_eval_boundary_stack(annotations, segmentations, void)
+            stack_time = (time.perf_counter() - start) / args.frames * 1e3
+
+            err = np.abs(ref - out).max()
+            print(f"{size:>10} {void is not None!s:>5} {ref_time:>13.2f} {stack_time:>9.2f} "
+                  f"{ref_time / stack_time:>8.1f} {err:>12.2e}")
+            assert err < 1e-12, "stacked boundary F does not match f_measure"
+
+    height, width = map(int, args.memory_size.split('x'))
+    annotations, segmentations, void_pixels = blob_sequence(rng, args.memory_frames, height, width,
+                                                            args.empty_ratio)
+    print(f"\n{args.memory_frames} frames of {args.memory_size}, scratch memory of the stack")
+    print(f"{'chunk':>10} {'stack ms':>9} {'peak MB':>8}")
+    results = []
+    for chunk_size in [args.memory_frames, args.chunk_size]:
+        start = time.perf_counter()
+        out, peak = peak_memory(lambda: db_eval_boundary_stack(annotations, segmentations, void_pixels,
+                                                               chunk_size=chunk_size))
+        stack_time = (time.perf_counter() - start) / args.memory_frames * 1e3
+        results.append(out)
+        print(f"{chunk_size:>10} {stack_time:>9.2f} {peak:>8.1f}")
+    assert np.array_equal(results[0], results[1]), "chunked boundary F differs per frame"
+
+
+if __name__ == '__main__':
+    main()
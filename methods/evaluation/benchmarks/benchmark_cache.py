@@ -0,0 +1,110 @@
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+import source.evaluation
+from source.evaluation import Evaluation
+from synthetic import make_synthetic_dataset
+from benchmark_workers import flatten
+
+
+def timed_evaluate(dataset_eval, results_path, cache_dir):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        metrics_res = dataset_eval.evaluate(results_path, cache_dir=cache_dir)
+    return flatten(metrics_res), time.perf_counter() - start
+
+
+def cache_mtimes(cache_dir):
+    return {name: os.stat(os.path.join(cache_dir, name)).st_mtime_ns for name in os.listdir(cache_dir)}
+
+
+def same_results(a, b):
+    return a.keys() == b.keys() and all(np.array_equal(a[k], b[k]) for k in a)
+
+
+def interrupted_evaluate(dataset_eval, results_path, cache_dir, done):
+    # Stops the serial run like a Ctrl-C once `done` sequences are evaluated
+    evaluate_sequence = source.evaluation._evaluate_sequence
+    calls = []
+
+    def interrupt_after(*args):
+        if len(calls) == done:
+            raise KeyboardInterrupt
+        calls.append(args)
+        return evaluate_sequence(*args)
+
+    source.evaluation._evaluate_sequence = interrupt_after
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            dataset_eval.evaluate(results_path, cache_dir=cache_dir)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.evaluation._evaluate_sequence = evaluate_sequence
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-sequence evaluation cache")
+    parser.add_argument('--seqs', type=int, default=16)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--size', type=int, default=240)
+    parser.add_argument('--objects', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        dataset_root, results_path = make_synthetic_dataset(
+            root, args.seqs, args.frames, args.size, args.objects)
+        cache_dir = os.path.join(root, 'cache')
+        dataset_eval = Evaluation(dataset_root=dataset_root, gt_set='val')
+
+        print(f"{'run':>24} {'wall s':>8} {'evaluated':>10}")
+        reference, elapsed = timed_evaluate(dataset_eval, results_path, None)
+        print(f"{'no cache':>24} {elapsed:>8.2f} {args.seqs:>10}")
+
+        res, elapsed = timed_evaluate(dataset_eval, results_path, cache_dir)
+        mtimes = cache_mtimes(cache_dir)
+        print(f"{'empty cache':>24} {elapsed:>8.2f} {len(mtimes):>10}")
+        assert same_results(res, reference), "results with the cache differ"
+
+        res, elapsed = timed_evaluate(dataset_eval, results_path, cache_dir)
+        evaluated = [name for name, mtime in cache_mtimes(cache_dir).items() if mtime != mtimes[name]]
+        print(f"{'unchanged':>24} {elapsed:>8.2f} {len(evaluated):>10}")
+        assert same_results(res, reference) and len(evaluated) == 0, "unchanged sequences were evaluated again"
+
+        # An interrupted run keeps the sequences it finished
+        interrupted_dir = os.path.join(root, 'interrupted_cache')
+        interrupted_evaluate(dataset_eval, results_path, interrupted_dir, args.seqs // 2)
+        mtimes = cache_mtimes(interrupted_dir)
+        res, elapsed = timed_evaluate(dataset_eval, results_path, interrupted_dir)
+        evaluated = [name for name in cache_mtimes(interrupted_dir) if name not in mtimes]
+        print(f"{'after an interruption':>24} {elapsed:>8.2f} {len(evaluated):>10}")
+        assert len(mtimes) == args.seqs // 2, f"{len(mtimes)} sequences cached before the interruption"
+        assert len(evaluated) == args.seqs - args.seqs // 2 and same_results(res, reference), \
+            "the resumed run evaluated cached sequences again or differs"
+
+        # Drop an object from one frame of one prediction
+        seq = sorted(os.listdir(results_path))[args.seqs // 2]
+        frame_path = os.path.join(results_path, seq, '00010.png')
+        mask = np.array(Image.open(frame_path))
+        Image.fromarray(np.where(mask == 1, 0, mask).astype(np.uint8)).save(frame_path)
+        mtimes = cache_mtimes(cache_dir)
+        res, elapsed = timed_evaluate(dataset_eval, results_path, cache_dir)
+        evaluated = [name for name, mtime in cache_mtimes(cache_dir).items() if mtime != mtimes[name]]
+        print(f"{'one sequence changed':>24} {elapsed:>8.2f} {len(evaluated):>10}")
+        assert evaluated == [f'{seq}.pkl'], f"expected only {seq} to be evaluated again, got {evaluated}"
+        reference, _ = timed_evaluate(dataset_eval, results_path, None)
+        assert same_results(res, reference), "cached results differ from a full evaluation"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import hashlib
+import argparse
+import resource
+import tempfile
+import multiprocessing as mp
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from source.dataset import Dataset
+from synthetic import make_synthetic_dataset
+
+
+def legacy_get_all_masks(dataset, sequence):
+    # Dense num_objects x T x H x W masks through a dense temporary, as get_all_masks used to do
+    masks, masks_id = dataset._get_all_elements(sequence, 'masks')
+    masks_void = np.zeros_like(masks)
+    for i in range(masks.shape[0]):
+        masks_void[i, ...] = masks[i, ...] == 255
+        masks[i, masks[i, ...] == 255] = 0
+    num_objects = int(np.max(masks[0, ...]))
+    tmp = np.ones((num_objects, *masks.shape), dtype=masks.dtype)
+    tmp = tmp * np.arange(1, num_objects + 1, dtype=tmp.dtype)[:, None, None, None]
+    masks = (tmp == masks[None, ...])
+    masks = masks > 0
+    return masks, masks_void, masks_id
+
+
+def run(dataset_root, legacy, queue):
+    start = time.perf_counter()
+    dataset = Dataset(root=dataset_root, subset='val')
+    sequence = next(dataset.get_sequences())
+    if legacy:
+        masks, _, _ = legacy_get_all_masks(dataset, sequence)
+    else:
+        masks, _, _ = dataset.get_all_masks(sequence, True)
+    # Same access pattern as the evaluation, one object at a time on the kept frames
+    masks = masks[:, 1:-1, :, :]
+    digests = [hashlib.sha1(np.packbits(masks[ii, ...]).tobytes()).hexdigest() for ii in range(masks.shape[0])]
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024., digests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the memory of Dataset.get_all_masks")
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--objects', type=int, default=20)
+    parser.add_argument('--size', type=int, default=160)
+    args = parser.parse_args()
+
+    ctx = mp.get_context('spawn')
+    with tempfile.TemporaryDirectory() as root:
+        # Written from another process, the peak RSS carries over to the processes started from this one
+        process = ctx.Process(target=make_synthetic_dataset, args=(root, 1, args.frames, args.size, args.objects))
+        process.start()
+        process.join()
+        dataset_root = os.path.join(root, 'dataset')
+        print(f"{'masks':>8} {'time s':>8} {'peak RSS MB':>12}")
+        digests = {}
+        for legacy in [True, False]:
+            queue = ctx.Queue()
+            process = ctx.Process(target=run, args=(dataset_root, legacy, queue))
+            process.start()
+            elapsed, peak_rss, digests[legacy] = queue.get()
+            process.join()
+            print(f"{'dense' if legacy else 'lazy':>8} {elapsed:>8.2f} {peak_rss:>12.1f}")
+        assert digests[True] == digests[False], "lazy object masks differ from the dense masks"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from source.evaluation import Evaluation
+from synthetic import make_synthetic_dataset
+
+
+def flatten(metrics_res):
+    return {(m, k): np.array(v if k != 'M_per_object' else list(v.items()), dtype=object)
+            for m, res in metrics_res.items() for k, v in res.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel sequence evaluation")
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--seqs', type=int, default=16)
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--size', type=int, default=240)
+    parser.add_argument('--objects', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        dataset_root, results_path = make_synthetic_dataset(
+            root, args.seqs, args.frames, args.size, args.objects)
+        dataset_eval = Evaluation(dataset_root=dataset_root, gt_set='val')
+
+        serial, serial_time = None, None
+        print(f"{'workers':>8} {'wall s':>8} {'speedup':>8} {'identical':>10}")
+        for workers in args.workers:
+            start = time.perf_counter()
+            metrics_res = dataset_eval.evaluate(results_path, workers=workers)
+            elapsed = time.perf_counter() - start
+            if serial is None:
+                serial, serial_time = flatten(metrics_res), elapsed
+            res = flatten(metrics_res)
+            identical = res.keys() == serial.keys() and all(
+                np.array_equal(res[k], serial[k]) for k in serial)
+            print(f"{workers:>8} {elapsed:>8.2f} {serial_time / elapsed:>8.2f} {str(identical):>10}")
+            assert identical, f"results with {workers} workers differ from the serial run"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+
+def _draw_objects(rng, num_objects, size, num_frames, jitter):
+    # Rectangles drifting across the frame, later objects are drawn on top
+    starts = rng.integers(0, size // 2, size=(num_objects, 2))
+    extents = rng.integers(size // 8, size // 3, size=(num_objects, 2))
+    speeds = rng.integers(-2, 3, size=(num_objects, 2))
+    masks = np.zeros((num_frames, size, size), dtype=np.uint8)
+    for t in range(num_frames):
+        for obj_idx in range(num_objects):
+            y, x = (starts[obj_idx] + speeds[obj_idx] * t +
+                    rng.integers(-jitter, jitter + 1, size=2)) % (size // 2)
+            h, w = extents[obj_idx]
+            masks[t, y:y + h, x:x + w] = obj_idx + 1
+    return masks
+
+
+def make_synthetic_dataset(root, num_seqs=8, num_frames=60, size=240,
+                           num_objects=3, subset='val', seed=0):
+    """
+    Write a VOST-like dataset and matching noisy predictions
+    :return: (dataset_root, results_path)
+    """
+    rng = np.random.default_rng(seed)
+    dataset_root = os.path.join(root, 'dataset')
+    results_path = os.path.join(root, 'results')
+    os.makedirs(os.path.join(dataset_root, 'ImageSets'), exist_ok=True)
+    sequences = [f'seq_{seq_idx:03d}' for seq_idx in range(num_seqs)]
+    with open(os.path.join(dataset_root, 'ImageSets', f'{subset}.txt'), 'w') as f:
+        f.write('\n'.join(sequences) + '\n')
+
+    for seq in sequences:
+        gt = _draw_objects(rng, num_objects, size, num_frames, jitter=0)
+        pred = np.where(rng.random(gt.shape) < 0.01, 0, gt)
+        pred = np.roll(pred, rng.integers(-3, 4), axis=2)
+        for path, masks in [(os.path.join(dataset_root, 'Annotations', seq), gt),
+                            (os.path.join(results_path, seq), pred)]:
+            os.makedirs(path, exist_ok=True)
+            for t, mask in enumerate(masks):
+                Image.fromarray(mask).save(os.path.join(path, f'{t:05d}.png'))
+    return dataset_root, results_path
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import os
 import sys
+import shutil
 from time import time
 import argparse
 
@@ -20,7 +21,8 @@ parser.add_argument('--results_path', type=str, help='Path to the folder contain
                     required=True)
 parser.add_argument('--week_num', type=int)
 parser.add_argument('--fps', type=int)
-parser.add_argument('--re', action='store_true')
+parser.add_argument('--re', action='store_true', help='Evaluate all the sequences again instead of using the cache')
+parser.add_argument('--workers', type=int, default=1, help='Number of processes evaluating sequences in parallel')
 args, _ = parser.parse_known_args()
 
 dataset_path_dict = {
@@ -40,44 +42,42 @@ csv_name_per_sequence = f'per-sequence_results-{args.set}.csv'
 
 print(f"Evaluating {args.results_path}")
 
-# Check if the method has been evaluated before, if so read the results, otherwise compute the results
+# Sequences evaluated before are read from the cache unless their results, annotations or metric parameters changed
 csv_name_global_path = os.path.join(args.results_path, csv_name_global)
 csv_name_per_sequence_path = os.path.join(args.results_path, csv_name_per_sequence)
-if os.path.exists(csv_name_global_path) and os.path.exists(csv_name_per_sequence_path) and not args.re:
-    print('Using precomputed results...')
-    table_g = pd.read_csv(csv_name_global_path)
-    table_seq = pd.read_csv(csv_name_per_sequence_path)
-else:
-    print(f'Evaluating sequences ...')
-    # Create dataset and evaluate
-    dataset_eval = Evaluation(dataset_root=args.dataset_path, gt_set=args.set, fps= args.fps)
-    metrics_res = dataset_eval.evaluate(args.results_path)
-    J = metrics_res['J']
-    J_last = None
-    if 'J_last' in metrics_res:
-        J_last = metrics_res['J_last']
-    if 'J_cc' in metrics_res:
-        J_cc =  metrics_res['J_cc']
+cache_dir = os.path.join(args.results_path, f'.eval_cache-{args.set}')
+if args.re:
+    shutil.rmtree(cache_dir, ignore_errors=True)
+print(f'Evaluating sequences ...')
+# Create dataset and evaluate
+dataset_eval = Evaluation(dataset_root=args.dataset_path, gt_set=args.set, fps= args.fps)
+metrics_res = dataset_eval.evaluate(args.results_path, workers=args.workers, cache_dir=cache_dir)
+J = metrics_res['J']
+J_last = None
+if 'J_last' in metrics_res:
+    J_last = metrics_res['J_last']
+if 'J_cc' in metrics_res:
+    J_cc =  metrics_res['J_cc']
 
-    # Generate dataframe for the general results
-    g_measures = ['J-Mean', 'J-Recall', 'J-Decay', 'J_last-Mean', 'J_last-Recall', 'J_last-Decay', "J_cc-Mean"]
-    g_res = np.array([np.mean(J["M"]), np.mean(J["R"]), np.mean(J["D"]), np.mean(J_last["M"]), np.mean(J_last["R"]), np.mean(J_last["D"]) , np.mean(J_cc['M'])])
-    g_res = np.reshape(g_res, [1, len(g_res)])
-    table_g = pd.DataFrame(data=g_res, columns=g_measures)
-    with open(csv_name_global_path, 'w') as f:
-        table_g.to_csv(f, index=False, float_format="%.6f")
-    print(f'Global results saved in {csv_name_global_path}')
+# Generate dataframe for the general results
+g_measures = ['J-Mean', 'J-Recall', 'J-Decay', 'J_last-Mean', 'J_last-Recall', 'J_last-Decay', "J_cc-Mean"]
+g_res = np.array([np.mean(J["M"]), np.mean(J["R"]), np.mean(J["D"]), np.mean(J_last["M"]), np.mean(J_last["R"]), np.mean(J_last["D"]) , np.mean(J_cc['M'])])
+g_res = np.reshape(g_res, [1, len(g_res)])
+table_g = pd.DataFrame(data=g_res, columns=g_measures)
+with open(csv_name_global_path, 'w') as f:
+    table_g.to_csv(f, index=False, float_format="%.6f")
+print(f'Global results saved in {csv_name_global_path}')
 
-    # Generate a dataframe for the per sequence results
-    seq_names = list(J['M_per_object'].keys())
-    seq_measures = ['Sequence', 'J-Mean', 'J_last-Mean', 'J_cc-Mean']
-    J_per_object = [J['M_per_object'][x] for x in seq_names]
-    J_last_per_object = [J_last['M_per_object'][x] for x in seq_names]
-    J_cc_per_object = [J_cc['M_per_object'][x] for x in seq_names  ]
-    table_seq = pd.DataFrame(data=list(zip(seq_names, J_per_object, J_last_per_object, J_cc_per_object)), columns=seq_measures)
-    with open(csv_name_per_sequence_path, 'w') as f:
-        table_seq.to_csv(f, index=False, float_format="%.6f")
-    print(f'Per-sequence results saved in {csv_name_per_sequence_path}')
+# Generate a dataframe for the per sequence results
+seq_names = list(J['M_per_object'].keys())
+seq_measures = ['Sequence', 'J-Mean', 'J_last-Mean', 'J_cc-Mean']
+J_per_object = [J['M_per_object'][x] for x in seq_names]
+J_last_per_object = [J_last['M_per_object'][x] for x in seq_names]
+J_cc_per_object = [J_cc['M_per_object'][x] for x in seq_names  ]
+table_seq = pd.DataFrame(data=list(zip(seq_names, J_per_object, J_last_per_object, J_cc_per_object)), columns=seq_measures)
+with open(csv_name_per_sequence_path, 'w') as f:
+    table_seq.to_csv(f, index=False, float_format="%.6f")
+print(f'Per-sequence results saved in {csv_name_per_sequence_path}')
 
 # Print the results
 sys.stdout.write(f"--------------------------- Global results for {args.set} ---------------------------\n")
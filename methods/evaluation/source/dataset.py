@@ -43,10 +43,11 @@ class Dataset(object):
                 raise FileNotFoundError(f'Annotations for sequence {seq} not found.')
             self.sequences[seq]['masks'] = masks
             images = np.sort(glob(os.path.join(self.img_path, seq, '*.jpg'))).tolist()
+            masks_set = set(masks)
             filtered_images = []
             for img in images:
                 ann = img.replace('jpg', 'png').replace('JPEGImages', 'Annotations')
-                if ann not in masks:
+                if ann not in masks_set:
                     print(ann)
                 else:
                     filtered_images.append(img)
@@ -79,7 +80,9 @@ class Dataset(object):
 
     def _get_all_elements(self, sequence, obj_type):
         obj = np.array(Image.open(self.sequences[sequence][obj_type][0]))
-        all_objs = np.zeros((len(self.sequences[sequence][obj_type]), *obj.shape), dtype=np.uint8)
+        # 16 bit label maps keep their ids
+        dtype = np.uint8 if obj.dtype == np.uint8 else np.uint16
+        all_objs = np.zeros((len(self.sequences[sequence][obj_type]), *obj.shape), dtype=dtype)
         obj_id = []
         for i, obj in enumerate(self.sequences[sequence][obj_type]):
             all_objs[i, ...] = np.array(Image.open(obj))
@@ -90,23 +93,60 @@ class Dataset(object):
         return self._get_all_elements(sequence, 'images')
 
     def get_all_masks(self, sequence, separate_objects_masks=False):
+        """
+        :return: (masks, masks_void, masks_id). masks is the T x H x W label map without the void
+                 label, or an ObjectMasks with the num_objects x T x H x W boolean masks of the
+                 objects in the first frame if separate_objects_masks is set.
+        """
         masks, masks_id = self._get_all_elements(sequence, 'masks')
-        masks_void = np.zeros_like(masks)
 
         # Separate void and object masks
-        for i in range(masks.shape[0]):
-            masks_void[i, ...] = masks[i, ...] == 255
-            masks[i, masks[i, ...] == 255] = 0
+        masks_void = masks == self.VOID_LABEL
+        masks[masks_void] = 0
 
         if separate_objects_masks:
             num_objects = int(np.max(masks[0, ...]))
-            tmp = np.ones((num_objects, *masks.shape), dtype=masks.dtype)
-            tmp = tmp * np.arange(1, num_objects + 1, dtype=tmp.dtype)[:, None, None, None]
-            masks = (tmp == masks[None, ...])
-            masks = masks > 0
+            masks = ObjectMasks(masks, np.arange(1, num_objects + 1))
         return masks, masks_void, masks_id
 
     def get_sequences(self):
         for seq in self.sequences:
             yield seq
 
+
+
+class ObjectMasks(object):
+    def __init__(self, labels, object_ids):
+        """
+        Boolean masks of several objects backed by a single label map, the masks of an object
+        are only computed when it is indexed.
+        :param labels: T x H x W label map.
+        :param object_ids: Label of each object, the first axis of the masks.
+        """
+        self.labels = labels
+        self.object_ids = np.asarray(object_ids)
+
+    @property
+    def shape(self):
+        return (len(self.object_ids), *self.labels.shape)
+
+    @property
+    def ndim(self):
+        return self.labels.ndim + 1
+
+    def __len__(self):
+        return len(self.object_ids)
+
+    def __getitem__(self, index):
+        index = index if isinstance(index, tuple) else (index,)
+        obj_index, frame_index = (slice(None), index) if index[0] is Ellipsis else (index[0], index[1:])
+        labels = self.labels[frame_index]
+        object_ids = self.object_ids[obj_index]
+        if object_ids.ndim == 0:
+            return labels == object_ids
+        # Slicing the frames or the objects keeps the masks lazy
+        return ObjectMasks(labels, object_ids)
+
+    def __array__(self, dtype=None, copy=None):
+        masks = self.labels[None] == self.object_ids.reshape(-1, *[1] * self.labels.ndim)
+        return masks if dtype is None else masks.astype(dtype)
@@ -1,4 +1,8 @@
+import os
 import sys
+import pickle
+import hashlib
+from glob import glob
 from tqdm import tqdm
 import warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
@@ -6,13 +10,13 @@ warnings.filterwarnings("ignore", category=RuntimeWarning)
 import numpy as np
 from source.dataset import Dataset
 from source.metrics import db_eval_boundary, db_eval_iou
-from  source.metrics import db_eval_blob_torch as db_eval_blob
+from source.metrics import db_eval_blob_sparse as db_eval_blob
 from source import utils
 from source.results import Results
 from scipy.optimize import linear_sum_assignment
 from math import floor
-import multiprocessing as mp
-from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import torch
 
 
 class Evaluation(object):
@@ -49,10 +53,16 @@ class Evaluation(object):
 
         return j_metrics_res , blob_metrics_res
 
-    def evaluate(self, res_path, metric=('J', 'J_last', "J_cc"), debug=False):
-        
+    def evaluate(self, res_path, metric=('J', 'J_last', "J_cc"), debug=False, workers=1, cache_dir=None):
+        """
+        Evaluate all the sequences of the set
+        :param res_path: Path to the folder containing the sequences folders with the results.
+        :param metric: Metrics to compute, any of 'J', 'J_last' and 'J_cc'.
+        :param workers: Number of worker processes, 1 evaluates the sequences in this process.
+        :param cache_dir: Folder keeping the results of each sequence with a hash of the results, the annotations
+                          and the metric parameters, only the sequences whose hash changed are evaluated again.
+        """
         metric = metric if isinstance(metric, tuple) or isinstance(metric, list) else [metric]
-        cnt = 0
 
         # Containers
         metrics_res = {}
@@ -60,105 +70,134 @@ class Evaluation(object):
             metrics_res['J'] = {"M": [], "R": [], "D": [], "M_per_object": {}}
         if 'J_last' in metric:
             metrics_res['J_last'] = {"M": [], "R": [], "D": [], "M_per_object": {}}
-
         if 'J_cc' in metric:
-            metrics_res["J_cc"] = {"M": [], "R": [], "D": [], "M_per_object": {}}
-
-        process_list = []
-        sema = mp.Semaphore(1)
-        manager = Manager()
-        metrics_res = manager.dict({
-            'J': manager.dict(
-                {
-                    "M": manager.list(),
-                    "R": manager.list(),
-                    "D": manager.list(),
-                    "M_per_object": manager.dict(),
-                }
-            ),
-            'J_last': manager.dict(
-                {
-                    "M": manager.list(),
-                    "R": manager.list(),
-                    "D": manager.list(),
-                    "M_per_object": manager.dict(),
-                }
-            ),
-            'J_cc': manager.dict(
-                {
-                    "M": manager.list(),
-                    "M_per_object": manager.dict(),
-                }    
-            )
-        })
+            metrics_res["J_cc"] = {"M": [], "M_per_object": {}}
+
         # Sweep all sequences
-        results = Results(root_dir=res_path)
-        for seq in tqdm(list(self.dataset.get_sequences())):
-        # sequences = list(results.get_sequences())
-        # for seq in tqdm(sequences):
-            def evaluate():
-                print(f"\n{seq}")
-                try:
-                    all_gt_masks, all_void_masks, all_masks_id = self.dataset.get_all_masks(seq, True)
-                    print(f"\n{seq} DONE 1")
-                    num_objects = all_gt_masks.shape[0]
-                    print(f"\n{seq} DONE 1.4")
-                    all_gt_masks = all_gt_masks[:, : :  self.compress_ratio]
-                    print(f"\n{seq} DONE 1.5")
-                    all_masks_id = all_masks_id[: : self.compress_ratio]
-                    print(f"\n{seq} DONE 1.6")
-                    all_gt_masks, all_masks_id = all_gt_masks[:, 1:-1, :, :], all_masks_id[1:-1]
-                    print(f"\n{seq} DONE 1.7")
-                    num_eval_frames = len(all_masks_id)
-                    print(f"\n{seq} DONE 1.8")
-                    last_quarter_ind = int(floor(num_eval_frames * 0.75))
-                    print(f"\n{seq} DONE 1.9")
-        
+        sequences = list(self.dataset.get_sequences())
+        seq_results = {}
+        stale_sequences = sequences
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            seq_keys = {seq: _sequence_key(self.dataset, res_path, seq, self.compress_ratio, metric)
+                        for seq in sequences}
+            for seq in sequences:
+                seq_res = _read_cache(cache_dir, seq, seq_keys[seq])
+                if seq_res is not None:
+                    seq_results[seq] = seq_res
+            stale_sequences = [seq for seq in sequences if seq not in seq_results]
+            print(f"Evaluating {len(stale_sequences)} of {len(sequences)} sequences, the others are cached")
 
-                    all_res_masks = results.read_masks(seq, all_masks_id)
-                    print(f"\n{seq} DONE 2")
-                    j_metrics_res, blob_metrics_res = self._evaluate_semisupervised(all_gt_masks, all_res_masks, None, metric)
-                    print(f"\n{seq} DONE 3")
-        
+        def store(seq, seq_res):
+            seq_results[seq] = seq_res
+            # Cached as soon as it is done, so that an interrupted run keeps it. Failed sequences are not cached
+            # so that they are tried again
+            if cache_dir is not None and seq_res is not None:
+                _write_cache(cache_dir, seq, seq_keys[seq], seq_res)
+
+        if workers <= 1:
+            for seq in tqdm(stale_sequences):
+                store(seq, _evaluate_sequence(self.dataset, res_path, seq, self.compress_ratio, metric))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                futures = {
+                    executor.submit(_evaluate_sequence, self.dataset, res_path, seq, self.compress_ratio, metric): seq
+                    for seq in stale_sequences
+                }
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    store(futures[future], future.result())
+
+        # Merge in the order of the set so that the results do not depend on the workers
+        for seq in sequences:
+            seq_res = seq_results[seq]
+            if seq_res is None:
+                continue
+            for ii in range(seq_res['num_objects']):
+                seq_name = f'{seq}_{ii+1}'
+                for m in ['J', 'J_last']:
+                    if m in metric:
+                        [JM, JR, JD] = seq_res[m][ii]
+                        metrics_res[m]["M"].append(JM)
+                        metrics_res[m]["R"].append(JR)
+                        metrics_res[m]["D"].append(JD)
+                        metrics_res[m]["M_per_object"][seq_name] = JM
+                if 'J_cc' in metric:
+                    metrics_res['J_cc']["M"].append(seq_res['J_cc'][ii])
+                    metrics_res['J_cc']["M_per_object"][seq_name] = seq_res['J_cc'][ii]
+
+            # Show progress
+            if debug:
+                sys.stdout.write(seq + '\n')
+                sys.stdout.flush()
 
-                    for ii in range(all_gt_masks.shape[0]):
-                        seq_name = f'{seq}_{ii+1}'
-                        if 'J' in metric:
-                            [JM, JR, JD] = utils.db_statistics(j_metrics_res[ii])
-                            metrics_res['J']["M"].append(JM)
-                            metrics_res['J']["R"].append(JR)
-                            metrics_res['J']["D"].append(JD)
-                            metrics_res['J']["M_per_object"][seq_name] = JM
-                        if 'J_last' in metric:
-                            [JM, JR, JD] = utils.db_statistics(j_metrics_res[ii][last_quarter_ind:])
-                            metrics_res['J_last']["M"].append(JM)
-                            metrics_res['J_last']["R"].append(JR)
-                            metrics_res['J_last']["D"].append(JD)
-                            metrics_res['J_last']["M_per_object"][seq_name] = JM
-                        if 'J_cc' in metric:
-                            metrics_res['J_cc']["M"].append(np.mean(blob_metrics_res[ii]))
-                            metrics_res['J_cc']["M_per_object"][seq_name] = np.mean(blob_metrics_res[ii])
-
-                    print(f"\n{seq} DONE 4")
-
-                    # Show progress
-                    if debug:
-                        sys.stdout.write(seq + '\n')
-                        sys.stdout.flush()
-                except Exception as e:
-                    print(f"Error in evaluate: {e}")
-                finally:
-                    sema.release()
-                    print(f"{seq} complete ! ")
-                    
-            sema.acquire()
-            p = mp.Process(target=evaluate, args=())
-            p.start()
-            process_list.append(p)
-        for process in tqdm(process_list):
-            process.join()
-            cnt += 1
-            print("waitting:" , cnt)
-            
         return metrics_res
 
+
+def _init_worker():
+    # The sequences already run in parallel, avoid oversubscribing the cores
+    torch.set_num_threads(1)
+
+
+def _sequence_key(dataset, res_path, seq, compress_ratio, metric):
+    """
+    Hash of the content of the annotation and result PNG files of a sequence and of the metric parameters
+    """
+    key = hashlib.sha1(repr((compress_ratio, sorted(metric))).encode())
+    for paths in [dataset.sequences[seq]['masks'], sorted(glob(os.path.join(res_path, seq, '*.png')))]:
+        key.update(str(len(paths)).encode())
+        for path in paths:
+            key.update(os.path.basename(path).encode())
+            with open(path, 'rb') as f:
+                key.update(f.read())
+    return key.hexdigest()
+
+
+def _read_cache(cache_dir, seq, key):
+    cache_path = os.path.join(cache_dir, f'{seq}.pkl')
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path, 'rb') as f:
+        cached = pickle.load(f)
+    return cached['result'] if cached['key'] == key else None
+
+
+def _write_cache(cache_dir, seq, key, seq_res):
+    # Written next to the cache file and renamed, an interrupted run does not leave a truncated file
+    cache_path = os.path.join(cache_dir, f'{seq}.pkl')
+    with open(cache_path + '.tmp', 'wb') as f:
+        pickle.dump({'key': key, 'result': seq_res}, f)
+    os.replace(cache_path + '.tmp', cache_path)
+
+
+def _evaluate_sequence(dataset, res_path, seq, compress_ratio, metric):
+    """
+    Evaluate a single sequence, runs in the worker processes
+    :return: Dict with [num_objects, 3] (mean, recall, decay) arrays for J and J_last and a [num_objects] array
+             for J_cc, or None if the sequence could not be evaluated.
+    """
+    try:
+        all_gt_masks, _, all_masks_id = dataset.get_all_masks(seq, True)
+        all_gt_masks = all_gt_masks[:, ::compress_ratio]
+        all_masks_id = all_masks_id[::compress_ratio]
+        all_gt_masks, all_masks_id = all_gt_masks[:, 1:-1, :, :], all_masks_id[1:-1]
+        num_eval_frames = len(all_masks_id)
+        last_quarter_ind = int(floor(num_eval_frames * 0.75))
+
+        all_res_masks = Results(root_dir=res_path).read_masks(seq, all_masks_id)
+        j_metrics_res, blob_metrics_res = Evaluation._evaluate_semisupervised(all_gt_masks, all_res_masks, None,
+                                                                              metric)
+
+        num_objects = all_gt_masks.shape[0]
+        seq_res = {'num_objects': num_objects}
+        if 'J' in metric:
+            seq_res['J'] = np.array([utils.db_statistics(j_metrics_res[ii]) for ii in range(num_objects)])
+        if 'J_last' in metric:
+            seq_res['J_last'] = np.array([utils.db_statistics(j_metrics_res[ii][last_quarter_ind:])
+                                          for ii in range(num_objects)])
+        if 'J_cc' in metric:
+            seq_res['J_cc'] = np.array([np.mean(blob_metrics_res[ii]) for ii in range(num_objects)])
+        return seq_res
+    # Results.read_masks exits on missing frames, keep the other sequences going
+    except (Exception, SystemExit) as e:
+        print(f"Error in evaluate {seq}: {e}")
+        return None
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Composes a synthetic sequence with merge_mask_images and reports frames per second
+and peak RSS, next to the old approach (per-channel blend, all frames kept in a list
+and encoded at the end). The blend of both is checked to be identical.
+
+python tool/benchmark_merge_png2mp4.py --frames 5000
+"""
+import os
+import sys
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import cv2
+import imageio
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from merge_png2mp4 import merge_mask_images, blend_mask
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def make_sequence(root, num_frames, size, num_objects, seed=0):
+    rng = np.random.default_rng(seed)
+    image_folder = os.path.join(root, 'JPEGImages')
+    mask_folder = os.path.join(root, 'Annotations')
+    os.makedirs(image_folder)
+    os.makedirs(mask_folder)
+
+    width, height = size
+    palette = rng.integers(0, 256, size=(256, 3), dtype=np.uint8)
+    palette[0] = 0
+    # one moving stripe per object
+    yy, xx = np.mgrid[:height, :width]
+    base = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    for idx in range(num_frames):
+        name = '{:05d}'.format(idx)
+        image = np.roll(base, idx, axis=1)
+        cv2.imwrite(os.path.join(image_folder, name + '.jpg'), image)
+        mask = np.zeros((height, width), dtype=np.uint8)
+        for obj in range(1, num_objects + 1):
+            start = (idx * obj + obj * width // (num_objects + 1)) % width
+            mask[(xx - start) % width < width // (2 * num_objects)] = obj
+        mask = Image.fromarray(mask, mode='P')
+        mask.putpalette(palette.flatten().tolist())
+        mask.save(os.path.join(mask_folder, name + '.png'))
+    return image_folder, mask_folder
+
+
+def legacy_blend(orig_path, mask_path, alpha):
+    orig_image = cv2.imread(orig_path)
+    mask_image = cv2.imread(mask_path, cv2.IMREAD_UNCHANGED)
+    if mask_image.shape[2] == 3:
+        mask_image = cv2.cvtColor(mask_image, cv2.COLOR_BGR2BGRA)
+    mask_image[:, :, 3] = (mask_image[:, :, 3] * alpha).astype(mask_image.dtype)
+    composite_image = orig_image.copy()
+    for c in range(0, 3):
+        composite_image[:, :, c] = mask_image[:, :, 3] / 255.0 * mask_image[:, :, c] + \
+                                (1.0 - mask_image[:, :, 3] / 255.0) * composite_image[:, :, c]
+    return composite_image
+
+
+def legacy_merge(image_folder, mask_folder, output_video, num_frames, fps=10, alpha=0.5):
+    names = sorted(os.listdir(mask_folder))[:num_frames]
+    composite_images = [
+        legacy_blend(os.path.join(image_folder, name[:-4] + '.jpg'), os.path.join(mask_folder, name), alpha)
+        for name in names
+    ]
+    # moviepy.ImageSequenceClip keeps the converted frames as well
+    frames = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in composite_images]
+    writer = imageio.get_writer(output_video, fps=fps, codec='libx264', macro_block_size=2)
+    for frame in frames:
+        writer.append_data(frame)
+    writer.close()
+
+
+def run_case(path, image_folder, mask_folder, output_video, num_frames, result_queue):
+    cv2.setNumThreads(1)
+    start = time.perf_counter()
+    if path == 'stream':
+        merge_mask_images(image_folder, mask_folder, output_video)
+    else:
+        legacy_merge(image_folder, mask_folder, output_video, num_frames)
+    elapsed = time.perf_counter() - start
+    result_queue.put({'fps': num_frames / elapsed, 'peak_rss_mb': _peak_rss_mb()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark merge_mask_images on a synthetic sequence')
+    parser.add_argument('--frames', type=int, default=5000)
+    parser.add_argument('--legacy_frames', type=int, default=1000,
+                        help='Frames for the old approach, which keeps all of them in memory')
+    parser.add_argument('--size', nargs=2, type=int, default=[480, 270])
+    parser.add_argument('--num_objects', type=int, default=3)
+    parser.add_argument('--check_frames', type=int, default=50)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        image_folder, mask_folder = make_sequence(root, args.frames, args.size, args.num_objects)
+
+        lut_cache = {}
+        blend_time = legacy_time = 0
+        for name in sorted(os.listdir(mask_folder))[:args.check_frames]:
+            orig_path = os.path.join(image_folder, name[:-4] + '.jpg')
+            mask_path = os.path.join(mask_folder, name)
+            start = time.perf_counter()
+            out = blend_mask(cv2.imread(orig_path), mask_path, 0.5, lut_cache)
+            blend_time += time.perf_counter() - start
+            start = time.perf_counter()
+            ref = legacy_blend(orig_path, mask_path, 0.5)
+            legacy_time += time.perf_counter() - start
+            assert np.array_equal(out, ref), 'blend does not match'
+        print('read + blend ms/frame: legacy {:.2f}, lut {:.2f}'.format(
+            legacy_time / args.check_frames * 1e3, blend_time / args.check_frames * 1e3))
+
+        ctx = mp.get_context('spawn')
+        print('{:>8} {:>7} {:>8} {:>12}'.format('path', 'frames', 'FPS', 'peak RSS MB'))
+        for path, num_frames in [('legacy', args.legacy_frames), ('stream', args.frames)]:
+            if num_frames <= 0:
+                continue
+            result_queue = ctx.Queue()
+            # A fresh process per case keeps the peak RSS numbers apart.
+            proc = ctx.Process(target=run_case,
+                               args=(path, image_folder, mask_folder, os.path.join(root, path + '.mp4'),
+                                     num_frames, result_queue))
+            proc.start()
+            result = result_queue.get()
+            proc.join()
+            print('{:>8} {:>7} {:>8.1f} {:>12.1f}'.format(path, num_frames, result['fps'], result['peak_rss_mb']))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
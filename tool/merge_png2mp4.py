@@ -3,20 +3,75 @@
 
 import os
 import cv2
+import imageio
 import numpy as np
-from moviepy.editor import ImageSequenceClip
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
 from tqdm  import tqdm
 
 
-   
-def merge_mask_images(original_image_folder: str, mask_image_folder: str, output_video: str) -> None:
+def build_blend_lut(palette: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    Builds the alpha blending table of a mask palette.
+
+    Args:
+        palette (np.ndarray): [num_colors, 3] uint8 palette, in the channel order of the images.
+        alpha (float): Opacity of the mask (0 to 1).
+
+    Returns:
+        np.ndarray: Flat uint8 table, entry (color * 3 + channel) * 256 + value is the blended value.
+    """
+    # same arithmetic as blending a cv2 BGRA mask: alpha is stored as uint8 first
+    mask_alpha = int(255 * alpha) / 255.0
+    values = np.arange(256, dtype=np.float64)[None, None, :]
+    lut = mask_alpha * palette.astype(np.float64)[:, :, None] + (1.0 - mask_alpha) * values
+    return lut.astype(np.uint8).reshape(-1)
+
+
+def blend_mask(orig_image: np.ndarray, mask_path: str, alpha: float, lut_cache: dict) -> np.ndarray:
+    """
+    Blends one mask onto a BGR image.
+
+    Palette masks go through a per-palette lookup table, other masks through a vectorized
+    per-pixel blend with their own alpha channel.
+    """
+    mask = Image.open(mask_path)
+    if mask.mode == 'P' and 'transparency' not in mask.info:
+        palette = mask.getpalette()
+        key = tuple(palette)
+        if key not in lut_cache:
+            # PIL palettes are RGB, the images are BGR
+            palette = np.array(palette, dtype=np.uint8).reshape(-1, 3)[:, ::-1]
+            lut_cache[key] = build_blend_lut(palette, alpha)
+        index = np.array(mask).astype(np.int32) * 768
+        index = index[:, :, None] + np.array([0, 256, 512], dtype=np.int32) + orig_image
+        return np.take(lut_cache[key], index)
+
+    mask_image = cv2.imread(mask_path, cv2.IMREAD_UNCHANGED)
+    # 确保mask图像是四通道（包括透明度通道）
+    if mask_image.shape[2] == 3:
+        mask_image = cv2.cvtColor(mask_image, cv2.COLOR_BGR2BGRA)
+    # 将mask图像的alpha通道应用透明度
+    mask_alpha = (mask_image[:, :, 3:] * alpha).astype(mask_image.dtype) / 255.0
+    composite_image = mask_alpha * mask_image[:, :, :3] + (1.0 - mask_alpha) * orig_image
+    return composite_image.astype(np.uint8)
+
+
+def merge_mask_images(original_image_folder: str, mask_image_folder: str, output_video: str,
+                      fps: int = 10, alpha: float = 0.5, show_progress: bool = False) -> None:
     """
     Merges original images with mask images and creates a video.
 
+    Frames are composed one at a time and streamed into the ffmpeg pipe of the writer,
+    so the memory use does not grow with the video length.
+
     Args:
         original_image_folder (str): Path to the folder containing original images.
         mask_image_folder (str): Path to the folder containing mask images.
         output_video (str): Path to the output video file.
+        fps (int): Frame rate of the video.
+        alpha (float): Opacity of the masks (0 to 1).
+        show_progress (bool): Show a per-frame progress bar.
 
     Raises:
         ValueError: If the number of original images and mask images is not the same.
@@ -55,43 +110,26 @@ def merge_mask_images(original_image_folder: str, mask_image_folder: str, output
     if len(original_images) != len(mask_images):
         raise ValueError("原图和mask图片数量不一致")
 
-    # 设置视频帧率（每秒显示的图片数量）
-    fps = 10  # 你可以根据需要调整这个值
-
-    # 设置透明度
-    alpha = 0.5  # 透明度值（0到1之间）
-
-    # 创建一个列表来存储合成后的图片
-    composite_images = []
-
-    # 遍历每对原图和mask
-    for orig_path, mask_path in zip(original_images, mask_images):
-        # 读取原图和mask图像
-        orig_image = cv2.imread(orig_path)
-        mask_image = cv2.imread(mask_path, cv2.IMREAD_UNCHANGED)
-
-        # 确保mask图像是四通道（包括透明度通道）
-        if mask_image.shape[2] == 3:
-            mask_image = cv2.cvtColor(mask_image, cv2.COLOR_BGR2BGRA)
-
-        #
-        # 将mask图像的alpha通道应用透明度
-        mask_image[:, :, 3] = (mask_image[:, :, 3] * alpha).astype(mask_image.dtype)
-
-        # 将mask图像叠加到原图上
-        composite_image = orig_image.copy()
-        for c in range(0, 3):
-            composite_image[:, :, c] = mask_image[:, :, 3] / 255.0 * mask_image[:, :, c] + \
-                                    (1.0 - mask_image[:, :, 3] / 255.0) * composite_image[:, :, c]
-
-        # 添加到合成图片列表
-        composite_images.append(composite_image)
-
-    # 使用moviepy将合成后的图片生成视频
-    clip = ImageSequenceClip([cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in composite_images], fps=fps)
-    clip.write_videofile(output_video, codec='libx264')
-
-def merge_all_mask_video(masks_folder, images_folders, exp_folder):
+    # 遍历每对原图和mask，合成后直接写入视频
+    lut_cache = {}
+    writer = imageio.get_writer(output_video, fps=fps, codec='libx264', macro_block_size=2)
+    try:
+        pairs = zip(original_images, mask_images)
+        if show_progress:
+            pairs = tqdm(pairs, total=len(mask_images))
+        for orig_path, mask_path in pairs:
+            orig_image = cv2.imread(orig_path)
+            composite_image = blend_mask(orig_image, mask_path, alpha, lut_cache)
+            writer.append_data(cv2.cvtColor(composite_image, cv2.COLOR_BGR2RGB))
+    finally:
+        writer.close()
+
+def _merge_one_video(args):
+    mask_folder, image_folder, output_video = args
+    merge_mask_images(original_image_folder=image_folder, mask_image_folder=mask_folder, output_video=output_video)
+    return output_video
+
+def merge_all_mask_video(masks_folder, images_folders, exp_folder, workers=1):
     """
     Merges mask images with original images from multiple folders and creates videos.
 
@@ -99,6 +137,7 @@ def merge_all_mask_video(masks_folder, images_folders, exp_folder):
         masks_folder (str): Path to the folder containing mask image folders.
         images_folders (str): Path to the folder containing original image folders.
         exp_folder (str): Path to the folder where the output videos will be saved.
+        workers (int): Number of processes composing videos in parallel, one video each.
 
     Returns:
         None
@@ -116,9 +155,10 @@ def merge_all_mask_video(masks_folder, images_folders, exp_folder):
     # cnt = 0
 
     # 遍历每对mask文件夹和images文件夹
-    for mask_folder, image_folder in tqdm(zip(mask_folders, image_folders), desc="Merge mask and image"):
+    jobs = []
+    for mask_folder, image_folder in zip(mask_folders, image_folders):
         mask_folder = os.path.join( masks_folder, mask_folder)
-        image_folder = os.path.join(images_folder, image_folder)
+        image_folder = os.path.join(images_folders, image_folder)
         # 获取文件夹名称
         folder_name = os.path.basename(mask_folder)
         # 设置输出视频文件名
@@ -127,10 +167,16 @@ def merge_all_mask_video(masks_folder, images_folders, exp_folder):
         if os.path.exists(output_video):
             print(output_video , "exists")
             continue
-        # cnt += 1
-        # print(cnt)
-        # 调用merge_mask_images方法，将对应文件夹里的mask和images合并成视频
-        merge_mask_images(original_image_folder=image_folder, mask_image_folder=mask_folder, output_video=output_video)
+        jobs.append((mask_folder, image_folder, output_video))
+
+    # 调用merge_mask_images方法，将对应文件夹里的mask和images合并成视频
+    if workers <= 1:
+        for job in tqdm(jobs, desc="Merge mask and image"):
+            _merge_one_video(job)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for _ in tqdm(executor.map(_merge_one_video, jobs), total=len(jobs), desc="Merge mask and image"):
+                pass
 
 if __name__ == "__main__":
     # 设置文件夹路径
@@ -148,6 +194,7 @@ if __name__ == "__main__":
     parser.add_argument('--images_folder', type=str, default= "/home/lijiaxin/Deform_VOS/DeformVOS/data/VOST/JPEGImages",help='Path to the folder containing original image folders')
     parser.add_argument('--masks_folder', type=str,default="/home/lijiaxin/Deform_VOS/DeformVOS/exp/Cutie_base1080p/Annotations" , help='Path to the folder containing mask image folders')
     parser.add_argument('--output_exp', type=str, default="/home/lijiaxin/Deform_VOS/DeformVOS/exp/Cutie_base1080p_merge_video", help='Path to the folder where the output videos will be saved')
+    parser.add_argument('--workers', type=int, default=1, help='Number of videos composed in parallel')
 
     args = parser.parse_args()
 
@@ -155,4 +202,4 @@ if __name__ == "__main__":
     masks_folder = args.masks_folder
     output_exp = args.output_exp
 
-    merge_all_mask_video(masks_folder, images_folder, output_exp)
\ No newline at end of file
+    merge_all_mask_video(masks_folder, images_folder, output_exp, workers=args.workers)
\ No newline at end of file